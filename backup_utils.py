@@ -1,38 +1,402 @@
+# backup_utils.py
+# Sauvegardes de la base SQLite pendant que l'application tourne :
+# copie par l'API de sauvegarde en ligne de SQLite, par paquets de pages
+# (en WAL, depuis un instantané figé : les écritures ne sont jamais
+# bloquées ; sinon elles passent entre deux paquets), contrôle d'intégrité,
+# compression gzip et rétention horaire / journalière / mensuelle.
+# La restauration vérifie la sauvegarde avant de la recopier en une seule
+# transaction dans la base vivante.
+# Usage : python backup_utils.py [backup|list|verify [fichier]|restore [fichier]|prune]
+#                                [--db supermarket.db] [--dir backups] [--no-gzip]
+
+import gzip
+import json
 import os
+import re
 import shutil
+import sqlite3
+import sys
+import time
 from datetime import datetime
 
 # Dossier des sauvegardes
 BACKUP_DIR = "backups"
 DB_FILE = "supermarket.db"
 
-# Crée une sauvegarde de la base de données
-def create_backup():
-    if not os.path.exists(DB_FILE):
-        return False
+PAGES_PER_STEP = 256          # pages copiées par étape (1 Mo en pages de 4 Ko)
+STEP_PAUSE = 0.005            # pause entre deux étapes, laissée aux écritures (s)
+MAX_RESTARTS = 5              # au-delà, copie en une seule étape
+BUSY_TIMEOUT = 30             # attente max d'un verrou (s)
+
+# Nombre de sauvegardes gardées par période (la plus récente de chaque période)
+RETENTION = {"hourly": 24, "daily": 14, "monthly": 12}
+_PERIODS = {"hourly": "%Y%m%d%H", "daily": "%Y%m%d", "monthly": "%Y%m"}
+
+HISTORY_FILE = "history.jsonl"
+_NAME = re.compile(r"^backup_(\d{8}_\d{6})(_\d+)?\.db(\.gz)?$")
+
+
+class _Restarted(Exception):
+    pass
+
+
+# --- Fichiers ---
+
+def list_backups(backup_dir=BACKUP_DIR):
+    """Sauvegardes du dossier, de la plus récente à la plus ancienne : [(date, chemin)]."""
+    if not os.path.isdir(backup_dir):
+        return []
+    found = []
+    for name in os.listdir(backup_dir):
+        match = _NAME.match(name)
+        if match:
+            # La date vient du nom du fichier, pas de son ctime (faussé par une copie)
+            found.append((datetime.strptime(match.group(1), "%Y%m%d_%H%M%S"), os.path.join(backup_dir, name)))
+    return sorted(found, reverse=True)
+
+
+def _remove(path):
+    # Avec les fichiers -wal / -shm qu'une connexion SQLite a pu laisser à côté
+    for name in (path, path + "-wal", path + "-shm"):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+def _rollback_journal(db_path):
+    """
+    Repasse une copie en mode journal DELETE : une base copiée depuis une
+    base en WAL l'est aussi, et l'ouvrir crée des fichiers -wal / -shm.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        conn.close()
+
+
+def _gunzip(path, target):
+    with gzip.open(path, "rb") as src, open(target, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+
+def integrity_check(db_path):
+    """Résultat de PRAGMA integrity_check sur un fichier SQLite ("ok" si sain)."""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("PRAGMA integrity_check").fetchall()
+        if not conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0]:
+            return "base vide"
+    except sqlite3.DatabaseError as e:
+        return str(e)
+    finally:
+        conn.close()
+    return "; ".join(row[0] for row in rows[:5])
+
+
+def verify_backup(path):
+    """Décompresse si besoin puis contrôle l'intégrité : "ok" ou le message d'erreur."""
+    if not path.endswith(".gz"):
+        try:
+            return integrity_check(path)
+        finally:
+            # Une ancienne sauvegarde encore en WAL : fichiers créés par la lecture
+            for name in (path + "-wal", path + "-shm"):
+                if os.path.exists(name):
+                    os.remove(name)
+    plain = path[:-3] + ".verify"
+    try:
+        _gunzip(path, plain)
+        _rollback_journal(plain)
+        return integrity_check(plain)
+    except (OSError, EOFError, sqlite3.DatabaseError) as e:
+        # CRC gzip faux, fichier tronqué ou qui n'est pas une base
+        return str(e)
+    finally:
+        _remove(plain)
+
+
+# --- Sauvegarde ---
+
+def _online_copy(source, target, pages=PAGES_PER_STEP):
+    """Copie `source` vers `target` ; retourne (pages, redémarrages)."""
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True, timeout=BUSY_TIMEOUT, isolation_level=None)
+    dst = sqlite3.connect(target)
+    state = {"remaining": None, "total": 0, "restarts": 0}
+    wal = src.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    if wal:
+        # En WAL, une transaction de lecture fige l'instantané copié sans gêner
+        # les écritures : la copie ne redémarre jamais
+        src.execute("BEGIN")
+        src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+
+    def progress(status, remaining, total):
+        # Hors WAL, une écriture d'une autre connexion fait repartir la copie du début
+        if state["remaining"] is not None and remaining > state["remaining"]:
+            state["restarts"] += 1
+            if state["restarts"] > MAX_RESTARTS:
+                raise _Restarted()
+        state["remaining"], state["total"] = remaining, total
+        if remaining:
+            time.sleep(STEP_PAUSE)
+
+    try:
+        src.backup(dst, pages=pages, progress=progress)
+        dst.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        if wal:
+            src.execute("COMMIT")
+        dst.close()
+        src.close()
+    return state["total"], state["restarts"]
+
+
+def _log(backup_dir, report):
+    with open(os.path.join(backup_dir, HISTORY_FILE), "a", encoding="utf-8") as f:
+        f.write(json.dumps(report) + "\n")
+
 
-    if not os.path.exists(BACKUP_DIR):
-        os.makedirs(BACKUP_DIR)
+def history(backup_dir=BACKUP_DIR, limit=50):
+    """Derniers rapports de sauvegarde (du plus ancien au plus récent)."""
+    path = os.path.join(backup_dir, HISTORY_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f.readlines()[-limit:] if line.strip()]
 
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_filename = f"backup_{timestamp}.db"
-    backup_path = os.path.join(BACKUP_DIR, backup_filename)
 
-    shutil.copy2(DB_FILE, backup_path)
-    return True
+def create_backup(db_file=DB_FILE, backup_dir=BACKUP_DIR, compress=True, prune=True):
+    """
+    Sauvegarde `db_file` sans bloquer les écritures et retourne un rapport :
+    path, pages, restarts, db_bytes, bytes, seconds. None si la base n'existe pas.
+    Lève ValueError si la copie ne passe pas le contrôle d'intégrité.
+    """
+    if not os.path.exists(db_file):
+        return None
+    os.makedirs(backup_dir, exist_ok=True)
 
-# Restaure la dernière sauvegarde disponible
+    started = time.perf_counter()
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    name, n = f"backup_{stamp}.db", 0
+    # Deux sauvegardes dans la même seconde (ex. avant une restauration)
+    while any(os.path.exists(os.path.join(backup_dir, name + ext)) for ext in ("", ".gz")):
+        n += 1
+        name = f"backup_{stamp}_{n}.db"
+    path = os.path.join(backup_dir, name + (".gz" if compress else ""))
+    copy = os.path.join(backup_dir, name + ".tmp")
+    try:
+        try:
+            pages, restarts = _online_copy(db_file, copy)
+        except _Restarted:
+            # Écritures trop fréquentes (mode rollback) : une seule étape, sous verrou de lecture
+            pages, restarts = _online_copy(db_file, copy, pages=-1)
+            restarts += MAX_RESTARTS + 1
+        copy_seconds = time.perf_counter() - started
+
+        check = integrity_check(copy)
+        if check != "ok":
+            raise ValueError(f"Sauvegarde corrompue : {check}")
+
+        if compress:
+            packed = path + ".tmp"
+            with open(copy, "rb") as src, gzip.open(packed, "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.replace(packed, path)
+        else:
+            os.replace(copy, path)
+    finally:
+        _remove(copy)
+        _remove(path + ".tmp")
+
+    report = {
+        "path": path,
+        "pages": pages,
+        "restarts": restarts,
+        "db_bytes": os.path.getsize(db_file),
+        "bytes": os.path.getsize(path),
+        "copy_seconds": round(copy_seconds, 3),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    _log(backup_dir, report)
+    if prune:
+        report["pruned"] = prune_backups(backup_dir)
+    return report
+
+
+# --- Rétention ---
+
+def prune_backups(backup_dir=BACKUP_DIR, retention=None):
+    """
+    Garde la plus récente sauvegarde de chacune des dernières heures, journées
+    et mois (RETENTION) et supprime les autres. Retourne les chemins supprimés.
+    """
+    retention = retention or RETENTION
+    backups = list_backups(backup_dir)
+    keep = {path for _, path in backups[:1]}
+    for period, count in retention.items():
+        seen = set()
+        for when, path in backups:
+            bucket = when.strftime(_PERIODS[period])
+            if bucket not in seen and len(seen) < count:
+                seen.add(bucket)
+                keep.add(path)
+
+    removed = [path for _, path in backups if path not in keep]
+    for path in removed:
+        _remove(path)
+    # Fichiers -wal / -shm orphelins (laissés par d'anciennes versions)
+    for name in os.listdir(backup_dir) if os.path.isdir(backup_dir) else ():
+        if name.startswith("backup_") and name.endswith(("-wal", "-shm")) \
+                and not os.path.exists(os.path.join(backup_dir, name[:-4])):
+            os.remove(os.path.join(backup_dir, name))
+            removed.append(os.path.join(backup_dir, name))
+    return removed
+
+
+# --- Restauration ---
+
+def _versions(db_path):
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return dict(conn.execute("SELECT table_name, version FROM table_versions").fetchall())
+    except sqlite3.DatabaseError:
+        return {}
+    finally:
+        conn.close()
+
+
+def _after_restore(db_file, before):
+    from sqlalchemy import create_engine, text
+
+    from db_migrations import migrate
+
+    engine = create_engine(f"sqlite:///{db_file}")
+    try:
+        # Une sauvegarde ancienne peut précéder des migrations
+        migrate(engine)
+        # Versions au-delà de celles vues avant : les caches (lectures, exports) sont invalidés
+        restored = _versions(db_file)
+        with engine.begin() as conn:
+            for table in set(before) | set(restored):
+                conn.execute(text("""
+                    INSERT INTO table_versions (table_name, version) VALUES (:table, :version)
+                    ON CONFLICT (table_name) DO UPDATE SET version = :version
+                """), {"table": table, "version": max(before.get(table, 0), restored.get(table, 0)) + 1})
+    finally:
+        engine.dispose()
+
+
+def restore_backup(path=None, db_file=DB_FILE, backup_dir=BACKUP_DIR):
+    """
+    Restaure `path` (par défaut la sauvegarde la plus récente) dans `db_file`.
+    La sauvegarde est décompressée et contrôlée à côté de la base ; la base
+    actuelle est elle-même sauvegardée, puis remplacée en une transaction
+    (les connexions ouvertes voient directement le nouveau contenu).
+    Retourne un rapport, ou None s'il n'y a aucune sauvegarde.
+    """
+    if path is None:
+        backups = list_backups(backup_dir)
+        if not backups:
+            return None
+        path = backups[0][1]
+
+    started = time.perf_counter()
+    staged = db_file + ".restore"
+    try:
+        try:
+            if path.endswith(".gz"):
+                _gunzip(path, staged)
+            else:
+                shutil.copyfile(path, staged)
+            _rollback_journal(staged)
+            check = integrity_check(staged)
+        except (OSError, EOFError, sqlite3.DatabaseError) as e:
+            check = str(e)
+        if check != "ok":
+            raise ValueError(f"Sauvegarde {path} refusée : {check}")
+
+        safety = None
+        if os.path.exists(db_file):
+            safety = create_backup(db_file, backup_dir, prune=False)["path"]
+            before = _versions(db_file)
+            src = sqlite3.connect(staged)
+            dst = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT)
+            try:
+                # Une seule étape : tout ou rien, sous le verrou d'écriture de SQLite
+                src.backup(dst, pages=-1)
+            finally:
+                dst.close()
+                src.close()
+        else:
+            before = {}
+            os.replace(staged, db_file)
+    finally:
+        _remove(staged)
+
+    _after_restore(db_file, before)
+    return {"path": path, "previous": safety, "seconds": round(time.perf_counter() - started, 3)}
+
+
+# Conservées pour les appels existants
 def restore_latest_backup():
-    if not os.path.exists(BACKUP_DIR):
-        return False
+    return restore_backup() is not None
+
+
+# --- Ligne de commande ---
+
+def _option(argv, name, default):
+    if name in argv:
+        i = argv.index(name)
+        value = argv[i + 1]
+        del argv[i:i + 2]
+        return value
+    return default
+
+
+def main(argv):
+    argv = list(argv)
+    db_file = _option(argv, "--db", DB_FILE)
+    backup_dir = _option(argv, "--dir", BACKUP_DIR)
+    compress = "--no-gzip" not in argv
+    args = [a for a in argv if not a.startswith("--")]
+    command = args[0] if args else "backup"
+    target = args[1] if len(args) > 1 else None
 
-    backups = [f for f in os.listdir(BACKUP_DIR) if f.endswith(".db")]
-    if not backups:
-        return False
+    if command == "backup":
+        report = create_backup(db_file, backup_dir, compress=compress)
+        if report is None:
+            print(f"❌ {db_file} introuvable.")
+            return 1
+        print(f"✅ {report['path']} : {report['db_bytes'] / 1e6:.1f} Mo -> {report['bytes'] / 1e6:.1f} Mo "
+              f"en {report['seconds']:.2f} s (copie {report['copy_seconds']:.2f} s, "
+              f"{report['pages']} pages, {report['restarts']} redémarrage(s))")
+        for path in report["pruned"]:
+            print(f"🗑️ {path}")
+    elif command == "list":
+        for when, path in list_backups(backup_dir):
+            print(f"{when:%Y-%m-%d %H:%M:%S}  {os.path.getsize(path) / 1e6:8.1f} Mo  {path}")
+    elif command == "verify":
+        paths = [target] if target else [path for _, path in list_backups(backup_dir)]
+        failed = 0
+        for path in paths:
+            check = verify_backup(path)
+            failed += check != "ok"
+            print(f"{'✅' if check == 'ok' else '❌'} {path} : {check}")
+        return 1 if failed else 0
+    elif command == "restore":
+        report = restore_backup(target, db_file, backup_dir)
+        if report is None:
+            print("❌ Aucune sauvegarde.")
+            return 1
+        print(f"✅ {report['path']} restaurée en {report['seconds']:.2f} s "
+              f"(ancienne base sauvegardée : {report['previous']})")
+    elif command == "prune":
+        for path in prune_backups(backup_dir):
+            print(f"🗑️ {path}")
+    else:
+        print("Commandes : backup, list, verify, restore, prune")
+        return 2
+    return 0
 
-    # Trouve la sauvegarde la plus récente
-    latest_backup = max(backups, key=lambda f: os.path.getctime(os.path.join(BACKUP_DIR, f)))
-    latest_backup_path = os.path.join(BACKUP_DIR, latest_backup)
 
-    shutil.copy2(latest_backup_path, DB_FILE)
-    return True
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
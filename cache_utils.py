@@ -0,0 +1,162 @@
+# cache_utils.py
+# Cache des lectures SQL partagé entre sessions, invalidé par version de table.
+# Chaque écriture incrémente table_versions dans sa transaction
+# (bump_table_version) ; un résultat en cache n'est réutilisé que si les
+# versions des tables dont il dépend n'ont pas bougé.
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from sqlalchemy import text
+
+DEFAULT_TTL = 600                 # durée de vie max d'un résultat (s)
+MAX_BYTES = 64 * 1024 * 1024      # taille totale max du cache
+VERSION_TTL = 2.0                 # fraîcheur des versions lues en base (s)
+READ_WORKERS = 4                  # lectures parallèles de read_many (< pool_size)
+
+_entries = OrderedDict()
+_versions = {}
+_dirty_until = {}
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+_lock = threading.Lock()
+_read_executor = ThreadPoolExecutor(max_workers=READ_WORKERS, thread_name_prefix="read")
+
+
+def create_table(conn):
+    """Table des compteurs de version (appelée par les migrations)."""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS table_versions (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """))
+
+
+def bump_table_version(conn, *tables):
+    """À appeler dans la transaction d'écriture pour chaque table modifiée."""
+    for table in tables:
+        conn.execute(text("""
+            INSERT INTO table_versions (table_name, version) VALUES (:table, 1)
+            ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1
+        """), {"table": table})
+    # Les versions relues juste avant le commit ne doivent pas être mémorisées
+    with _lock:
+        _versions.pop(conn.engine.url, None)
+        _dirty_until[conn.engine.url] = time.monotonic() + VERSION_TTL
+
+
+def bump_month_versions(conn, table, days):
+    """
+    Version par mois des lignes écrites (clé "table@AAAA-MM"), dans la même
+    transaction : snapshot_utils ne revérifie que les mois archivés qui ont bougé.
+    """
+    months = sorted({str(day)[:7] for day in days if day is not None})
+    if months:
+        bump_table_version(conn, *(f"{table}@{month}" for month in months))
+
+
+def _table_versions(engine):
+    now = time.monotonic()
+    with _lock:
+        cached = _versions.get(engine.url)
+        if cached and now - cached[0] < VERSION_TTL:
+            return cached[1]
+    with engine.connect() as conn:
+        versions = dict(conn.execute(text("SELECT table_name, version FROM table_versions")).fetchall())
+    with _lock:
+        if now >= _dirty_until.get(engine.url, 0):
+            _versions[engine.url] = (now, versions)
+    return versions
+
+
+def table_versions(engine, tables):
+    """Versions actuelles de `tables` (tuple), pour construire des clés de cache."""
+    current = _table_versions(engine)
+    return tuple(current.get(table, 0) for table in tables)
+
+
+def month_versions(engine, table):
+    """{mois: version} des mois de `table` déjà écrits (voir bump_month_versions)."""
+    prefix = f"{table}@"
+    return {name[len(prefix):]: version for name, version in _table_versions(engine).items()
+            if name.startswith(prefix)}
+
+
+def _evict():
+    while _stats["bytes"] > MAX_BYTES and _entries:
+        _, entry = _entries.popitem(last=False)
+        _stats["bytes"] -= entry["size"]
+        _stats["evictions"] += 1
+
+
+def read_sql(engine, sql, params=None, tables=(), ttl=DEFAULT_TTL):
+    """
+    Équivalent de pd.read_sql mis en cache.
+    `tables` : tables dont dépend le résultat (ex. ("purchases",) pour
+    une lecture de daily_purchases). Retourne une copie du DataFrame.
+    """
+    params = params or {}
+    key = (engine.url, sql, tuple(sorted((k, str(v)) for k, v in params.items())))
+    versions = table_versions(engine, tables)
+    now = time.monotonic()
+
+    with _lock:
+        entry = _entries.get(key)
+        if entry and entry["versions"] == versions and now - entry["created"] < ttl:
+            _entries.move_to_end(key)
+            _stats["hits"] += 1
+            return entry["frame"].copy()
+        _stats["misses"] += 1
+
+    with engine.connect() as conn:
+        frame = pd.read_sql(text(sql), conn, params=params)
+
+    size = int(frame.memory_usage(deep=True).sum())
+    with _lock:
+        old = _entries.pop(key, None)
+        if old:
+            _stats["bytes"] -= old["size"]
+        if size <= MAX_BYTES:
+            _entries[key] = {"versions": versions, "created": now, "frame": frame, "size": size}
+            _stats["bytes"] += size
+            _evict()
+    return frame.copy()
+
+
+def _timed_read(engine, sql, params, tables):
+    start = time.perf_counter()
+    frame = read_sql(engine, sql, params, tables=tables)
+    return frame, time.perf_counter() - start
+
+
+def read_many(engine, queries):
+    """
+    Plusieurs read_sql indépendants lancés en parallèle, chacun sur sa
+    connexion du pool : la page attend la plus lente, pas la somme.
+    `queries` : {nom: (sql, params, tables)}.
+    Retourne ({nom: DataFrame}, {nom: durée en secondes}).
+    """
+    futures = {
+        name: _read_executor.submit(_timed_read, engine, sql, params, tables)
+        for name, (sql, params, tables) in queries.items()
+    }
+    frames, timings = {}, {}
+    for name, future in futures.items():
+        frames[name], timings[name] = future.result()
+    return frames, timings
+
+
+def cache_stats():
+    """Compteurs : hits, misses, evictions, bytes, entries."""
+    with _lock:
+        return {**_stats, "entries": len(_entries)}
+
+
+def clear_cache():
+    with _lock:
+        _entries.clear()
+        _versions.clear()
+        _stats.update({"hits": 0, "misses": 0, "evictions": 0, "bytes": 0})
@@ -0,0 +1,26 @@
+# categories.py
+# Taxonomie des catégories partagée par les pages de saisie et l'import en masse.
+
+CATEGORIES = {
+    "🍼 Dépôt": {"subcategories": ["Medded", "Mlika", "Jamila"], "suppliers": []},
+    "🍰 Cake": {"subcategories": ["Tom", "Moulin d'Or"], "suppliers": []},
+    "🥛 Produits Laitiers": {"subcategories": ["Lait", "Yaourt"], "suppliers": ["Delice", "Vitalait", "Centrale"]},
+    "🍗 Volaille": {"subcategories": ["Mazra", "Jalel"], "suppliers": ["SOTUVI", "CHA"]},
+    "🌾 Farine": {"subcategories": [], "suppliers": ["Grands Moulins", "Minoterie"]},
+    "🥤 Liquides": {"subcategories": ["Eau", "Boissons Gazeuses", "Jus"], "suppliers": ["Cristal", "Coca-Cola", "Pepsi"]},
+    "🧴 Hygiène & Beauté": {
+        "subcategories": {
+            "🧼 Hygiène": ["Judy", "Lilas", "Nawar", "Syso", "Sunsilk", "Autre"],
+            "💄 Beauté": ["Yassine", "L'Oréal", "Autre"]
+        },
+        "suppliers": []
+    },
+    "🧀 Fromage": {"subcategories": ["Majesté", "Landor", "Traditionnel"], "suppliers": []},
+    "🥩 Twebel": {"subcategories": ["Twebel", "Elmalah"], "suppliers": []},
+    "🍦 Glace": {"subcategories": [], "suppliers": ["Frigo", "Polar"]},
+    "🥖 Daily": {"subcategories": ["Gâteaux", "Pain"], "suppliers": ["Boulangerie du Coin", "Fournée Dorée"]},
+    "🐶 Animaux": {"subcategories": ["Pet's"], "suppliers": ["Royal Canin", "Pedigree"]},
+    "🏠 Maison": {"subcategories": [], "suppliers": []},
+    "📦 Divers": {"subcategories": [], "suppliers": []},
+    "🎉 Autres": {"subcategories": [], "suppliers": []}
+}
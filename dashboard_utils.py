@@ -0,0 +1,63 @@
+# dashboard_utils.py
+# Agrégats du tableau de bord calculés par la base en un seul aller-retour.
+
+import pandas as pd
+from sqlalchemy import text
+
+# Achats sans catégorie : regroupés pour que la répartition retombe sur le total
+UNCATEGORIZED = "Sans catégorie"
+
+
+def _month_sql(conn):
+    # Dates TEXT 'YYYY-MM-DD' sous SQLite, DATE sous PostgreSQL
+    return "substr(date, 1, 7)" if conn.dialect.name == "sqlite" else "to_char(date, 'YYYY-MM')"
+
+
+def load_dashboard(conn, top_n=10):
+    """
+    Retourne les indicateurs du tableau de bord sans charger les achats :
+    nombre d'articles, montant total, nombre de fournisseurs,
+    répartition par catégorie, top N fournisseurs et série mensuelle.
+    Tout vient des tables de synthèse (rollup_utils) : le coût dépend du
+    nombre de jours x catégories / fournisseurs, pas du nombre d'achats.
+    Les achats sans fournisseur ne comptent ni dans le nombre ni dans le top.
+    """
+    query = f"""
+        SELECT 'kpi' AS kind, NULL AS label, COALESCE(SUM(lines), 0) AS n, SUM(purchase_total) AS total,
+               (SELECT COUNT(DISTINCT supplier) FROM daily_supplier_purchases WHERE supplier <> '') AS suppliers
+        FROM daily_purchases
+        UNION ALL
+        SELECT 'category', CASE WHEN category = '' THEN :uncategorized ELSE category END,
+               SUM(lines), SUM(purchase_total), NULL
+        FROM daily_category_purchases GROUP BY category
+        UNION ALL
+        SELECT * FROM (
+            SELECT 'supplier' AS kind, supplier AS label, SUM(lines) AS n,
+                   COALESCE(SUM(purchase_total), 0) AS total, NULL AS suppliers
+            FROM daily_supplier_purchases WHERE supplier <> ''
+            GROUP BY supplier ORDER BY total DESC, supplier LIMIT :top_n
+        ) AS top_suppliers
+        UNION ALL
+        SELECT 'month', {_month_sql(conn)}, SUM(lines), SUM(purchase_total), NULL
+        FROM daily_purchases GROUP BY {_month_sql(conn)}
+    """
+    rows = pd.DataFrame(
+        conn.execute(text(query), {"top_n": top_n, "uncategorized": UNCATEGORIZED}).fetchall(),
+        columns=["kind", "label", "n", "total", "suppliers"],
+    )
+    rows["total"] = pd.to_numeric(rows["total"]).fillna(0.0)
+
+    kpi = rows[rows["kind"] == "kpi"].iloc[0]
+    part = lambda kind, name: (
+        rows[rows["kind"] == kind][["label", "total"]]
+        .rename(columns={"label": name, "total": "Total"})
+        .reset_index(drop=True)
+    )
+    return {
+        "count": int(kpi["n"]),
+        "total": float(kpi["total"]),
+        "suppliers": int(kpi["suppliers"] or 0),
+        "categories": part("category", "category").sort_values("Total", ascending=False),
+        "top_suppliers": part("supplier", "supplier").sort_values("Total", ascending=False),
+        "monthly": part("month", "Mois").sort_values("Mois"),
+    }
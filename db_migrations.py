@@ -0,0 +1,253 @@
+# db_migrations.py
+# Migrations numérotées du schéma, compatibles SQLite et PostgreSQL.
+# Usage : python db_migrations.py [url] [--status]
+
+import sys
+
+from sqlalchemy import inspect, text
+
+DEFAULT_URL = "sqlite:///supermarket.db"
+
+# Types dépendant du moteur
+TYPES = {
+    "sqlite": {"id": "INTEGER PRIMARY KEY AUTOINCREMENT", "money": "REAL", "date": "TEXT"},
+    "postgresql": {"id": "SERIAL PRIMARY KEY", "money": "NUMERIC", "date": "DATE"},
+}
+
+
+def _types(conn):
+    return TYPES.get(conn.dialect.name, TYPES["postgresql"])
+
+
+def _columns(conn, table):
+    return {col["name"] for col in inspect(conn).get_columns(table)}
+
+
+def _add_missing_columns(conn, table, columns):
+    existing = _columns(conn, table)
+    for name, col_type in columns.items():
+        if name not in existing:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {col_type}"))
+
+
+# --- Migrations ---
+
+def _create_base_tables(conn):
+    ty = _types(conn)
+    # La base SQLite historique (inev.py) stocke un seul prix dans `price`
+    purchase_prices = (
+        f"price {ty['money']}" if conn.dialect.name == "sqlite"
+        else f"purchase_price {ty['money']},\n            sale_price {ty['money']}"
+    )
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS purchases (
+            id {ty['id']},
+            product TEXT,
+            category TEXT,
+            subcategory TEXT,
+            supplier TEXT,
+            quantity INTEGER,
+            {purchase_prices},
+            date {ty['date']}
+        )
+    """))
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS caisse (
+            id {ty['id']},
+            montant {ty['money']},
+            date {ty['date']},
+            periode TEXT
+        )
+    """))
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS credits (
+            id {ty['id']},
+            montant {ty['money']},
+            date {ty['date']},
+            note TEXT
+        )
+    """))
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS expenses (
+            id {ty['id']},
+            montant {ty['money']},
+            date {ty['date']},
+            type TEXT
+        )
+    """))
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS inventory_movements (
+            id {ty['id']},
+            product TEXT,
+            depot TEXT,
+            movement_type TEXT,  -- 'entry' ou 'exit'
+            quantity INTEGER,
+            price {ty['money']},
+            date {ty['date']}
+        )
+    """))
+
+
+def _add_drifted_columns(conn):
+    # Remplace update_db.py : colonnes ajoutées après coup sur les anciennes bases
+    ty = _types(conn)
+    _add_missing_columns(conn, "purchases", {"purchase_price": ty["money"], "sale_price": ty["money"]})
+    _add_missing_columns(conn, "caisse", {"date": ty["date"], "periode": "TEXT"})
+
+
+# Index des recherches par date / produit (vérifiés par query_plans.py)
+INDEXES = [
+    ("idx_purchases_date", "purchases", "date"),
+    ("idx_purchases_date_category", "purchases", "date, category"),
+    ("idx_purchases_product", "purchases", "product"),
+    ("idx_caisse_date_periode", "caisse", "date, periode"),
+    ("idx_credits_date", "credits", "date"),
+    ("idx_expenses_date", "expenses", "date"),
+    ("idx_movements_product_depot_date", "inventory_movements", "product, depot, date"),
+    ("idx_movements_date", "inventory_movements", "date"),
+]
+
+
+def _create_indexes(conn):
+    for name, table, columns in INDEXES:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+def _create_rollups(conn):
+    import rollup_utils
+    rollup_utils.create_tables(conn)
+    rollup_utils.rebuild(conn)
+
+
+def _create_search_index(conn):
+    import search_utils
+    search_utils.create_index(conn)
+
+
+def _create_table_versions(conn):
+    import cache_utils
+    cache_utils.create_table(conn)
+
+
+# Identifiant généré par le poste de saisie (journal hors ligne, voir journal_utils.py)
+CLIENT_ID_TABLES = ("caisse", "credits", "expenses")
+
+
+def _add_client_ids(conn):
+    for table in CLIENT_ID_TABLES:
+        _add_missing_columns(conn, table, {"client_id": "TEXT"})
+        # Unique : un envoi rejoué par la synchronisation n'insère rien
+        conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_client_id ON {table} (client_id)"))
+
+
+def _add_expiry_dates(conn):
+    # Date de péremption des entrées, pour l'affectation FEFO des sorties (lot_utils.py)
+    _add_missing_columns(conn, "inventory_movements", {"expiry_date": _types(conn)["date"]})
+
+
+def _create_stock_levels(conn):
+    import stock_utils
+    stock_utils.create_tables(conn)
+    stock_utils.rebuild(conn)
+
+
+def _create_valuation_tables(conn):
+    # Les mois sont clos ensuite par valuation_utils.close_months (tâche de fin de mois)
+    import valuation_utils
+    valuation_utils.create_tables(conn)
+
+
+def _create_supplier_rollup(conn):
+    # daily_supplier_purchases : fournisseurs du tableau de bord sans relire les achats
+    import rollup_utils
+    rollup_utils.create_tables(conn)
+    rollup_utils.rebuild(conn)
+
+
+MIGRATIONS = [
+    (1, "tables de base", _create_base_tables),
+    (2, "colonnes prix achat/vente et caisse par période", _add_drifted_columns),
+    (3, "index sur les dates et produits", _create_indexes),
+    (4, "tables de synthèse journalières", _create_rollups),
+    (5, "index de recherche des produits", _create_search_index),
+    (6, "versions des tables pour le cache de lecture", _create_table_versions),
+    (7, "identifiants client pour la synchronisation du journal", _add_client_ids),
+    (8, "date de péremption des mouvements d'inventaire", _add_expiry_dates),
+    (9, "stock par dépôt et produit, fins de mois", _create_stock_levels),
+    (10, "valorisation du stock par mois clos", _create_valuation_tables),
+    (11, "synthèse journalière par fournisseur", _create_supplier_rollup),
+]
+
+
+# --- Exécution ---
+
+def _ensure_version_table(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+
+
+def current_version(engine):
+    """Retourne le numéro de la dernière migration appliquée (0 si aucune)."""
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+
+
+def migrate(engine):
+    """
+    Applique les migrations manquantes, chacune dans sa propre transaction.
+    Retourne la liste des versions appliquées.
+    """
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        done = {row[0] for row in conn.execute(text("SELECT version FROM schema_version"))}
+
+    applied = []
+    for version, name, step in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                # Sérialise les processus qui démarrent en même temps
+                conn.execute(text("SELECT pg_advisory_xact_lock(707001)"))
+            # Un autre processus a pu l'appliquer entre-temps
+            already = conn.execute(
+                text("SELECT 1 FROM schema_version WHERE version = :version"), {"version": version}
+            ).first()
+            if already:
+                continue
+            step(conn)
+            conn.execute(
+                text("INSERT INTO schema_version (version, name) VALUES (:version, :name)"),
+                {"version": version, "name": name},
+            )
+            applied.append(version)
+    return applied
+
+
+def main(argv):
+    from db_utils import get_engine
+
+    args = [a for a in argv if not a.startswith("--")]
+    url = args[0] if args else DEFAULT_URL
+    engine = get_engine(url, auto_migrate=False)
+
+    if "--status" in argv:
+        print(f"Version du schéma : {current_version(engine)} / {MIGRATIONS[-1][0]}")
+        return
+
+    applied = migrate(engine)
+    if applied:
+        for version in applied:
+            print(f"✅ Migration {version} appliquée.")
+    else:
+        print("✅ Schéma déjà à jour.")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,371 @@
+# db_utils.py
+# Usage : python db_utils.py stress [--threads 8] [--processes 4] [--writes 50]
+# Compare, sur une base SQLite temporaire, les écritures concurrentes avec
+# les réglages par défaut de sqlite3 et avec begin_write() en WAL.
+
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+# --- Réglages par défaut du pool (surchargeables dans st.secrets["database"]) ---
+POOL_DEFAULTS = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_timeout": 30,
+    "pool_recycle": 1800,
+    "pool_pre_ping": True,
+}
+
+# Durée (secondes) pendant laquelle le test de connexion reste en cache
+HEALTH_CHECK_TTL = 300
+
+# --- SQLite : pragmas appliqués à chaque connexion ---
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",          # lecteurs et écrivain ne se bloquent plus
+    "synchronous": "NORMAL",        # suffisant en WAL (fsync aux checkpoints)
+    "cache_size": -16000,           # 16 Mo de cache de pages par connexion
+    "mmap_size": 256 * 1024 * 1024,
+    "busy_timeout": 10000,          # attente d'un verrou avant SQLITE_BUSY (ms)
+    "temp_store": "MEMORY",
+}
+WRITE_RETRIES = 5                   # nouvelles tentatives après busy_timeout
+WRITE_BACKOFF = 0.05                # première attente, doublée à chaque essai (s)
+
+_engines = {}
+_health = {}
+_cost_sql = {}
+_lock = threading.Lock()
+_write_locks = {}
+_write_stats = {}
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool qui mesure le temps d'attente pour obtenir une connexion.
+    Les compteurs sont exposés via pool_stats().
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.wait_stats = {"checkouts": 0, "timeouts": 0, "wait_total": 0.0, "wait_max": 0.0}
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self.wait_stats["timeouts"] += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.wait_stats["checkouts"] += 1
+                self.wait_stats["wait_total"] += waited
+                self.wait_stats["wait_max"] = max(self.wait_stats["wait_max"], waited)
+
+
+def _database_config():
+    # Import local : les scripts CLI peuvent utiliser ce module sans Streamlit
+    import streamlit as st
+    return dict(st.secrets["database"])
+
+
+def _is_memory_sqlite(url):
+    return url.startswith("sqlite") and (url in ("sqlite://", "sqlite:///") or ":memory:" in url)
+
+
+def get_engine(url=None, auto_migrate=None, **pool_options):
+    """
+    Retourne le moteur SQLAlchemy partagé par tout le processus.
+    Sans url, la configuration est lue dans st.secrets["database"].
+    Le pool n'est construit qu'une seule fois par url, et les migrations
+    du schéma sont appliquées à ce moment-là (sauf auto_migrate=False).
+    """
+    config = {}
+    if url is None:
+        config = _database_config()
+        url = config["url"]
+
+    engine = _engines.get(url)
+    if engine is not None:
+        return engine
+
+    with _lock:
+        engine = _engines.get(url)
+        if engine is None:
+            if _is_memory_sqlite(url):
+                engine = create_engine(url)
+            else:
+                options = {key: config.get(key, value) for key, value in POOL_DEFAULTS.items()}
+                if url.startswith("sqlite"):
+                    # LIFO : une page récupère la connexion qu'elle vient de rendre, cache de pages compris
+                    options["pool_use_lifo"] = True
+                options.update(pool_options)
+                engine = create_engine(url, poolclass=TimedQueuePool, **options)
+                if engine.dialect.name == "sqlite":
+                    _setup_sqlite(engine)
+            if auto_migrate is None:
+                auto_migrate = config.get("auto_migrate", True)
+            if auto_migrate:
+                from db_migrations import migrate
+                migrate(engine)
+            _engines[url] = engine
+    return engine
+
+
+def _setup_sqlite(engine):
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_conn, record):
+        # BEGIN émis par _on_begin et non par pysqlite (recette SQLAlchemy)
+        dbapi_conn.isolation_level = None
+        cursor = dbapi_conn.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def _on_begin(conn):
+        immediate = conn.get_execution_options().get("sqlite_immediate")
+        conn.exec_driver_sql("BEGIN IMMEDIATE" if immediate else "BEGIN")
+
+
+def _is_busy(error):
+    message = str(error.orig).lower()
+    return "locked" in message or "busy" in message
+
+
+def _begin_immediate(engine, stats):
+    for attempt in range(WRITE_RETRIES + 1):
+        conn = engine.connect().execution_options(sqlite_immediate=True)
+        try:
+            return conn, conn.begin()
+        except OperationalError as e:
+            conn.close()
+            if attempt == WRITE_RETRIES or not _is_busy(e):
+                raise
+            stats["retries"] += 1
+            time.sleep(WRITE_BACKOFF * 2 ** attempt * random.uniform(1, 1.5))
+
+
+@contextmanager
+def begin_write(engine=None):
+    """
+    Remplace engine.begin() pour les écritures des pages.
+    Sous SQLite, les écritures du processus passent une par une, le verrou
+    d'écriture est pris dès le BEGIN (IMMEDIATE : pas de « database is locked »
+    en cours de transaction) et, si un autre processus le garde au-delà de
+    busy_timeout, on réessaie avec une attente croissante.
+    Ne pas imbriquer deux begin_write dans le même thread.
+    """
+    engine = engine or get_engine()
+    if engine.dialect.name != "sqlite":
+        with engine.begin() as conn:
+            yield conn
+        return
+
+    with _lock:
+        lock = _write_locks.setdefault(engine.url, threading.Lock())
+        stats = _write_stats.setdefault(engine.url, {"writes": 0, "retries": 0, "wait_total": 0.0, "wait_max": 0.0})
+    start = time.perf_counter()
+    with lock:
+        conn, trans = _begin_immediate(engine, stats)
+        waited = time.perf_counter() - start
+        stats["writes"] += 1
+        stats["wait_total"] += waited
+        stats["wait_max"] = max(stats["wait_max"], waited)
+        with conn, trans:
+            yield conn
+
+
+def write_stats(engine=None):
+    """Écritures passées par begin_write : nombre, nouvelles tentatives, attente du verrou."""
+    engine = engine or get_engine()
+    with _lock:
+        stats = dict(_write_stats.get(engine.url, {"writes": 0, "retries": 0, "wait_total": 0.0, "wait_max": 0.0}))
+    stats["wait_avg"] = stats["wait_total"] / stats["writes"] if stats["writes"] else 0.0
+    return stats
+
+
+def check_connection(engine=None, ttl=HEALTH_CHECK_TTL):
+    """
+    Vérifie la connexion et retourne la version du serveur.
+    Le résultat est mis en cache pendant `ttl` secondes pour éviter
+    un aller-retour à chaque rerun des pages.
+    """
+    engine = engine or get_engine()
+    cached = _health.get(engine.url)
+    now = time.monotonic()
+    if cached and now - cached[0] < ttl:
+        return cached[1]
+
+    query = "SELECT sqlite_version()" if engine.dialect.name == "sqlite" else "SELECT version()"
+    with engine.connect() as conn:
+        version = conn.execute(text(query)).scalar()
+    if engine.dialect.name == "sqlite":
+        version = f"SQLite {version}"
+    _health[engine.url] = (now, version)
+    return version
+
+
+def reset_connection_check(engine=None):
+    """Oublie le résultat de check_connection (à appeler quand une requête échoue)."""
+    engine = engine or get_engine()
+    _health.pop(engine.url, None)
+
+
+def pool_stats(engine=None):
+    """
+    Statistiques du pool : connexions ouvertes, empruntées, débordement
+    et temps d'attente cumulé / moyen / maximal pour obtenir une connexion.
+    """
+    engine = engine or get_engine()
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": max(pool.overflow(), 0),
+        })
+    wait_stats = getattr(pool, "wait_stats", None)
+    if wait_stats:
+        with pool._stats_lock:
+            stats.update(wait_stats)
+        stats["wait_avg"] = stats["wait_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+    return stats
+
+
+def purchase_cost_sql(conn):
+    """
+    Expression SQL du prix d'achat unitaire des achats.
+    Les bases SQLite historiques (inev.py) remplissent `price`
+    au lieu de `purchase_price` : on prend alors l'un ou l'autre.
+    """
+    key = conn.engine.url
+    if key not in _cost_sql:
+        columns = {col["name"] for col in inspect(conn).get_columns("purchases")}
+        _cost_sql[key] = "COALESCE(purchase_price, price)" if "price" in columns else "purchase_price"
+    return _cost_sql[key]
+
+
+def dispose_engines():
+    """Ferme tous les pools (utile pour les scripts et les tests manuels)."""
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        _health.clear()
+        _cost_sql.clear()
+        _write_locks.clear()
+        _write_stats.clear()
+
+
+# --- Test de charge ---
+
+def _stress_writes(url, writes, use_layer, results):
+    """Un caissier : lit puis écrit dans la même transaction, `writes` fois."""
+    engine = get_engine(url, auto_migrate=False) if use_layer else create_engine(url)
+    for i in range(writes):
+        start = time.perf_counter()
+        try:
+            with (begin_write(engine) if use_layer else engine.begin()) as conn:
+                conn.execute(text("SELECT COUNT(*) FROM caisse WHERE date = :date"), {"date": "2026-01-01"}).scalar()
+                conn.execute(text("INSERT INTO caisse (montant, date) VALUES (:montant, :date)"),
+                             {"montant": i, "date": "2026-01-01"})
+            results.append(("ok", time.perf_counter() - start))
+        except OperationalError as e:
+            results.append((str(e.orig), time.perf_counter() - start))
+    if not use_layer:
+        engine.dispose()
+
+
+def _stress_process(url, threads, writes, use_layer, queue):
+    results = []
+    workers = [threading.Thread(target=_stress_writes, args=(url, writes, use_layer, results)) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    queue.put(results)
+
+
+def stress(path, threads=8, processes=4, writes=50, use_layer=True):
+    """Lance processes x threads écrivains sur `path` ; retourne un résumé."""
+    import multiprocessing
+
+    url = f"sqlite:///{path}"
+    setup = create_engine(url)
+    with setup.begin() as conn:
+        conn.execute(text("CREATE TABLE IF NOT EXISTS caisse (id INTEGER PRIMARY KEY, montant REAL, date TEXT)"))
+    setup.dispose()
+
+    queue = multiprocessing.Queue()
+    started = time.perf_counter()
+    jobs = [multiprocessing.Process(target=_stress_process, args=(url, threads, writes, use_layer, queue))
+            for _ in range(processes)]
+    for job in jobs:
+        job.start()
+    results = [r for _ in jobs for r in queue.get()]
+    for job in jobs:
+        job.join()
+    seconds = time.perf_counter() - started
+
+    latencies = sorted(latency for status, latency in results if status == "ok")
+    errors = {}
+    for status, _ in results:
+        if status != "ok":
+            errors[status] = errors.get(status, 0) + 1
+    return {
+        "ok": len(latencies),
+        "errors": errors,
+        "seconds": seconds,
+        "per_second": len(latencies) / seconds,
+        "p50": latencies[len(latencies) // 2] if latencies else 0.0,
+        "p99": latencies[int(len(latencies) * 0.99)] if latencies else 0.0,
+    }
+
+
+def main(argv):
+    import os
+    import tempfile
+
+    argv = list(argv)
+    options = {"--threads": 8, "--processes": 4, "--writes": 50}
+    for name in options:
+        if name in argv:
+            i = argv.index(name)
+            options[name] = int(argv[i + 1])
+            del argv[i:i + 2]
+    if argv[:1] != ["stress"]:
+        print("Usage : python db_utils.py stress [--threads 8] [--processes 4] [--writes 50]")
+        return 2
+
+    total = options["--threads"] * options["--processes"] * options["--writes"]
+    print(f"⏳ {options['--processes']} processus x {options['--threads']} threads, {total} écritures...")
+    for use_layer, label in ((False, "sqlite3 par défaut"), (True, "WAL + begin_write")):
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, "stress.db")
+        try:
+            report = stress(path, options["--threads"], options["--processes"], options["--writes"], use_layer)
+        finally:
+            for name in os.listdir(tmpdir):
+                os.remove(os.path.join(tmpdir, name))
+            os.rmdir(tmpdir)
+        errors = ", ".join(f"{count} × {message}" for message, count in report["errors"].items()) or "aucune"
+        print(f"{'✅' if not report['errors'] else '❌'} {label} : {report['ok']}/{total} en {report['seconds']:.2f} s "
+              f"({report['per_second']:.0f}/s), p50 {report['p50'] * 1000:.1f} ms, "
+              f"p99 {report['p99'] * 1000:.1f} ms, erreurs : {errors}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,342 @@
+# export_utils.py
+# Exports Excel / CSV partagés par les pages, en mémoire bornée :
+# les lignes sont lues par paquets (curseur côté serveur sous PostgreSQL)
+# et écrites au fil de l'eau dans un classeur openpyxl en écriture seule
+# ou dans un CSV compressé gzip.
+# Dans les pages, un export n'est produit qu'à la demande, par un thread
+# d'arrière-plan, et gardé en cache tant que ses tables n'ont pas changé.
+# Usage : python export_utils.py [url] [--rows 200000] [--format xlsx|csv]
+# Sans url, mesure temps et mémoire sur une base SQLite synthétique.
+
+import csv
+import gzip
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from sqlalchemy import text
+
+from cache_utils import table_versions
+
+CHUNK_SIZE = 5000
+EXCEL_MAX_ROWS = 1_048_576        # limite d'une feuille Excel, en-tête compris
+EXCEL_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+CSV_GZIP_MIME = "application/gzip"
+FORMATS = {"xlsx": ("xlsx", EXCEL_MIME), "csv": ("csv.gz", CSV_GZIP_MIME)}
+
+EXPORT_WORKERS = 2                    # exports générés en parallèle au plus
+EXPORT_CACHE_BYTES = 128 * 1024 * 1024
+WAIT_SECONDS = 2.0                    # attente dans la page avant de rendre la main
+
+_timings = deque(maxlen=50)
+_lock = threading.Lock()
+_jobs = OrderedDict()
+_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+
+
+# --- Lecture par paquets ---
+
+def iter_chunks(engine, sql, params=None, chunk_size=CHUNK_SIZE):
+    """
+    Exécute `sql` et produit d'abord la liste des colonnes, puis des listes
+    d'au plus `chunk_size` lignes. stream_results ouvre un curseur nommé
+    sous PostgreSQL ; sqlite3 lit déjà les lignes à la demande.
+    """
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=chunk_size).execute(
+            text(sql), params or {}
+        )
+        yield list(result.keys())
+        for rows in result.partitions(chunk_size):
+            yield rows
+
+
+def _record(fmt, rows, size, started):
+    timing = {"format": fmt, "rows": rows, "bytes": size, "seconds": time.perf_counter() - started}
+    with _lock:
+        _timings.append(timing)
+    return timing
+
+
+def export_timings():
+    """Derniers exports (du plus ancien au plus récent) : format, rows, bytes, seconds."""
+    with _lock:
+        return list(_timings)
+
+
+def last_export():
+    with _lock:
+        return _timings[-1] if _timings else None
+
+
+# --- Écrivains ---
+
+def _excel_value(value):
+    # openpyxl refuse les dates avec fuseau horaire
+    if getattr(value, "tzinfo", None) is not None:
+        return value.replace(tzinfo=None)
+    return value
+
+
+def export_excel(engine, sql, params=None, sheet_name="Export", chunk_size=CHUNK_SIZE):
+    """Retourne le contenu .xlsx du résultat de `sql`, écrit en mode write-only."""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    started = time.perf_counter()
+    workbook = Workbook(write_only=True)
+    chunks = iter_chunks(engine, sql, params, chunk_size)
+    columns = next(chunks)
+    sheet, sheet_rows, total = None, EXCEL_MAX_ROWS, 0
+
+    def new_sheet(number):
+        ws = workbook.create_sheet(sheet_name if number == 1 else f"{sheet_name} ({number})")
+        header = []
+        for name in columns:
+            cell = WriteOnlyCell(ws, value=name)
+            cell.font = Font(bold=True)
+            header.append(cell)
+        ws.append(header)
+        return ws
+
+    sheets = 0
+    for rows in chunks:
+        for row in rows:
+            # Au-delà d'un million de lignes, on continue sur une nouvelle feuille
+            if sheet_rows >= EXCEL_MAX_ROWS:
+                sheets += 1
+                sheet, sheet_rows = new_sheet(sheets), 1
+            sheet.append([_excel_value(v) for v in row])
+            sheet_rows += 1
+        total += len(rows)
+    if sheet is None:
+        new_sheet(1)
+
+    output = io.BytesIO()
+    workbook.save(output)
+    data = output.getvalue()
+    _record("xlsx", total, len(data), started)
+    return data
+
+
+def export_csv_gzip(engine, sql, params=None, chunk_size=CHUNK_SIZE):
+    """Retourne le résultat de `sql` en CSV UTF-8 (BOM pour Excel) compressé gzip."""
+    started = time.perf_counter()
+    output = io.BytesIO()
+    total = 0
+    with gzip.GzipFile(fileobj=output, mode="wb", compresslevel=6) as gz:
+        stream = io.TextIOWrapper(gz, encoding="utf-8-sig", newline="")
+        writer = csv.writer(stream)
+        for i, rows in enumerate(iter_chunks(engine, sql, params, chunk_size)):
+            if i == 0:
+                writer.writerow(rows)
+                continue
+            writer.writerows(rows)
+            total += len(rows)
+        stream.flush()
+        stream.detach()
+    data = output.getvalue()
+    _record("csv.gz", total, len(data), started)
+    return data
+
+
+def export(engine, sql, params=None, fmt="xlsx", **options):
+    """Retourne (contenu, extension, type MIME) pour fmt = 'xlsx' ou 'csv'."""
+    writer = export_csv_gzip if fmt == "csv" else export_excel
+    extension, mime = FORMATS["csv" if fmt == "csv" else "xlsx"]
+    return writer(engine, sql, params, **options), extension, mime
+
+
+# --- Exports à la demande, en arrière-plan et en cache ---
+
+def _job_key(engine, name, tables):
+    return (engine.url, name, tuple(tables), table_versions(engine, tables))
+
+
+def _run(job, build):
+    started = time.perf_counter()
+    data = build()
+    job["seconds"] = time.perf_counter() - started
+    return data
+
+
+def _job_done(key, future):
+    with _lock:
+        job = _jobs.get(key)
+        if job is None:
+            return
+        if future.exception() is not None:
+            # Un échec n'est pas mis en cache : le prochain clic relance l'export
+            del _jobs[key]
+            return
+        job["size"] = len(future.result())
+        # Éviction LRU des exports terminés au-delà de EXPORT_CACHE_BYTES
+        total = sum(j["size"] for j in _jobs.values())
+        for old_key in list(_jobs):
+            if total <= EXPORT_CACHE_BYTES:
+                break
+            if old_key != key and _jobs[old_key]["future"].done():
+                total -= _jobs.pop(old_key)["size"]
+
+
+def find_export(engine, name, tables=()):
+    """Job déjà lancé pour `name` aux versions actuelles de `tables`, sinon None."""
+    key = _job_key(engine, name, tables)
+    with _lock:
+        job = _jobs.get(key)
+        if job:
+            _jobs.move_to_end(key)
+        return job
+
+
+def submit_export(engine, name, tables, build):
+    """
+    Lance build() (qui retourne des bytes) dans un thread d'arrière-plan,
+    sauf si le même export existe déjà pour les versions actuelles de `tables`.
+    `name` identifie l'export (requête, paramètres, format...).
+    Retourne le job : {"future", "size", "seconds"}.
+    """
+    key = _job_key(engine, name, tables)
+    with _lock:
+        job = _jobs.get(key)
+        if job:
+            return job
+        # Les versions précédentes du même export sont désormais périmées
+        for old_key in [k for k in _jobs if k[:3] == key[:3] and _jobs[k]["future"].done()]:
+            del _jobs[old_key]
+        job = {"size": 0, "seconds": None}
+        job["future"] = _executor.submit(_run, job, build)
+        _jobs[key] = job
+    job["future"].add_done_callback(lambda future: _job_done(key, future))
+    return job
+
+
+def export_jobs():
+    """État des exports en mémoire : [(nom, terminé, taille, durée)]."""
+    with _lock:
+        return [(k[1], j["future"].done(), j["size"], j["seconds"]) for k, j in _jobs.items()]
+
+
+def lazy_download(label, engine, name, tables, build, file_name, mime, key):
+    """
+    Bouton « Préparer » puis st.download_button : rien n'est généré tant que
+    personne ne le demande, et un export déjà produit pour les mêmes données
+    est servi directement depuis le cache.
+    """
+    import streamlit as st
+
+    job = find_export(engine, name, tables)
+    if job is None:
+        if not st.button(f"⚙️ {label}", key=f"{key}_prepare"):
+            return
+        job = submit_export(engine, name, tables, build)
+
+    future = job["future"]
+    try:
+        data = future.result(timeout=WAIT_SECONDS)
+    except FutureTimeout:
+        st.info("⏳ Export en cours de préparation, la page reste utilisable.")
+        st.button("🔄 Actualiser", key=f"{key}_refresh")
+        return
+    except Exception as e:
+        st.error(f"❌ Export impossible : {e}")
+        return
+    st.download_button(label=label, data=data, file_name=file_name, mime=mime, key=key)
+    st.caption(f"{len(data) / 1024:.0f} Ko · généré en {job['seconds'] or 0:.2f} s")
+
+
+def download_export(label, engine, sql, params=None, file_stem="export", key="export", tables=()):
+    """
+    Sélecteur de format + export à la demande du résultat de `sql`.
+    `tables` : tables lues par `sql`, dont les versions invalident le cache.
+    """
+    import streamlit as st
+
+    choice = st.radio("Format", ["Excel", "CSV (gzip)"], horizontal=True, key=f"{key}_format")
+    fmt = "csv" if choice.startswith("CSV") else "xlsx"
+    extension, mime = FORMATS[fmt]
+    name = ("sql", sql, tuple(sorted((k, str(v)) for k, v in (params or {}).items())), fmt)
+    lazy_download(
+        label, engine, name, tables,
+        lambda: export(engine, sql, params, fmt)[0],
+        f"{file_stem}.{extension}", mime, key,
+    )
+
+
+# --- Mesure ---
+
+def _benchmark(url, rows, fmt):
+    import tracemalloc
+
+    import pandas as pd
+
+    from db_utils import get_engine
+    from query_plans import seed_synthetic
+
+    engine = get_engine(url)
+    if rows:
+        print(f"⏳ Insertion de {rows} achats synthétiques...")
+        with engine.begin() as conn:
+            seed_synthetic(conn, rows)
+    sql = "SELECT * FROM purchases ORDER BY date, id"
+
+    # tracemalloc ralentit nettement les deux mesures : comparer les rapports, pas les durées absolues
+    tracemalloc.start()
+    data, extension, _ = export(engine, sql, fmt=fmt)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    timing = last_export()
+    print(f"✅ export_utils ({extension}) : {timing['rows']} lignes, {timing['seconds']:.2f} s, "
+          f"{len(data) / 1e6:.1f} Mo, pic mémoire {peak / 1e6:.1f} Mo")
+
+    # Référence : l'ancien to_excel() de chaque page (DataFrame complet + ExcelWriter)
+    tracemalloc.start()
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        frame = pd.read_sql(text(sql), conn)
+    output = io.BytesIO()
+    if fmt == "csv":
+        frame.to_csv(output, index=False, compression="gzip")
+    else:
+        with pd.ExcelWriter(output, engine="openpyxl") as writer:
+            frame.to_excel(writer, index=False)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"ℹ️ pandas ({fmt}) : {time.perf_counter() - started:.2f} s, pic mémoire {peak / 1e6:.1f} Mo")
+    engine.dispose()
+
+
+def main(argv):
+    rows, fmt = 200_000, "xlsx"
+    argv = list(argv)
+    if "--rows" in argv:
+        i = argv.index("--rows")
+        rows = int(argv[i + 1])
+        del argv[i:i + 2]
+    if "--format" in argv:
+        i = argv.index("--format")
+        fmt = argv[i + 1]
+        del argv[i:i + 2]
+
+    if argv:
+        # Base existante : on exporte ses données telles quelles
+        _benchmark(argv[0], 0, fmt)
+        return 0
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, "export.db")
+    try:
+        _benchmark(f"sqlite:///{path}", rows, fmt)
+    finally:
+        os.remove(path)
+        os.rmdir(tmpdir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
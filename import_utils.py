@@ -0,0 +1,328 @@
+# import_utils.py
+# Import en masse d'achats depuis un fichier CSV ou XLSX.
+# Le fichier est lu en flux, chaque ligne est validée puis insérée par lots
+# dans UNE transaction (executemany sous SQLite, COPY sous PostgreSQL).
+# Usage : python import_utils.py fichier.csv|fichier.xlsx [--url URL] [--dry-run] [--fallback-category "📦 Divers"]
+
+import csv
+import io
+import math
+import re
+import sys
+import time
+from datetime import date, datetime
+
+from sqlalchemy import text
+
+from cache_utils import bump_table_version
+from db_utils import begin_write
+from categories import CATEGORIES
+from rollup_utils import purchases_inserted
+from search_utils import index_purchases_after, normalize
+
+BATCH_SIZE = 1000
+MAX_REJECTS = 1000            # lignes rejetées détaillées dans le rapport
+
+COLUMNS = ["product", "category", "subcategory", "supplier", "quantity", "purchase_price", "sale_price", "date"]
+REQUIRED = ["product", "quantity", "date"]
+
+# En-têtes acceptés (normalisés : minuscules, sans accents ni unité entre parenthèses)
+HEADER_ALIASES = {
+    "product": ["product", "produit", "nom du produit", "article", "designation"],
+    "category": ["category", "categorie"],
+    "subcategory": ["subcategory", "sous categorie", "sous-categorie"],
+    "supplier": ["supplier", "fournisseur"],
+    "quantity": ["quantity", "quantite", "qte"],
+    "purchase_price": ["purchase_price", "purchase price", "prix d'achat", "prix achat",
+                       "prix d'achat unitaire", "price", "prix"],
+    "sale_price": ["sale_price", "sale price", "prix de vente", "prix vente", "prix de vente unitaire"],
+    "date": ["date", "date d'achat"],
+}
+DATE_FORMATS = ["%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%Y/%m/%d"]
+
+INSERT_SQL = """
+    INSERT INTO purchases (product, category, subcategory, supplier, quantity, purchase_price, sale_price, date)
+    VALUES (:product, :category, :subcategory, :supplier, :quantity, :purchase_price, :sale_price, :date)
+"""
+
+
+# --- Correspondances en-têtes / catégories ---
+
+def _header_key(value):
+    return re.sub(r"\(.*?\)", "", normalize(value)).replace("_", " ").strip()
+
+
+_HEADERS = {
+    alias.replace("_", " "): column
+    for column, aliases in HEADER_ALIASES.items()
+    for alias in aliases
+}
+
+
+def map_headers(header):
+    """Retourne {index de colonne: nom canonique} pour les colonnes reconnues."""
+    mapping = {}
+    for i, name in enumerate(header):
+        column = _HEADERS.get(_header_key(name or ""))
+        if column and column not in mapping.values():
+            mapping[i] = column
+    return mapping
+
+
+def _label(value):
+    # '🥛 Produits Laitiers' -> 'produits laitiers'
+    return re.sub(r"^\W+", "", normalize(value))
+
+
+def _build_category_index():
+    by_name, by_hint = {}, {}
+    for key, spec in CATEGORIES.items():
+        by_name[normalize(key)] = key
+        by_name[_label(key)] = key
+        subs = spec.get("subcategories") or []
+        if isinstance(subs, dict):
+            subs = list(subs) + [s for details in subs.values() for s in details]
+        for hint in list(subs) + list(spec.get("suppliers") or []):
+            # 'Autre' apparaît dans plusieurs catégories : pas de déduction possible
+            by_hint.setdefault(_label(hint), set()).add(key)
+    return by_name, {hint: keys.pop() for hint, keys in by_hint.items() if len(keys) == 1}
+
+
+_CATEGORY_NAMES, _CATEGORY_HINTS = _build_category_index()
+
+
+def map_category(category, subcategory=None, supplier=None):
+    """
+    Retrouve la clé de CATEGORIES à partir d'un libellé avec ou sans emoji,
+    ou, à défaut, à partir de la sous-catégorie puis du fournisseur.
+    Retourne None si rien ne correspond.
+    """
+    if category:
+        return _CATEGORY_NAMES.get(normalize(category)) or _CATEGORY_NAMES.get(_label(category))
+    for hint in (subcategory, supplier):
+        if hint and _label(hint) in _CATEGORY_HINTS:
+            return _CATEGORY_HINTS[_label(hint)]
+    return None
+
+
+# --- Lecture en flux ---
+
+def _iter_csv(source):
+    stream = io.TextIOWrapper(source, encoding="utf-8-sig", newline="") if not isinstance(source, io.TextIOBase) else source
+    first = stream.readline()
+    delimiter = ";" if first.count(";") > first.count(",") else ","
+    yield next(csv.reader([first], delimiter=delimiter))
+    yield from csv.reader(stream, delimiter=delimiter)
+
+
+def _iter_xlsx(source):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def iter_rows(source, filename):
+    """Itère sur les lignes brutes (en-tête compris) d'un fichier binaire CSV ou XLSX."""
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        return _iter_xlsx(source)
+    return _iter_csv(source)
+
+
+# --- Validation ---
+
+def _number(value):
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return float(str(value).strip().replace(" ", "").replace(",", "."))
+
+
+def _date(value):
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    value = str(value).strip()[:10]
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            continue
+    raise ValueError(f"date invalide : {value!r}")
+
+
+def validate_row(raw, fallback_category=None):
+    """
+    Valide une ligne {colonne canonique: valeur brute}.
+    Retourne (ligne prête à insérer, None) ou (None, motif du rejet).
+    """
+    for column in REQUIRED:
+        if raw.get(column) is None or not str(raw[column]).strip():
+            return None, f"{column} manquant"
+
+    def clean(column):
+        value = raw.get(column)
+        return str(value).strip() if value is not None else ""
+
+    try:
+        quantity = _number(raw["quantity"])
+        purchase_price = _number(raw.get("purchase_price"))
+        sale_price = _number(raw.get("sale_price"))
+        day = _date(raw["date"])
+    except ValueError as e:
+        return None, str(e)
+    # "nan" / "inf" passent float() : rejetés ici plutôt que d'interrompre l'import
+    if quantity is None or not math.isfinite(quantity) or quantity <= 0 or quantity != int(quantity):
+        return None, f"quantité invalide : {raw['quantity']!r}"
+    for column, price in (("purchase_price", purchase_price), ("sale_price", sale_price)):
+        if price is not None and not math.isfinite(price):
+            return None, f"prix invalide : {raw.get(column)!r}"
+    if (purchase_price is not None and purchase_price < 0) or (sale_price is not None and sale_price < 0):
+        return None, "prix négatif"
+
+    category = map_category(clean("category"), clean("subcategory"), clean("supplier")) or fallback_category
+    if not category:
+        return None, f"catégorie inconnue : {clean('category')!r}"
+
+    return {
+        "product": clean("product"),
+        "category": category,
+        "subcategory": clean("subcategory"),
+        "supplier": clean("supplier"),
+        "quantity": int(quantity),
+        "purchase_price": purchase_price,
+        "sale_price": sale_price,
+        "date": day,
+    }, None
+
+
+# --- Insertion par lots ---
+
+def _copy_batch(conn, batch):
+    # COPY ... FROM STDIN via le curseur psycopg2 de la connexion en cours
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in batch:
+        writer.writerow(["\\N" if row[c] is None else row[c] for c in COLUMNS])
+    buffer.seek(0)
+    cursor = conn.connection.driver_connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY purchases ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer
+        )
+    finally:
+        cursor.close()
+
+
+def _insert_batch(conn, batch):
+    if conn.dialect.name == "postgresql" and conn.dialect.driver == "psycopg2":
+        _copy_batch(conn, batch)
+    else:
+        conn.execute(text(INSERT_SQL), batch)
+    purchases_inserted(conn, batch)
+
+
+def insert_purchases(conn, rows, batch_size=BATCH_SIZE):
+    """
+    Insère des lignes déjà validées (voir validate_row) dans la transaction
+    `conn`, par lots, avec synthèses, index de recherche et version de table.
+    """
+    last_id = _last_id(conn)
+    for start in range(0, len(rows), batch_size):
+        _insert_batch(conn, rows[start:start + batch_size])
+    _after_insert(conn, last_id)
+
+
+def _last_id(conn):
+    return conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM purchases")).scalar()
+
+
+def _after_insert(conn, last_id):
+    index_purchases_after(conn, last_id)
+    bump_table_version(conn, "purchases")
+
+
+def import_purchases(engine, source, filename, fallback_category=None, dry_run=False, batch_size=BATCH_SIZE):
+    """
+    Importe les achats d'un fichier (objet binaire) dans une seule transaction.
+    Retourne un rapport : read, inserted, rejected, rejects [(ligne, motif)],
+    seconds, rows_per_second. Avec dry_run, rien n'est écrit.
+    """
+    report = {"read": 0, "inserted": 0, "rejected": 0, "rejects": [], "seconds": 0.0, "rows_per_second": 0.0}
+    started = time.perf_counter()
+    rows = iter_rows(source, filename)
+    mapping = map_headers(next(rows, None) or [])
+    missing = [c for c in REQUIRED if c not in mapping.values()]
+    if missing:
+        raise ValueError(f"Colonnes obligatoires absentes : {', '.join(missing)}")
+
+    # Une vérification seule ne prend pas le verrou d'écriture
+    with (engine.begin() if dry_run else begin_write(engine)) as conn:
+        last_id = _last_id(conn)
+        batch = []
+        for line, values in enumerate(rows, start=2):
+            if not any(v not in (None, "") for v in values):
+                continue
+            report["read"] += 1
+            raw = {column: values[i] for i, column in mapping.items() if i < len(values)}
+            row, reason = validate_row(raw, fallback_category)
+            if reason:
+                report["rejected"] += 1
+                if len(report["rejects"]) < MAX_REJECTS:
+                    report["rejects"].append((line, reason))
+                continue
+            report["inserted"] += 1
+            if dry_run:
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                _insert_batch(conn, batch)
+                batch = []
+        if batch:
+            _insert_batch(conn, batch)
+        if report["inserted"] and not dry_run:
+            _after_insert(conn, last_id)
+
+    report["seconds"] = time.perf_counter() - started
+    report["rows_per_second"] = report["read"] / report["seconds"] if report["seconds"] else 0.0
+    return report
+
+
+def main(argv):
+    from db_utils import get_engine
+
+    def option(name, default=None):
+        if name in argv:
+            i = argv.index(name)
+            value = argv[i + 1]
+            del argv[i:i + 2]
+            return value
+        return default
+
+    argv = list(argv)
+    url = option("--url", "sqlite:///supermarket.db")
+    fallback = option("--fallback-category")
+    dry_run = "--dry-run" in argv
+    argv = [a for a in argv if a != "--dry-run"]
+    if not argv:
+        print("Usage : python import_utils.py fichier [--url URL] [--dry-run] [--fallback-category X]")
+        return 2
+
+    with open(argv[0], "rb") as f:
+        report = import_purchases(get_engine(url), f, argv[0], fallback, dry_run)
+
+    for line, reason in report["rejects"][:50]:
+        print(f"❌ ligne {line} : {reason}")
+    verb = "valides (simulation)" if dry_run else "insérées"
+    print(f"✅ {report['inserted']} ligne(s) {verb}, {report['rejected']} rejetée(s) sur {report['read']} "
+          f"en {report['seconds']:.2f} s ({report['rows_per_second']:.0f} lignes/s).")
+    return 1 if report["rejected"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
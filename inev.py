@@ -1,60 +1,24 @@
 # --- inev.py ---
 
 import streamlit as st
-import sqlite3
 from datetime import datetime
 import pandas as pd
-from lang_utils import get_translation
+from lang_utils import translator
+from db_utils import get_engine
+from categories import CATEGORIES
+from repository import get_repository
 
 # --- LANGUE ---
 lang = st.sidebar.selectbox("🌍 Langue / اللغة", ["fr", "ar"], index=0)
-_ = lambda key: get_translation(key, lang)
-
-# --- CATÉGORIES ---
-CATEGORIES = {
-    "🍼 Dépôt": {"subcategories": ["Medded", "Mlika", "Jamila"], "suppliers": []},
-    "🍰 Cake": {"subcategories": ["Tom", "Moulin d'Or"], "suppliers": []},
-    "🥛 Produits Laitiers": {"subcategories": ["Lait", "Yaourt"], "suppliers": ["Delice", "Vitalait", "Centrale"]},
-    "🍗 Volaille": {"subcategories": ["Mazra", "Jalel"], "suppliers": ["SOTUVI", "CHA"]},
-    "🍾 Farine": {"subcategories": [], "suppliers": ["Grands Moulins", "Minoterie"]},
-    "🥤 Liquides": {"subcategories": ["Eau", "Boissons Gazeuses", "Jus"], "suppliers": ["Cristal", "Coca-Cola", "Pepsi"]},
-    "🧴 Hygiène & Beauté": {
-        "subcategories": {
-            "🧼 Hygiène": ["Judy", "Lilas", "Nawar", "Syso", "Sunsilk", "Autre"],
-            "💄 Beauté": ["Yassine", "L'Oréal", "Autre"]
-        },
-        "suppliers": []
-    },
-    "🧀 Fromage": {"subcategories": ["Majesté", "Landor", "Traditionnel"], "suppliers": []},
-    "🥩 Twebel": {"subcategories": ["Twebel", "Elmalah"], "suppliers": []},
-    "🍦 Glace": {"subcategories": [], "suppliers": ["Frigo", "Polar"]},
-    "🥖 Daily": {"subcategories": ["Gâteaux", "Pain"], "suppliers": ["Boulangerie du Coin", "Fournée Dorée"]},
-    "🐶 Animaux": {"subcategories": ["Pet's"], "suppliers": ["Royal Canin", "Pedigree"]},
-    "🏠 Maison": {"subcategories": [], "suppliers": []},
-    "📦 Divers": {"subcategories": [], "suppliers": []},
-    "🎉 Autres": {"subcategories": [], "suppliers": []}
-}
+_ = translator(lang)
 
 st.title("👚 " + _("Supermarket Expense Tracker"))
 
 # --- BASE DE DONNÉES ---
 DB_PATH = "supermarket.db"
-conn = sqlite3.connect(DB_PATH)
-cursor = conn.cursor()
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS purchases (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    product TEXT,
-    category TEXT,
-    subcategory TEXT,
-    supplier TEXT,
-    quantity INTEGER,
-    price REAL,
-    date TEXT
-)
-""")
-conn.commit()
+# Schéma créé/migré une seule fois par processus (voir db_migrations.py)
+engine = get_engine(f"sqlite:///{DB_PATH}")
+repo = get_repository(engine)
 
 # --- FORMULAIRE AJOUT ---
 st.header(_("Add a product"))
@@ -90,21 +54,56 @@ with st.form("add_product_form", clear_on_submit=True):
         elif price <= 0:
             st.error(_("Price must be greater than 0."))
         else:
-            cursor.execute("""
-                INSERT INTO purchases (product, category, subcategory, supplier, quantity, price, date)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (product.strip(), category, subcategory, supplier.strip(), quantity, price, date.strftime("%Y-%m-%d")))
-            conn.commit()
+            # Achat et tables de synthèse dans la même transaction (prix = prix d'achat)
+            repo.add_purchase(
+                product, quantity, purchase_price=price, date=date,
+                category=category, subcategory=subcategory, supplier=supplier,
+            )
             st.success(f"{_('Added')} {product} (x{quantity}) = {quantity * price:.2f} TND")
 
-# --- HISTORIQUE DES ACHATS ---
+# --- HISTORIQUE DES ACHATS (pagination par clé date/id) ---
+PAGE_SIZES = [10, 25, 50, 100]
+
+
+def load_history_page(page_size, cursor=None, start=None, end=None, category=None):
+    """
+    Charge une page de l'historique, triée par date puis id décroissants.
+    `cursor` = (date, id) de la dernière ligne de la page précédente.
+    Retourne (lignes, il_reste_des_pages).
+    """
+    page = repo.purchases(start, end, category=category, cursor=cursor, limit=page_size + 1)
+    # Prix d'achat unifié (colonne historique `price` ou purchase_price)
+    page = page.rename(columns={"purchase_price": "price"})
+    return page.head(page_size), len(page) > page_size
+
+
 st.subheader(f"📋 {_('Purchase History')}")
-df = pd.read_sql_query("SELECT * FROM purchases ORDER BY date DESC", conn)
-conn.close()
+
+col_period, col_cat, col_size = st.columns([3, 3, 1])
+with col_period:
+    period = st.date_input(_("Period"), value=(), key="history_period")
+with col_cat:
+    history_category = st.selectbox(_("Category"), [_("All")] + list(CATEGORIES.keys()), key="history_category")
+with col_size:
+    page_size = st.selectbox(_("Per page"), PAGE_SIZES, index=1, key="history_page_size")
+
+start_filter = period[0] if len(period) > 0 else None
+end_filter = period[1] if len(period) > 1 else None
+category_filter = None if history_category == _("All") else history_category
+
+# Changer un filtre ramène à la première page
+filters = (start_filter, end_filter, category_filter, page_size)
+if st.session_state.get("history_filters") != filters:
+    st.session_state["history_filters"] = filters
+    st.session_state["history_cursors"] = []
+
+cursors = st.session_state["history_cursors"]
+df, has_next = load_history_page(page_size, cursors[-1] if cursors else None, *filters[:3])
 
 if df.empty:
     st.info(_("No purchases found."))
 else:
+    # Boutons modifier/supprimer pour la page visible uniquement
     for i, row in df.iterrows():
         col1, col2, col3 = st.columns([6, 1, 1])
         with col1:
@@ -115,26 +114,34 @@ else:
             """)
         with col2:
             if st.button("📝", key=f"edit_{row['id']}"):
-                st.session_state["edit_id"] = row['id']
+                st.session_state["edit_id"] = int(row['id'])
                 st.experimental_rerun()
         with col3:
             if st.button("🖑️", key=f"delete_{row['id']}"):
-                conn = sqlite3.connect(DB_PATH)
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM purchases WHERE id = ?", (row['id'],))
-                conn.commit()
-                conn.close()
+                repo.delete_purchase(int(row['id']))
                 st.success(f"{_('Deleted')} {row['product']} {_('on')} {row['date']}")
                 st.experimental_rerun()
 
+col_prev, col_page, col_next = st.columns([1, 4, 1])
+with col_prev:
+    if cursors and st.button("◀️ " + _("Previous"), key="history_prev"):
+        cursors.pop()
+        st.experimental_rerun()
+with col_page:
+    st.caption(f"{_('Page')} {len(cursors) + 1}")
+with col_next:
+    if has_next and st.button(_("Next") + " ▶️", key="history_next"):
+        last = df.iloc[-1]
+        cursors.append((str(last["date"]), int(last["id"])))
+        st.experimental_rerun()
+
 # --- FORMULAIRE MODIFICATION ---
 if "edit_id" in st.session_state:
     edit_id = st.session_state["edit_id"]
-    conn = sqlite3.connect(DB_PATH)
-    row = conn.execute("SELECT * FROM purchases WHERE id = ?", (edit_id,)).fetchone()
-    conn.close()
+    row = repo.purchase(edit_id)
     if row:
-        id_, product, category, subcategory, supplier, quantity, price, date = row
+        product, category, subcategory, supplier = row["product"], row["category"], row["subcategory"], row["supplier"]
+        quantity, price, date = row["quantity"], row["purchase_price"], row["date"]
         st.subheader(f"📝 {_('Modify Entry')}")
         with st.form("edit_form"):
             new_product = st.text_input(_("Product"), value=product)
@@ -142,22 +149,23 @@ if "edit_id" in st.session_state:
             new_subcategory = st.text_input(_("Subcategory"), value=subcategory)
             new_supplier = st.text_input(_("Supplier"), value=supplier)
             new_quantity = st.number_input(_("Quantity"), min_value=1, value=quantity)
-            new_price = st.number_input(_("Price"), min_value=0.01, value=price, step=0.01)
+            new_price = st.number_input(_("Price"), min_value=0.01, value=float(price or 0.01), step=0.01)
             new_date = st.date_input(_("Date"), value=pd.to_datetime(date))
 
             save = st.form_submit_button(_("Save Changes"))
             cancel = st.form_submit_button(_("Cancel"))
 
             if save:
-                conn = sqlite3.connect(DB_PATH)
-                cursor = conn.cursor()
-                cursor.execute("""
-                    UPDATE purchases
-                    SET product=?, category=?, subcategory=?, supplier=?, quantity=?, price=?, date=?
-                    WHERE id=?
-                """, (new_product, new_category, new_subcategory, new_supplier, new_quantity, new_price, new_date.strftime("%Y-%m-%d"), edit_id))
-                conn.commit()
-                conn.close()
+                changes = {
+                    "product": new_product,
+                    "category": new_category,
+                    "subcategory": new_subcategory,
+                    "supplier": new_supplier,
+                    "quantity": new_quantity,
+                    "purchase_price": new_price,
+                    "date": new_date,
+                }
+                repo.update_purchase(edit_id, **changes)
                 st.success(_("Entry updated successfully!"))
                 del st.session_state["edit_id"]
                 st.experimental_rerun()
@@ -0,0 +1,448 @@
+# journal_utils.py
+# Journal local des saisies de caisse, crédits et dépenses : une saisie est
+# enregistrée tout de suite dans un petit fichier SQLite (journal.db) puis
+# envoyée à la base distante par un thread de synchronisation, par lots.
+# Chaque entrée porte un identifiant généré au poste (client_id) : renvoyer
+# un lot déjà reçu n'insère rien (INSERT ... ON CONFLICT DO NOTHING).
+# Si le lien tombe, les saisies continuent et partent au retour du réseau.
+# Une entrée refusée par la base distante (contrainte, donnée invalide) ne
+# bloque pas les autres : le lot est renvoyé ligne à ligne, et après
+# MAX_ATTEMPTS refus l'entrée passe dans journal_rejected.
+# Usage : python journal_utils.py [url distante] [--journal journal.db] [status|sync|retry|simulate]
+# Sans url, `simulate` utilise une seconde base SQLite comme base distante.
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from datetime import date as date_type
+
+from sqlalchemy import text
+from sqlalchemy.exc import InterfaceError, OperationalError, SQLAlchemyError
+
+from cache_utils import bump_table_version
+from db_utils import begin_write, get_engine
+from repository import get_repository
+from rollup_utils import cash_inserted
+
+JOURNAL_PATH = os.environ.get("JOURNAL_PATH", "journal.db")
+BATCH_SIZE = 500              # entrées envoyées par transaction distante
+SYNC_INTERVAL = 2.0           # attente entre deux passages sans nouvelle saisie (s)
+MAX_BACKOFF = 60.0            # attente max après des échecs successifs (s)
+MAX_PENDING = 50_000          # au-delà, les saisies attendent (contre-pression)
+BACKPRESSURE_WAIT = 5.0       # attente max d'une saisie quand le journal est plein (s)
+MAX_ATTEMPTS = 5              # refus avant mise à l'écart dans journal_rejected
+
+# Table distante -> colonnes propres (en plus de client_id, montant, date)
+JOURNAL_TABLES = {"caisse": ("periode",), "credits": ("note",), "expenses": ("type",)}
+
+_journals = {}
+_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+
+class JournalFull(Exception):
+    """Trop d'entrées en attente : la base distante est injoignable depuis longtemps."""
+
+
+def _offline(error):
+    # Lien coupé ou base indisponible : rien à reprocher aux entrées elles-mêmes
+    return isinstance(error, (OperationalError, InterfaceError)) or getattr(error, "connection_invalidated", False)
+
+
+class Journal:
+    """
+    Saisies en attente d'envoi vers `remote`. Mêmes méthodes d'écriture que
+    repository.Repository (add_cash, add_credit, add_expense).
+    """
+
+    def __init__(self, remote, path=JOURNAL_PATH):
+        self.remote = remote
+        self.local = get_engine(f"sqlite:///{path}", auto_migrate=False)
+        with begin_write(self.local) as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS journal (
+                    client_id TEXT PRIMARY KEY,
+                    table_name TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                )
+            """))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_journal_created ON journal (created_at)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_journal_attempts ON journal (attempts, created_at)"))
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS journal_rejected (
+                    client_id TEXT PRIMARY KEY,
+                    table_name TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL,
+                    error TEXT,
+                    rejected_at REAL NOT NULL
+                )
+            """))
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "synced": 0, "batches": 0, "errors": 0, "last_error": None,
+            "last_sync": None, "last_batch": 0, "last_batch_seconds": 0.0, "online": None,
+        }
+
+    # --- Saisie ---
+
+    def pending(self):
+        with self.local.connect() as conn:
+            return conn.execute(text("SELECT COUNT(*) FROM journal")).scalar()
+
+    def record(self, table, montant, date, **values):
+        """Ajoute une entrée au journal et retourne son client_id (sans attendre le réseau)."""
+        if table not in JOURNAL_TABLES:
+            raise ValueError(f"Table non journalisée : {table}")
+        deadline = time.monotonic() + BACKPRESSURE_WAIT
+        while self.pending() >= MAX_PENDING:
+            self._wake.set()
+            if time.monotonic() >= deadline:
+                raise JournalFull(f"{MAX_PENDING} saisies en attente d'envoi")
+            time.sleep(0.2)
+
+        client_id = uuid.uuid4().hex
+        if isinstance(date, date_type):
+            date = date.isoformat()
+        payload = {"montant": float(montant), "date": str(date)[:10], **values}
+        with begin_write(self.local) as conn:
+            conn.execute(text("""
+                INSERT INTO journal (client_id, table_name, payload, created_at)
+                VALUES (:client_id, :table, :payload, :created_at)
+            """), {"client_id": client_id, "table": table, "payload": json.dumps(payload), "created_at": time.time()})
+        self._wake.set()
+        return client_id
+
+    def add_cash(self, montant, date, periode):
+        return self.record("caisse", montant, date, periode=periode)
+
+    def add_credit(self, montant, date, note=""):
+        return self.record("credits", montant, date, note=note)
+
+    def add_expense(self, montant, date, type):
+        return self.record("expenses", montant, date, type=type)
+
+    # --- Synchronisation ---
+
+    def _push(self, table, entries):
+        """Envoie les entrées d'une table ; retourne le nombre de lignes réellement insérées."""
+        backend = get_repository(self.remote).backend
+        columns = ("client_id", "montant", "date") + JOURNAL_TABLES[table]
+        params, rows = {}, []
+        for i, (client_id, payload) in enumerate(entries):
+            values = {**payload, "client_id": client_id, "date": backend.date(payload["date"])}
+            rows.append("(" + ", ".join(f":{c}_{i}" for c in columns) + ")")
+            params.update({f"{c}_{i}": values.get(c) for c in columns})
+        with backend.begin() as conn:
+            inserted = conn.execute(text(f"""
+                INSERT INTO {table} ({", ".join(columns)})
+                VALUES {", ".join(rows)}
+                ON CONFLICT (client_id) DO NOTHING
+                RETURNING montant, date
+            """), params).fetchall()
+            # Seules les lignes nouvelles comptent dans les synthèses
+            for montant, day in inserted:
+                cash_inserted(conn, table, montant, day)
+            if inserted:
+                bump_table_version(conn, table)
+        return len(inserted)
+
+    def _send(self, rows):
+        """Envoie des lignes (client_id, table_name, payload) du journal, groupées par table."""
+        by_table = {}
+        for client_id, table, payload in rows:
+            by_table.setdefault(table, []).append((client_id, json.loads(payload)))
+        for table, entries in by_table.items():
+            self._push(table, entries)
+
+    def sync_once(self, batch_size=BATCH_SIZE):
+        """
+        Envoie un lot (entrées jamais refusées d'abord, les plus anciennes en
+        tête) ; retourne le nombre d'entrées retirées du journal (envoyées ou
+        mises à l'écart). Si le lot est refusé, chaque entrée est renvoyée
+        seule : seules les fautives restent, avec un refus de plus.
+        """
+        with self.local.connect() as conn:
+            batch = conn.execute(text("""
+                SELECT client_id, table_name, payload, created_at, attempts FROM journal
+                ORDER BY attempts, created_at LIMIT :limit
+            """), {"limit": batch_size}).fetchall()
+        if not batch:
+            return 0
+
+        started = time.perf_counter()
+        sent, failed = [], []
+        try:
+            self._send([row[:3] for row in batch])
+            sent = batch
+        except Exception as e:
+            if isinstance(e, SQLAlchemyError) and _offline(e):
+                raise
+            for row in batch:
+                try:
+                    self._send([row[:3]])
+                    sent.append(row)
+                except Exception as e:
+                    if isinstance(e, SQLAlchemyError) and _offline(e):
+                        # Les entrées déjà reçues sont purgées avant de remonter l'erreur
+                        self._settle(sent, failed)
+                        raise
+                    failed.append((row, str(e).splitlines()[0] if str(e) else type(e).__name__))
+        rejected = self._settle(sent, failed)
+
+        with self._stats_lock:
+            self.stats.update({
+                "synced": self.stats["synced"] + len(sent),
+                "batches": self.stats["batches"] + 1,
+                "last_sync": time.time(),
+                "last_batch": len(sent),
+                "last_batch_seconds": time.perf_counter() - started,
+                "online": True,
+            })
+            if failed:
+                self.stats["last_error"] = failed[-1][1]
+        return len(sent) + rejected
+
+    def _settle(self, sent, failed):
+        """Purge les entrées reçues, compte les refus ; retourne le nombre d'entrées mises à l'écart."""
+        rejected = [
+            {"client_id": client_id, "table": table, "payload": payload, "created_at": created_at,
+             "attempts": attempts + 1, "error": error, "rejected_at": time.time()}
+            for (client_id, table, payload, created_at, attempts), error in failed
+            if attempts + 1 >= MAX_ATTEMPTS
+        ]
+        retried = [{"client_id": row[0]} for row, _ in failed if row[4] + 1 < MAX_ATTEMPTS]
+        with begin_write(self.local) as conn:
+            # Reçu par la base distante : retiré du journal (un renvoi serait sans effet)
+            removed = [{"client_id": row[0]} for row in sent] + [{"client_id": r["client_id"]} for r in rejected]
+            if removed:
+                conn.execute(text("DELETE FROM journal WHERE client_id = :client_id"), removed)
+            if retried:
+                conn.execute(text("UPDATE journal SET attempts = attempts + 1 WHERE client_id = :client_id"), retried)
+            if rejected:
+                conn.execute(text("""
+                    INSERT OR REPLACE INTO journal_rejected
+                        (client_id, table_name, payload, created_at, attempts, error, rejected_at)
+                    VALUES (:client_id, :table, :payload, :created_at, :attempts, :error, :rejected_at)
+                """), rejected)
+        for entry in rejected:
+            logger.warning("Saisie %s (%s) refusée %d fois, mise à l'écart : %s",
+                           entry["client_id"], entry["table"], entry["attempts"], entry["error"])
+        return len(rejected)
+
+    def retry_rejected(self):
+        """Remet les entrées mises à l'écart dans le journal (après correction côté serveur)."""
+        with begin_write(self.local) as conn:
+            count = conn.execute(text("""
+                INSERT OR IGNORE INTO journal (client_id, table_name, payload, created_at, attempts)
+                SELECT client_id, table_name, payload, created_at, 0 FROM journal_rejected
+            """)).rowcount
+            conn.execute(text("DELETE FROM journal_rejected"))
+        self._wake.set()
+        return count
+
+    def _run(self):
+        backoff = 0.0
+        while not self._stop.is_set():
+            try:
+                while self.sync_once() and not self._stop.is_set():
+                    pass
+                backoff = 0.0
+            except Exception as e:
+                # Toute erreur (réseau, fichier local...) est consignée : le thread ne doit pas mourir
+                if not isinstance(e, SQLAlchemyError):
+                    logger.exception("Synchronisation du journal interrompue")
+                with self._stats_lock:
+                    self.stats.update({
+                        "errors": self.stats["errors"] + 1,
+                        "last_error": (str(e).splitlines() or [type(e).__name__])[0],
+                        "online": False if isinstance(e, SQLAlchemyError) else self.stats["online"],
+                    })
+                backoff = min(max(backoff * 2, 1.0), MAX_BACKOFF)
+            if backoff:
+                # Hors ligne : une nouvelle saisie ne raccourcit pas l'attente
+                self._stop.wait(backoff)
+            else:
+                self._wake.wait(SYNC_INTERVAL)
+            self._wake.clear()
+
+    def start(self):
+        """Démarre le thread de synchronisation (une seule fois)."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="journal-sync", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def sync_stats(self):
+        """pending, lag (âge de la plus ancienne entrée, s), rejected, synced, batches, errors, online..."""
+        with self.local.connect() as conn:
+            pending, oldest = conn.execute(text("SELECT COUNT(*), MIN(created_at) FROM journal")).one()
+            rejected = conn.execute(text("SELECT COUNT(*) FROM journal_rejected")).scalar()
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats.update({"pending": pending, "lag": time.time() - oldest if oldest else 0.0, "rejected": rejected})
+        return stats
+
+
+def get_journal(remote=None, path=JOURNAL_PATH):
+    """Journal partagé par le processus pour `remote`, thread de synchronisation démarré."""
+    remote = remote or get_engine()
+    key = (remote.url, os.path.abspath(path))
+    with _lock:
+        journal = _journals.get(key)
+        if journal is None:
+            journal = _journals[key] = Journal(remote, path)
+        # Relance le thread s'il s'est arrêté
+        journal.start()
+    return journal
+
+
+def cash_writer(engine=None):
+    """
+    Pour les formulaires de caisse : le journal si la base est distante
+    (PostgreSQL), le dépôt directement si elle est déjà locale (SQLite).
+    """
+    engine = engine or get_engine()
+    if engine.dialect.name == "sqlite":
+        return get_repository(engine)
+    return get_journal(engine)
+
+
+def sync_caption(writer):
+    """Sous un formulaire : saisies pas encore envoyées (rien si `writer` écrit directement)."""
+    import streamlit as st
+
+    if not isinstance(writer, Journal):
+        return
+    stats = writer.sync_stats()
+    if stats["pending"]:
+        st.caption(
+            f"⏳ {stats['pending']} saisie(s) en attente d'envoi, retard {stats['lag']:.0f} s"
+            + (" · base distante injoignable" if stats["online"] is False else "")
+        )
+    if stats["rejected"]:
+        st.warning(
+            f"⛔ {stats['rejected']} saisie(s) refusée(s) par la base distante ({stats['last_error'] or 'voir journal_rejected'}) : "
+            "elles sont gardées sur ce poste, `python journal_utils.py retry` les renvoie."
+        )
+
+
+# --- Ligne de commande ---
+
+def _simulate(remote_url, path, entries=2000):
+    from rollup_utils import verify
+
+    remote = get_engine(remote_url)
+    journal = Journal(remote, path)
+    latencies = []
+
+    def burst(count):
+        for i in range(count):
+            start = time.perf_counter()
+            journal.add_cash(10 + i % 5, date_type(2026, 1, 1 + i % 28), "🕐 04–14")
+            latencies.append(time.perf_counter() - start)
+
+    # Réseau coupé : rien ne part, les saisies restent rapides
+    burst(entries // 2)
+    print(f"📴 hors ligne : {journal.pending()} en attente")
+    journal.start()
+    burst(entries - entries // 2)
+    deadline = time.monotonic() + 120
+    while journal.pending() and time.monotonic() < deadline:
+        time.sleep(0.1)
+    journal.stop()
+    stats = journal.sync_stats()
+    latencies.sort()
+    print(f"✅ {stats['synced']} envoyées en {stats['batches']} lots, {stats['pending']} en attente ; "
+          f"saisie p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms")
+
+    # Rejeu d'un lot déjà reçu (coupure entre l'envoi et la purge du journal)
+    with remote.connect() as conn:
+        sample = conn.execute(text(
+            "SELECT client_id, montant, date, periode FROM caisse WHERE client_id IS NOT NULL LIMIT 100"
+        )).fetchall()
+    replayed = journal._push("caisse", [
+        (client_id, {"montant": montant, "date": str(day), "periode": periode})
+        for client_id, montant, day, periode in sample
+    ])
+    with remote.connect() as conn:
+        total, distinct = conn.execute(text(
+            "SELECT COUNT(client_id), COUNT(DISTINCT client_id) FROM caisse"
+        )).one()
+        gaps = verify(conn)
+    print(f"{'✅' if replayed == 0 and total == distinct else '❌'} rejeu : {replayed} insérée(s), "
+          f"{total} lignes journalisées, {distinct} distinctes ; synthèses : {len(gaps)} écart(s)")
+
+    # Une entrée invalide (sans date) au milieu de saisies valides
+    with begin_write(journal.local) as conn:
+        conn.execute(text("""
+            INSERT INTO journal (client_id, table_name, payload, created_at)
+            VALUES ('invalide', 'caisse', '{"montant": 1.0}', 0)
+        """))
+    burst(20)
+    for _ in range(MAX_ATTEMPTS):
+        journal.sync_once()
+    stats = journal.sync_stats()
+    print(f"{'✅' if stats['pending'] == 0 and stats['rejected'] == 1 else '❌'} entrée refusée : "
+          f"{stats['pending']} en attente, {stats['rejected']} mise(s) à l'écart ({stats['last_error']})")
+
+
+def main(argv):
+    import tempfile
+
+    argv = list(argv)
+    path = JOURNAL_PATH
+    if "--journal" in argv:
+        i = argv.index("--journal")
+        path = argv[i + 1]
+        del argv[i:i + 2]
+    commands = [a for a in argv if a in ("status", "sync", "retry", "simulate")]
+    urls = [a for a in argv if a not in commands]
+    command = commands[0] if commands else "status"
+
+    if command == "simulate":
+        tmpdir = tempfile.mkdtemp()
+        try:
+            remote_url = urls[0] if urls else f"sqlite:///{os.path.join(tmpdir, 'remote.db')}"
+            _simulate(remote_url, os.path.join(tmpdir, "journal.db"))
+        finally:
+            from db_utils import dispose_engines
+            dispose_engines()
+            for name in os.listdir(tmpdir):
+                os.remove(os.path.join(tmpdir, name))
+            os.rmdir(tmpdir)
+        return 0
+
+    journal = Journal(get_engine(urls[0] if urls else "sqlite:///supermarket.db"), path)
+    if command == "retry":
+        print(f"{journal.retry_rejected()} entrée(s) remise(s) dans le journal")
+    if command in ("sync", "retry"):
+        while journal.sync_once():
+            pass
+    stats = journal.sync_stats()
+    print(f"{stats['pending']} entrée(s) en attente, retard {stats['lag']:.0f} s, {stats['synced']} envoyée(s), "
+          f"{stats['rejected']} refusée(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
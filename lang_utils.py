@@ -1,111 +1,150 @@
 # lang_utils.py
+# Traductions de l'interface. Les catalogues (locales/<langue>.json, une table
+# clé -> texte par langue) sont lus une seule fois à l'import et figés en
+# lecture seule ; translator(lang) renvoie un accesseur lié à la langue, sans
+# reconstruction de dictionnaire ni double recherche à chaque appel.
+# Usage : python lang_utils.py scan [fichiers...]
+#         python lang_utils.py bench [--calls 1000000]
+
+import ast
+import glob
+import json
+import os
+import sys
+import time
+from functools import lru_cache
+from types import MappingProxyType
+
+DEFAULT_LANG = "fr"
+LOCALE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "locales")
+
+# Fichiers dont les appels _("...") / t("...") sont contrôlés par `scan`
+SCANNED = ("inev.py", "Dashboard_Résumé.py", os.path.join("pages", "*.py"))
+
+
+def load_catalogs(directory=LOCALE_DIR):
+    """{langue: {clé: texte}} depuis les fichiers JSON de `directory`, en lecture seule."""
+    catalogs = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path, encoding="utf-8") as f:
+            catalog = json.load(f)
+        lang = os.path.splitext(os.path.basename(path))[0]
+        catalogs[lang] = MappingProxyType(dict(catalog))
+    if DEFAULT_LANG not in catalogs:
+        raise FileNotFoundError(f"Catalogue {DEFAULT_LANG}.json introuvable dans {directory}")
+    return MappingProxyType(catalogs)
+
+
+CATALOGS = load_catalogs()
+
+
+@lru_cache(maxsize=None)
+def translator(lang: str):
+    """Fonction clé -> texte pour `lang` (catalogue français si la langue est inconnue)."""
+    lookup = CATALOGS.get(lang, CATALOGS[DEFAULT_LANG]).get
+
+    def translate(key: str) -> str:
+        # Retourne la traduction, sinon la clé originale
+        return lookup(key, key)
+    return translate
+
 
 def get_translation(key: str, lang: str) -> str:
-    translations = {
-        "fr": {
-            "Add a product": "Ajouter un produit",
-            "Category": "Catégorie",
-            "Subcategory main": "Sous-catégorie principale",
-            "Subcategory detail": "Sous-catégorie détaillée",
-            "Subcategory": "Sous-catégorie",
-            "Subcategory (free text)": "Sous-catégorie (texte libre)",
-            "Supplier": "Fournisseur",
-            "Supplier (free text)": "Fournisseur (texte libre)",
-            "Product name": "Nom du produit",
-            "Quantity": "Quantité",
-            "Price": "Prix",
-            "Date": "Date",
-            "Save": "Enregistrer",
-            "Please enter a product name.": "Veuillez entrer un nom de produit.",
-            "Price must be greater than 0.": "Le prix doit être supérieur à 0.",
-            "Added": "Ajouté",
-            "Purchase History": "Historique des Achats",
-            "No purchases found.": "Aucun achat trouvé.",
-            "Deleted": "Supprimé",
-            "on": "le",
-            "Modify Entry": "Modifier l'entrée",
-            "Product": "Produit",
-            "Save Changes": "Enregistrer les modifications",
-            "Cancel": "Annuler",
-            "Entry updated successfully!": "Entrée mise à jour avec succès!",
-            "Total": "Total",
-            "Weekly Comparison": "Comparaison Hebdomadaire",
-            "Statistics": "Statistiques",
-            "Monthly Expenses": "Dépenses Mensuelles",
-            "Catégorie": "Catégorie",
-            "Sous-catégorie principale": "Sous-catégorie principale",
-            "Sous-catégorie détaillée": "Sous-catégorie détaillée",
-            "Sous-catégorie": "Sous-catégorie",
-            "Sous-catégorie (libre)": "Sous-catégorie (libre)",
-            "Fournisseur": "Fournisseur",
-            "Fournisseur (libre)": "Fournisseur (libre)",
-            "Nom du produit": "Nom du produit",
-            "Quantité": "Quantité",
-            "Prix d'achat unitaire (TND)": "Prix d'achat unitaire (TND)",
-            "Prix de vente unitaire (TND)": "Prix de vente unitaire (TND)",
-            "Date": "Date",
-            "Enregistrer": "Enregistrer",
-            "⚠️ Veuillez saisir un nom de produit.": "⚠️ Veuillez saisir un nom de produit.",
-            "⚠️ Le prix de vente doit être supérieur ou égal au prix d'achat.": "⚠️ Le prix de vente doit être supérieur ou égal au prix d'achat.",
-            "Aucun achat/vente enregistré.": "Aucun achat/vente enregistré.",
-            "Historique Achat/Vente": "Historique Achat/Vente",
-            "Télécharger l'historique en Excel": "Télécharger l'historique en Excel",
-            "Télécharger l'historique en PDF": "Télécharger l'historique en PDF",
-            "🔄 Rafraîchir la page": "🔄 Rafraîchir la page",
-            "Ajouter un achat/vente": "Ajouter un achat/vente"
-        },
-        "ar": {
-            "Add a product": "إضافة منتج",
-            "Category": "الفئة",
-            "Subcategory main": "الفئة الفرعية الرئيسية",
-            "Subcategory detail": "الفئة الفرعية التفصيلية",
-            "Subcategory": "الفئة الفرعية",
-            "Subcategory (free text)": "الفئة الفرعية (نص حر)",
-            "Supplier": "المورد",
-            "Supplier (free text)": "المورد (نص حر)",
-            "Product name": "اسم المنتج",
-            "Quantity": "الكمية",
-            "Price": "السعر",
-            "Date": "التاريخ",
-            "Save": "حفظ",
-            "Please enter a product name.": "يرجى إدخال اسم المنتج.",
-            "Price must be greater than 0.": "يجب أن يكون السعر أكبر من 0.",
-            "Added": "تمت الإضافة",
-            "Purchase History": "سجل المشتريات",
-            "No purchases found.": "لا توجد مشتريات.",
-            "Deleted": "تم الحذف",
-            "on": "في",
-            "Modify Entry": "تعديل الإدخال",
-            "Product": "المنتج",
-            "Save Changes": "حفظ التعديلات",
-            "Cancel": "إلغاء",
-            "Entry updated successfully!": "تم تحديث الإدخال بنجاح!",
-            "Total": "الإجمالي",
-            "Weekly Comparison": "المقارنة الأسبوعية",
-            "Statistics": "الإحصائيات",
-            "Monthly Expenses": "المصروفات الشهرية",
-            "Catégorie": "الفئة",
-            "Sous-catégorie principale": "الفئة الفرعية الرئيسية",
-            "Sous-catégorie détaillée": "الفئة الفرعية التفصيلية",
-            "Sous-catégorie": "الفئة الفرعية",
-            "Sous-catégorie (libre)": "الفئة الفرعية (نص حر)",
-            "Fournisseur": "المورد",
-            "Fournisseur (libre)": "المورد (نص حر)",
-            "Nom du produit": "اسم المنتج",
-            "Quantité": "الكمية",
-            "Prix d'achat unitaire (TND)": "سعر الشراء للوحدة (TND)",
-            "Prix de vente unitaire (TND)": "سعر البيع للوحدة (TND)",
-            "Date": "التاريخ",
-            "Enregistrer": "حفظ",
-            "⚠️ Veuillez saisir un nom de produit.": "⚠️ يرجى إدخال اسم المنتج.",
-            "⚠️ Le prix de vente doit être supérieur ou égal au prix d'achat.": "⚠️ يجب أن يكون سعر البيع أكبر أو يساوي سعر الشراء.",
-            "Aucun achat/vente enregistré.": "لا يوجد سجل للشراء/البيع.",
-            "Historique Achat/Vente": "سجل الشراء/البيع",
-            "Télécharger l'historique en Excel": "تحميل السجل بصيغة Excel",
-            "Télécharger l'historique en PDF": "تحميل السجل بصيغة PDF",
-            "🔄 Rafraîchir la page": "🔄 إعادة تحميل الصفحة",
-            "Ajouter un achat/vente": "إضافة شراء/بيع"
-        }
-    }
-    # Retourne la traduction selon la langue, sinon la clé originale
-    return translations.get(lang, translations["fr"]).get(key, key)
+    return translator(lang)(key)
+
+
+# --- Contrôle des clés ---
+
+def _aliases(tree):
+    # Noms liés à un traducteur : _ = translator(lang), t = lambda key: get_translation(key, lang)
+    names = {"get_translation"}
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Assign) or len(node.targets) != 1 or not isinstance(node.targets[0], ast.Name):
+            continue
+        value = node.value.body if isinstance(node.value, ast.Lambda) else node.value
+        if isinstance(value, ast.Call) and isinstance(value.func, ast.Name) \
+                and value.func.id in ("translator", "get_translation"):
+            names.add(node.targets[0].id)
+    return names
+
+
+def used_keys(paths):
+    """{clé: [(fichier, ligne)]} des appels de traduction avec une chaîne littérale."""
+    keys = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            tree = ast.parse(f.read(), path)
+        names = _aliases(tree)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in names \
+                    and node.args and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str):
+                keys.setdefault(node.args[0].value, []).append((path, node.lineno))
+    return keys
+
+
+def scan(paths=None):
+    """Clés utilisées absentes d'un catalogue, et entrées de catalogue jamais utilisées."""
+    base = os.path.dirname(os.path.abspath(__file__))
+    if not paths:
+        paths = [p for pattern in SCANNED for p in sorted(glob.glob(os.path.join(base, pattern)))]
+    keys = used_keys(paths)
+    print(f"{len(keys)} clé(s) utilisée(s) dans {len(paths)} fichier(s)")
+
+    missing_total = 0
+    for lang, catalog in CATALOGS.items():
+        missing = sorted(k for k in keys if k not in catalog)
+        unused = sorted(k for k in catalog if k not in keys)
+        missing_total += len(missing)
+        print(f"\n[{lang}] {len(catalog)} entrée(s) · {len(missing)} manquante(s) · {len(unused)} inutilisée(s)")
+        for key in missing:
+            where = ", ".join(f"{os.path.relpath(p, base)}:{line}" for p, line in keys[key][:3])
+            print(f"  ❌ {key!r} ({where})")
+        for key in unused:
+            print(f"  ⚠️ {key!r} inutilisée")
+    return 1 if missing_total else 0
+
+
+# --- Banc d'essai ---
+
+def bench(calls=1_000_000):
+    keys = list(CATALOGS[DEFAULT_LANG]) + ["Clé absente"]
+    lookups = [keys[i % len(keys)] for i in range(calls)]
+
+    def rebuilt(key, lang):
+        # Ancienne forme : dictionnaire de toutes les langues reconstruit à chaque appel
+        translations = {code: dict(catalog) for code, catalog in CATALOGS.items()}
+        return translations.get(lang, translations[DEFAULT_LANG]).get(key, key)
+
+    candidates = (
+        ("dictionnaire reconstruit", lambda key: rebuilt(key, "ar"), calls // 100),
+        ("get_translation", lambda key: get_translation(key, "ar"), calls),
+        ("translator(lang)", translator("ar"), calls),
+    )
+    for label, function, count in candidates:
+        start = time.perf_counter()
+        for key in lookups[:count]:
+            function(key)
+        seconds = time.perf_counter() - start
+        print(f"{label} : {seconds / count * 1e9:.0f} ns par appel ({count} appels)")
+    return 0
+
+
+def main(argv):
+    argv = list(argv)
+    options = {}
+    for flag in ("--calls",):
+        if flag in argv:
+            i = argv.index(flag)
+            options[flag] = argv[i + 1]
+            del argv[i:i + 2]
+
+    if argv[:1] == ["bench"]:
+        return bench(int(options.get("--calls", 1_000_000)))
+    if argv[:1] == ["scan"]:
+        return scan(argv[1:])
+    print("Usage : python lang_utils.py scan [fichiers...] | bench [--calls N]")
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
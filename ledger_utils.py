@@ -0,0 +1,244 @@
+# ledger_utils.py
+# Compte de résultat mensuel (gain brut / gain net) de la vue mensuelle.
+# Chaque source est déjà agrégée par jour (daily_purchases, daily_cash, tenues
+# par rollup_utils) ; elle est ramenée au mois séparément puis alignée sur un
+# calendrier continu de mois. Aucune source ne multiplie ni n'écarte les
+# autres, et le coût dépend du nombre de jours, pas du nombre d'achats.
+# Usage : python ledger_utils.py [url] [--start 2025-01] [--end 2025-12]
+#         python ledger_utils.py check [--purchases 50000]
+
+import sys
+import time
+
+import pandas as pd
+from sqlalchemy import text
+
+from cache_utils import read_many
+from rollup_utils import TOLERANCE
+
+MONTH = "SUBSTR(CAST(date AS TEXT), 1, 7)"
+
+# Source -> (colonnes agrégées, table journalière, tables dont dépend le cache)
+LEDGER_SOURCES = {
+    "purchases": ({
+        "gain_vente": "SUM(priced_sale_total - priced_purchase_total)",
+        "total_vente": "SUM(sale_total)",
+        "total_achat": "SUM(purchase_total)",
+    }, "daily_purchases", ("purchases",)),
+    "caisse": ({"caisse": "SUM(caisse)"}, "daily_cash", ("caisse",)),
+    "credits": ({"credit": "SUM(credits)"}, "daily_cash", ("credits",)),
+    "expenses": ({"depense": "SUM(expenses)"}, "daily_cash", ("expenses",)),
+}
+LEDGER_COLUMNS = [
+    column for measures, _, _ in LEDGER_SOURCES.values() for column in measures
+]
+
+
+def _source_query(measures, table, start, end):
+    where, params = [], {}
+    if start:
+        where.append(f"{MONTH} >= :start")
+        params["start"] = start
+    if end:
+        where.append(f"{MONTH} <= :end")
+        params["end"] = end
+    columns = ", ".join(f"{expr} AS {name}" for name, expr in measures.items())
+    sql = f"SELECT {MONTH} AS mois, {columns} FROM {table}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return sql + f" GROUP BY {MONTH}", params
+
+
+def _month_spine(months, start=None, end=None):
+    months = [m for m in months if m]
+    first = start or (min(months) if months else None)
+    last = end or (max(months) if months else None)
+    if not first or not last or first > last:
+        return pd.DataFrame({"mois": pd.Series(dtype=str)})
+    return pd.DataFrame({"mois": pd.period_range(first, last, freq="M").astype(str)})
+
+
+def monthly_ledger(engine, start=None, end=None):
+    """
+    Une ligne par mois ('YYYY-MM') de `start` à `end` (bornes incluses,
+    par défaut le premier et le dernier mois avec des données), mois sans
+    activité à zéro. Les sources sont lues en parallèle (read_many).
+    Retourne (DataFrame, {source: durée en secondes}).
+    """
+    queries = {}
+    for name, (measures, table, tables) in LEDGER_SOURCES.items():
+        sql, params = _source_query(measures, table, start, end)
+        queries[name] = (sql, params, tables)
+    frames, timings = read_many(engine, queries)
+
+    months = set()
+    for frame in frames.values():
+        months.update(frame["mois"].dropna())
+    ledger = _month_spine(months, start, end)
+    for frame in frames.values():
+        ledger = ledger.merge(frame, on="mois", how="left")
+    ledger[LEDGER_COLUMNS] = ledger[LEDGER_COLUMNS].astype(float).fillna(0.0)
+
+    # Gain brut : ventes - achats des lignes chiffrées ; gain net : caisse + crédits - dépenses
+    ledger["gain_brut"] = ledger["gain_vente"]
+    ledger["gain_net"] = (ledger["caisse"] + ledger["credit"]) - ledger["depense"]
+    return ledger, timings
+
+
+# --- Référence naïve (contrôle) ---
+
+def reference_ledger(conn):
+    """Même résultat recalculé ligne à ligne depuis les tables brutes : {mois: {colonne: montant}}."""
+    months = {}
+
+    def month(value):
+        return months.setdefault(str(value)[:7], dict.fromkeys(LEDGER_COLUMNS, 0.0))
+
+    for day, quantity, cost, price, sale in conn.execute(text(
+        "SELECT date, quantity, purchase_price, price, sale_price FROM purchases"
+    )):
+        quantity = quantity or 0
+        cost = cost if cost is not None else price
+        row = month(day)
+        if cost is not None:
+            row["total_achat"] += quantity * float(cost)
+        if sale is not None:
+            row["total_vente"] += quantity * float(sale)
+        if cost is not None and sale is not None:
+            row["gain_vente"] += quantity * (float(sale) - float(cost))
+
+    for table, column in (("caisse", "caisse"), ("credits", "credit"), ("expenses", "depense")):
+        for day, montant in conn.execute(text(f"SELECT date, montant FROM {table}")):
+            month(day)[column] += float(montant or 0)
+    return months
+
+
+def compare(ledger, reference):
+    """Écarts [(mois, colonne, attendu, trouvé)] entre monthly_ledger et reference_ledger."""
+    found = {row["mois"]: row for row in ledger.to_dict("records")}
+    mismatches = []
+    for mois in sorted(found.keys() | reference.keys()):
+        for column in LEDGER_COLUMNS:
+            expected = reference.get(mois, {}).get(column, 0.0)
+            actual = found[mois][column] if mois in found else None
+            if actual is None or abs(expected - actual) > TOLERANCE:
+                mismatches.append((mois, column, expected, actual))
+    return mismatches
+
+
+def seed_ledger(engine, purchases=50_000, seed=7):
+    """
+    Données synthétiques sur deux ans : jours avec achats seulement, avec
+    caisse seulement, lignes sans prix, et un mois entièrement vide.
+    """
+    import random
+    from datetime import date, timedelta
+
+    from cache_utils import bump_table_version
+    from db_utils import begin_write
+    from repository import get_repository
+    from rollup_utils import cash_inserted
+
+    rng = random.Random(seed)
+    first = date(2024, 1, 1)
+    days = [first + timedelta(days=i) for i in range(730)]
+    days = [d for d in days if (d.year, d.month) != (2024, 8)]
+    purchase_days = [d for d in days if d.day % 5]
+    cash_days = [d for d in days if d.day % 7]
+
+    rows = []
+    for i in range(purchases):
+        cost = round(rng.uniform(0.5, 20), 3)
+        rows.append({
+            "product": f"Produit {i % 500}",
+            "quantity": rng.randint(1, 12),
+            "purchase_price": None if rng.random() < 0.1 else cost,
+            "sale_price": None if rng.random() < 0.05 else round(cost * rng.uniform(1.05, 1.4), 3),
+            "date": rng.choice(purchase_days),
+            "category": rng.choice(["🌾 Farine", "🥛 Lait", "🥤 Boissons"]),
+        })
+    repository = get_repository(engine)
+    for i in range(0, len(rows), 5_000):
+        repository.add_purchases(rows[i:i + 5_000])
+
+    entries = {"caisse": [], "credits": [], "expenses": []}
+    for day in cash_days:
+        for periode in ("🕐 04–14", "🕑 14–17", "🌙 17–02"):
+            entries["caisse"].append({"montant": round(rng.uniform(50, 900), 2), "date": day, "periode": periode})
+        if rng.random() < 0.3:
+            entries["credits"].append({"montant": round(rng.uniform(10, 200), 2), "date": day, "note": ""})
+        if rng.random() < 0.2:
+            entries["expenses"].append({"montant": round(rng.uniform(20, 400), 2), "date": day, "type": "Autre"})
+    with begin_write(engine) as conn:
+        for table, values in entries.items():
+            for value in values:
+                value["date"] = repository.backend.date(value["date"])
+                columns = list(value)
+                conn.execute(text(f"""
+                    INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join(":" + c for c in columns)})
+                """), value)
+                cash_inserted(conn, table, value["montant"], value["date"])
+            bump_table_version(conn, table)
+
+
+def check(purchases=50_000):
+    """Compare monthly_ledger à la référence naïve sur une base SQLite temporaire."""
+    import os
+    import tempfile
+
+    from cache_utils import clear_cache
+    from db_utils import dispose_engines, get_engine
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        engine = get_engine(f"sqlite:///{os.path.join(tmpdir, 'ledger.db')}")
+        seed_ledger(engine, purchases)
+
+        clear_cache()
+        start = time.perf_counter()
+        ledger, _ = monthly_ledger(engine)
+        ledger_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with engine.connect() as conn:
+            reference = reference_ledger(conn)
+        reference_time = time.perf_counter() - start
+
+        mismatches = compare(ledger, reference)
+        for mois, column, expected, actual in mismatches[:50]:
+            print(f"❌ {mois} {column} : attendu {expected:.2f}, trouvé {actual}")
+        print(f"{len(ledger)} mois ({len(reference)} avec activité), {purchases} achats")
+        print(f"monthly_ledger : {ledger_time * 1000:.1f} ms · référence : {reference_time * 1000:.1f} ms")
+        print(f"{len(mismatches)} écart(s).")
+        return 1 if mismatches else 0
+    finally:
+        dispose_engines()
+        for name in os.listdir(tmpdir):
+            os.remove(os.path.join(tmpdir, name))
+        os.rmdir(tmpdir)
+
+
+def main(argv):
+    argv = list(argv)
+    options = {}
+    for flag in ("--start", "--end", "--purchases"):
+        if flag in argv:
+            i = argv.index(flag)
+            options[flag] = argv[i + 1]
+            del argv[i:i + 2]
+
+    if argv[:1] == ["check"]:
+        return check(int(options.get("--purchases", 50_000)))
+
+    from db_utils import get_engine
+
+    url = argv[0] if argv else "sqlite:///supermarket.db"
+    ledger, timings = monthly_ledger(get_engine(url), options.get("--start"), options.get("--end"))
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(ledger.round(2).to_string(index=False))
+    print(" · ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in timings.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,248 @@
+# lot_utils.py
+# Lots d'inventaire : chaque entrée de inventory_movements ouvre un lot, chaque
+# sortie consomme les lots ouverts du même (produit, dépôt), du plus ancien au
+# plus récent (FIFO) ou de la péremption la plus proche à la plus lointaine
+# (FEFO). Un seul passage sur les mouvements triés : O(n) en FIFO,
+# O(n log lots ouverts) en FEFO, mémoire limitée aux lots d'un couple.
+# Usage : python lot_utils.py [url] [--method fefo]
+#         python lot_utils.py bench [--movements 1000000]
+
+import heapq
+import sys
+import threading
+import time
+from collections import deque
+from datetime import date as date_type
+from functools import lru_cache
+
+import pandas as pd
+from sqlalchemy import text
+
+from cache_utils import table_versions
+
+METHODS = ("fifo", "fefo")
+
+LOT_COLUMNS = [
+    "lot_id", "product", "depot", "date", "expiry_date", "quantity", "consumed", "remaining",
+    "last_exit", "days_in_depot", "avg_days", "age_days",
+]
+ALLOCATION_COLUMNS = ["lot_id", "exit_id", "product", "depot", "quantity", "days"]
+SHORTAGE_COLUMNS = ["exit_id", "product", "depot", "date", "quantity"]
+
+# Entrées avant sorties le même jour : une sortie peut consommer un lot du jour
+MOVEMENTS_SQL = """
+    SELECT id, product, depot, movement_type, quantity, date, expiry_date
+    FROM inventory_movements
+    ORDER BY product, depot, date, CASE movement_type WHEN 'entry' THEN 0 ELSE 1 END, id
+"""
+
+_results = {}
+_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _ordinal(value):
+    # date ou texte 'YYYY-MM-DD...' -> numéro de jour
+    if isinstance(value, date_type):
+        return value.toordinal()
+    return date_type.fromisoformat(str(value)[:10]).toordinal()
+
+
+class _Lot:
+    __slots__ = ("lot_id", "product", "depot", "date", "expiry_date", "quantity",
+                 "remaining", "day", "last_exit", "dwell")
+
+    def __init__(self, lot_id, product, depot, quantity, day, expiry_date):
+        self.lot_id = lot_id
+        self.product = product
+        self.depot = depot
+        self.date = day
+        self.expiry_date = expiry_date
+        self.quantity = quantity
+        self.remaining = quantity
+        self.day = _ordinal(day)
+        self.last_exit = None
+        self.dwell = 0            # somme quantité x jours des unités sorties
+
+
+def match_lots(movements, method="fifo", as_of=None, allocations=True):
+    """
+    Affecte les sorties aux lots. `movements` : itérable de tuples
+    (id, product, depot, movement_type, quantity, date, expiry_date) triés
+    comme MOVEMENTS_SQL. Retourne {"lots", "allocations", "shortages"}
+    (DataFrame) : un lot par entrée avec quantité consommée, restante et
+    durées en dépôt ; le détail des affectations (si `allocations`) ; les
+    sorties non couvertes par le stock.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Méthode inconnue : {method} (attendu : {', '.join(METHODS)})")
+    fefo = method == "fefo"
+    today = _ordinal(as_of or date_type.today())
+
+    lots, matched, shortages = [], [], []
+    group = None
+    open_lots = None
+    for movement_id, product, depot, movement_type, quantity, day, expiry_date in movements:
+        if (product, depot) != group:
+            group = (product, depot)
+            open_lots = [] if fefo else deque()
+        quantity = quantity or 0
+
+        if movement_type == "entry":
+            lot = _Lot(movement_id, product, depot, quantity, day, expiry_date)
+            lots.append(lot)
+            if fefo:
+                # Sans date de péremption : après les lots datés, puis par entrée
+                expiry = _ordinal(expiry_date) if expiry_date else float("inf")
+                heapq.heappush(open_lots, (expiry, lot.day, movement_id, lot))
+            else:
+                open_lots.append(lot)
+            continue
+
+        exit_day = _ordinal(day)
+        while quantity > 0 and open_lots:
+            lot = open_lots[0][3] if fefo else open_lots[0]
+            taken = min(lot.remaining, quantity)
+            lot.remaining -= taken
+            lot.last_exit = exit_day
+            lot.dwell += taken * (exit_day - lot.day)
+            quantity -= taken
+            if allocations:
+                matched.append((lot.lot_id, movement_id, product, depot, taken, exit_day - lot.day))
+            if lot.remaining <= 0:
+                if fefo:
+                    heapq.heappop(open_lots)
+                else:
+                    open_lots.popleft()
+        if quantity > 0:
+            shortages.append((movement_id, product, depot, day, quantity))
+
+    rows = []
+    for lot in lots:
+        consumed = lot.quantity - lot.remaining
+        rows.append((
+            lot.lot_id, lot.product, lot.depot, lot.date, lot.expiry_date, lot.quantity, consumed, lot.remaining,
+            date_type.fromordinal(lot.last_exit) if lot.last_exit else None,
+            lot.last_exit - lot.day if lot.remaining <= 0 and lot.last_exit else None,
+            lot.dwell / consumed if consumed else None,
+            today - lot.day if lot.remaining > 0 else None,
+        ))
+    return {
+        "lots": pd.DataFrame(rows, columns=LOT_COLUMNS),
+        "allocations": pd.DataFrame(matched, columns=ALLOCATION_COLUMNS),
+        "shortages": pd.DataFrame(shortages, columns=SHORTAGE_COLUMNS),
+    }
+
+
+def _stream_movements(engine, chunk=10_000):
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk).execute(text(MOVEMENTS_SQL))
+        for row in result:
+            yield tuple(row)
+
+
+def load_lots(engine, method="fifo", as_of=None):
+    """
+    match_lots sur inventory_movements, lus en flux. Le résultat est gardé
+    tant que la table ne change pas (versions de cache_utils).
+    """
+    as_of = as_of or date_type.today()
+    key = (engine.url, method, as_of)
+    versions = table_versions(engine, ("inventory_movements",))
+    with _lock:
+        cached = _results.get(key)
+        if cached and cached[0] == versions:
+            return cached[1]
+    result = match_lots(_stream_movements(engine), method, as_of)
+    with _lock:
+        _results[key] = (versions, result)
+    return result
+
+
+# --- Banc d'essai ---
+
+def synthetic_movements(count=1_000_000, products=5_000, depots=2, seed=7):
+    """Mouvements déjà triés : ~55 % d'entrées, sorties parfois plus grandes que le stock."""
+    import random
+
+    rng = random.Random(seed)
+    groups = products * depots
+    per_group = max(count // groups, 1)
+    first = date_type(2023, 1, 1).toordinal()
+    movement_id = 0
+    for g in range(groups):
+        product, depot = f"Produit {g // depots}", f"Dépôt {g % depots + 1}"
+        day = first
+        for _ in range(per_group):
+            day += rng.randrange(3)
+            movement_id += 1
+            when = date_type.fromordinal(day).isoformat()
+            if rng.random() < 0.55:
+                expiry = date_type.fromordinal(day + rng.randrange(10, 200)).isoformat()
+                yield (movement_id, product, depot, "entry", rng.randint(1, 50), when, expiry)
+            else:
+                yield (movement_id, product, depot, "exit", rng.randint(1, 60), when, None)
+
+
+def bench(count=1_000_000):
+    import resource
+
+    movements = list(synthetic_movements(count))
+    entries, exits = {}, {}
+    for _, product, depot, movement_type, quantity, _, _ in movements:
+        counter = entries if movement_type == "entry" else exits
+        counter[(product, depot)] = counter.get((product, depot), 0) + 1
+    pairs = sum(n * exits.get(group, 0) for group, n in entries.items())
+    print(f"{len(movements)} mouvements, {len(entries)} couples produit/dépôt")
+    print(f"ancienne fusion entrées x sorties : {pairs} lignes")
+
+    failures = 0
+    for method in METHODS:
+        start = time.perf_counter()
+        result = match_lots(movements, method, date_type(2026, 1, 1))
+        seconds = time.perf_counter() - start
+        lots, matched, short = result["lots"], result["allocations"], result["shortages"]
+
+        # Toute quantité entrée est soit consommée soit restante, toute sortie est affectée ou manquante
+        entered = sum(q for _, _, _, t, q, _, _ in movements if t == "entry")
+        exited = sum(q for _, _, _, t, q, _, _ in movements if t == "exit")
+        ok = (
+            int(lots["consumed"].sum() + lots["remaining"].sum()) == entered
+            and int(matched["quantity"].sum() + short["quantity"].sum()) == exited
+            and int(matched["quantity"].sum()) == int(lots["consumed"].sum())
+            and (lots["remaining"] >= 0).all()
+        )
+        failures += not ok
+        print(f"{method} : {seconds:.2f} s · {len(lots)} lots · {len(matched)} affectations · "
+              f"{len(short)} sorties sans stock · {'✅' if ok else '❌'} quantités")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"mémoire max du processus : {peak:.0f} Mo")
+    return 1 if failures else 0
+
+
+def main(argv):
+    argv = list(argv)
+    options = {}
+    for flag in ("--method", "--movements"):
+        if flag in argv:
+            i = argv.index(flag)
+            options[flag] = argv[i + 1]
+            del argv[i:i + 2]
+
+    if argv[:1] == ["bench"]:
+        return bench(int(options.get("--movements", 1_000_000)))
+
+    from db_utils import get_engine
+
+    url = argv[0] if argv else "sqlite:///supermarket.db"
+    result = load_lots(get_engine(url), options.get("--method", "fifo"))
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(result["lots"].to_string(index=False))
+        if not result["shortages"].empty:
+            print("\nSorties sans stock suffisant :")
+            print(result["shortages"].to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
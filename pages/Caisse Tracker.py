@@ -1,35 +1,34 @@
 # caisse-tracker.py (PostgreSQL / mkdb version)
 import streamlit as st
-from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
 from datetime import datetime, timedelta
-import pandas as pd
-from io import BytesIO
-from fpdf import FPDF
+from db_utils import get_engine, check_connection, reset_connection_check
+from repository import get_repository
+from journal_utils import cash_writer, sync_caption, Journal, JournalFull
+from export_utils import download_export, lazy_download
+from pdf_utils import report_from_sql
 
-# --- Connect to PostgreSQL using Streamlit secrets ---
+# --- Connect to PostgreSQL using the shared pool ---
 try:
-    DATABASE_URL = st.secrets["database"]["url"]
-    engine = create_engine(DATABASE_URL)
-
-    # Test connection
-    with engine.connect() as conn:
-        db_version = conn.execute(text("SELECT version()")).fetchone()
-    st.success(f"✅ Connected to: {db_version[0]}")
+    engine = get_engine()
+    repo = get_repository(engine)
+    # Remote database: entries go through the local journal and are synced in the background
+    writer = cash_writer(engine)
 except SQLAlchemyError as e:
     st.error(f"❌ Database connection failed: {e}")
     st.stop()
 
-# --- Create table if not exists ---
-with engine.begin() as conn:
-    conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS caisse (
-            id SERIAL PRIMARY KEY,
-            montant NUMERIC,
-            date DATE,
-            periode TEXT
-        )
-    """))
+# Test connection (cached); once the journal runs, entry keeps working offline
+online = True
+try:
+    db_version = check_connection(engine)
+    st.success(f"✅ Connected to: {db_version}")
+except SQLAlchemyError as e:
+    if not isinstance(writer, Journal):
+        st.error(f"❌ Database connection failed: {e}")
+        st.stop()
+    online = False
+    st.warning("📴 Base distante injoignable : les saisies sont gardées sur ce poste et partiront au retour du réseau.")
 
 # --- UI title ---
 st.title("💰 Caisse Journalière - Entrée par Plage Horaire")
@@ -49,20 +48,24 @@ with st.form("add_entry", clear_on_submit=True):
     submit = st.form_submit_button("Enregistrer")
 
     if submit:
-        with engine.begin() as conn:
-            conn.execute(text("""
-                INSERT INTO caisse (montant, date, periode)
-                VALUES (:montant, :date, :periode)
-            """), {
-                "montant": montant,
-                "date": date_val,
-                "periode": periode
-            })
-        st.success(f"✅ Montant {montant:.2f} TND enregistré pour la plage {periode}.")
-
-# --- Load data ---
-with engine.connect() as conn:
-    df = pd.read_sql("SELECT * FROM caisse ORDER BY date DESC", conn)
+        try:
+            writer.add_cash(montant, date_val, periode)
+            st.success(f"✅ Montant {montant:.2f} TND enregistré pour la plage {periode}.")
+        except JournalFull as e:
+            st.error(f"❌ {e}")
+sync_caption(writer)
+
+if not online:
+    st.stop()
+
+# --- Load data (shared cache, refreshed when caisse changes) ---
+try:
+    df = repo.cash()
+except SQLAlchemyError:
+    # Link dropped since the last health check: check again on the next run
+    reset_connection_check(engine)
+    st.warning("📴 Base distante injoignable : les saisies sont gardées sur ce poste et partiront au retour du réseau.")
+    st.stop()
 
 if df.empty:
     st.info("Aucune donnée enregistrée.")
@@ -102,39 +105,27 @@ for label, comp_date in comparisons.items():
 # --- Export Excel ---
 st.subheader("⬇️ Télécharger les données")
 
-def to_excel(dataframe):
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        dataframe.to_excel(writer, index=False)
-    return output.getvalue()
-
-excel_file = to_excel(df)
-st.download_button(
-    label="📥 Télécharger toutes les données (Excel)",
-    data=excel_file,
-    file_name=f"caisse_{datetime.now().strftime('%Y-%m-%d')}.xlsx",
-    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# Streamed from the database in chunks (export_utils), not from the DataFrame
+download_export(
+    "📥 Télécharger toutes les données",
+    engine, "SELECT * FROM caisse ORDER BY date DESC",
+    file_stem=f"caisse_{datetime.now().strftime('%Y-%m-%d')}",
+    key="caisse_export", tables=("caisse",),
 )
 
-# --- Export PDF ---
-def to_pdf(dataframe):
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", size=12)
-    pdf.cell(200, 10, txt="Résumé Caisse", ln=True, align="C")
-    pdf.ln(10)
-
-    for _, row in dataframe.iterrows():
-        line = f"{row['date']} | {row['periode']} | {float(row['montant']):.2f} TND"
-        line = line.encode('latin-1', 'replace').decode('latin-1')
-        pdf.cell(200, 8, txt=line, ln=True)
-
-    return pdf.output(dest='S').encode('latin-1')
-
-pdf_file = to_pdf(df)
-st.download_button(
-    label="📄 Télécharger en PDF",
-    data=pdf_file,
-    file_name=f"caisse_{datetime.now().strftime('%Y-%m-%d')}.pdf",
-    mime="application/pdf"
+# --- Export PDF (paginated table with per-page subtotals, see pdf_utils) ---
+PDF_COLUMNS = [
+    ("date", "Date", 40, "date"),
+    ("periode", "Plage horaire", 60, "text"),
+    ("montant", "Montant (TND)", 50, "money"),
+]
+
+# Built only on request, then reused until the caisse table changes
+lazy_download(
+    "📄 Télécharger en PDF", engine, ("caisse_pdf",), ("caisse",),
+    lambda: report_from_sql(
+        engine, "SELECT date, periode, montant FROM caisse ORDER BY date DESC",
+        title="Résumé Caisse", columns=PDF_COLUMNS, subtotal_columns=["montant"],
+    ),
+    f"caisse_{datetime.now().strftime('%Y-%m-%d')}.pdf", "application/pdf", key="caisse_pdf",
 )
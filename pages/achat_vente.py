@@ -1,65 +1,20 @@
 import streamlit as st
-from sqlalchemy import create_engine, text
+import pandas as pd
 from sqlalchemy.exc import SQLAlchemyError
 from datetime import datetime
-from lang_utils import get_translation
+from lang_utils import translator
+from categories import CATEGORIES
+from import_utils import validate_row
+from repository import get_repository
 
 # --- LANGUE ---
 lang = st.sidebar.selectbox("🌍 Langue / اللغة", ["fr", "ar"], index=0)
-t = lambda key: get_translation(key, lang)
+t = translator(lang)
 
 st.title("🧾 " + t("Quick Entry for Purchase"))
 
-# --- Get database URL from Streamlit secrets ---
-DATABASE_URL = st.secrets["database"]["url"]
-
-# --- Create SQLAlchemy engine ---
-engine = create_engine(DATABASE_URL)
-
-# --- Initialize database table if not exists ---
-def init_db():
-    with engine.connect() as conn:
-        conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS purchases (
-            id SERIAL PRIMARY KEY,
-            product TEXT NOT NULL,
-            category TEXT,
-            subcategory TEXT,
-            supplier TEXT,
-            quantity INTEGER,
-            purchase_price NUMERIC,
-            sale_price NUMERIC,
-            date DATE
-        )
-        """))
-        conn.commit()
-
-init_db()
-
-# --- Category setup (your original CATEGORIES dict) ---
-CATEGORIES = {
-    "🍼 Dépôt": {"subcategories": ["Medded", "Mlika", "Jamila"], "suppliers": []},
-    "🍰 Cake": {"subcategories": ["Tom", "Moulin d'Or"], "suppliers": []},
-    "🥛 Produits Laitiers": {"subcategories": ["Lait", "Yaourt"], "suppliers": ["Delice", "Vitalait", "Centrale"]},
-    "🍗 Volaille": {"subcategories": ["Mazra", "Jalel"], "suppliers": ["SOTUVI", "CHA"]},
-    "🌾 Farine": {"subcategories": [], "suppliers": ["Grands Moulins", "Minoterie"]},
-    "🥤 Liquides": {"subcategories": ["Eau", "Boissons Gazeuses", "Jus"], "suppliers": ["Cristal", "Coca-Cola", "Pepsi"]},
-    "🧴 Hygiène & Beauté": {
-        "subcategories": {
-            "🧼 Hygiène": ["Judy", "Lilas", "Nawar", "Syso", "Sunsilk", "Autre"],
-            "💄 Beauté": ["Yassine", "L'Oréal", "Autre"]
-        },
-        "suppliers": []
-    },
-    "🧀 Fromage": {"subcategories": ["Majesté", "Landor", "Traditionnel"], "suppliers": []},
-    "🥩 Twebel": {"subcategories": ["Twebel", "Elmalah"], "suppliers": []},
-    "🍦 Glace": {"subcategories": [], "suppliers": ["Frigo", "Polar"]},
-    "🥖 Daily": {"subcategories": ["Gâteaux", "Pain"], "suppliers": ["Boulangerie du Coin", "Fournée Dorée"]},
-    "🐶 Animaux": {"subcategories": ["Pet's"], "suppliers": ["Royal Canin", "Pedigree"]},
-    "🏠 Maison": {"subcategories": [], "suppliers": []},
-    "📦 Divers": {"subcategories": [], "suppliers": []},
-    "🎉 Autres": {"subcategories": [], "suppliers": []}
-}
+# --- Shared repository (pooled engine, SQLite or PostgreSQL backend) ---
+repo = get_repository()
 
 # --- Streamlit UI ---
 category = st.selectbox("📂 " + t("Category"), list(CATEGORIES.keys()))
@@ -79,32 +34,85 @@ else:
 suppliers = CATEGORIES[category].get("suppliers", [])
 supplier = st.selectbox("🏢 " + t("Supplier"), suppliers) if suppliers else st.text_input("🏢 " + t("Supplier"))
 
-product = st.text_input("📦 " + t("Product name"))
-quantity = st.number_input("🔢 " + t("Quantity"), min_value=1, step=1)
-purchase_price = st.number_input("💰 " + t("Purchase price"), min_value=0.0, step=0.1)
-sale_price = st.number_input("🏷️ " + t("Sale price"), min_value=0.0, step=0.1)
-date = st.date_input("📅 " + t("Date"), value=datetime.today())
+mode = st.radio(t("Entry mode"), [t("Single product"), t("Delivery grid")], horizontal=True)
+
+if mode == t("Single product"):
+    product = st.text_input("📦 " + t("Product name"))
+    quantity = st.number_input("🔢 " + t("Quantity"), min_value=1, step=1)
+    purchase_price = st.number_input("💰 " + t("Purchase price"), min_value=0.0, step=0.1)
+    sale_price = st.number_input("🏷️ " + t("Sale price"), min_value=0.0, step=0.1)
+    date = st.date_input("📅 " + t("Date"), value=datetime.today())
+
+    if st.button("✅ " + t("Add Purchase")):
+        if not product.strip():
+            st.warning(t("Please fill in the product name."))
+        else:
+            # Rollups and the search index are updated in the same transaction
+            try:
+                repo.add_purchase(
+                    product, quantity, purchase_price, sale_price, date,
+                    category=category, subcategory=subcategory, supplier=supplier,
+                )
+                st.success(t("Purchase added successfully!"))
+            except SQLAlchemyError as e:
+                st.error(f"{t('Database error')}: {str(e)}")
+
+else:
+    # Grid mode: one shared header, many lines, one transaction
+    date = st.date_input("📅 " + t("Date"), value=datetime.today(), key="grid_date")
+    if "grid_saved" in st.session_state:
+        st.success(f"{st.session_state.pop('grid_saved')} {t('lines added')}")
+    empty_grid = pd.DataFrame({
+        "product": pd.Series(dtype="str"),
+        "quantity": pd.Series(dtype="Int64"),
+        "purchase_price": pd.Series(dtype="float"),
+        "sale_price": pd.Series(dtype="float"),
+    })
+    # Inside a form, cell edits do not trigger a rerun until the delivery is submitted.
+    # The grid key changes after each saved delivery so the next one starts empty.
+    grid_key = f"grid_lines_{st.session_state.get('grid_batch', 0)}"
+    with st.form("delivery_grid"):
+        lines = st.data_editor(
+            empty_grid,
+            num_rows="dynamic",
+            use_container_width=True,
+            column_config={
+                "product": st.column_config.TextColumn("📦 " + t("Product name"), required=True),
+                "quantity": st.column_config.NumberColumn("🔢 " + t("Quantity"), min_value=1, step=1, required=True),
+                "purchase_price": st.column_config.NumberColumn("💰 " + t("Purchase price"), min_value=0.0, format="%.3f"),
+                "sale_price": st.column_config.NumberColumn("🏷️ " + t("Sale price"), min_value=0.0, format="%.3f"),
+            },
+            key=grid_key,
+        )
+        submitted = st.form_submit_button("✅ " + t("Save delivery"))
+
+    if submitted:
+        rows, errors = [], []
+        for line, values in enumerate(lines.to_dict("records"), start=1):
+            values = {k: None if pd.isna(v) else v for k, v in values.items()}
+            if all(v in (None, "") for v in values.values()):
+                continue
+            row, reason = validate_row({
+                **values,
+                "category": category,
+                "subcategory": subcategory,
+                "supplier": supplier,
+                "date": date,
+            })
+            if reason:
+                errors.append((line, reason))
+            else:
+                rows.append(row)
 
-if st.button("✅ " + t("Add Purchase")):
-    if not product.strip():
-        st.warning(t("Please fill in the product name."))
-    else:
-        # Insert into DB
-        try:
-            with engine.begin() as conn:
-                conn.execute(text("""
-                    INSERT INTO purchases (product, category, subcategory, supplier, quantity, purchase_price, sale_price, date)
-                    VALUES (:product, :category, :subcategory, :supplier, :quantity, :purchase_price, :sale_price, :date)
-                """), {
-                    "product": product,
-                    "category": category,
-                    "subcategory": subcategory,
-                    "supplier": supplier,
-                    "quantity": quantity,
-                    "purchase_price": purchase_price,
-                    "sale_price": sale_price,
-                    "date": date
-                })
-            st.success(t("Purchase added successfully!"))
-        except SQLAlchemyError as e:
-            st.error(f"{t('Database error')}: {str(e)}")
+        # The whole delivery is rejected if any line is invalid
+        if errors:
+            st.error(t("Nothing was saved, fix these lines:"))
+            st.dataframe(pd.DataFrame(errors, columns=[t("Line"), t("Error")]), hide_index=True)
+        elif rows:
+            try:
+                repo.add_purchases(rows)
+                st.session_state["grid_batch"] = st.session_state.get("grid_batch", 0) + 1
+                st.session_state["grid_saved"] = len(rows)
+                st.experimental_rerun()
+            except SQLAlchemyError as e:
+                st.error(f"{t('Database error')}: {str(e)}")
@@ -1,22 +1,22 @@
 # pages/depense_mensuel.py
 import streamlit as st
-from sqlalchemy import create_engine, text
 import pandas as pd
 import matplotlib.pyplot as plt
 from datetime import datetime
 import calendar
-from lang_utils import get_translation
+from lang_utils import translator
+from db_utils import get_engine
+from cache_utils import read_sql
 
 # --- LANGUAGE ---
 lang = st.sidebar.selectbox("🌍 Langue / اللغة", ["fr", "ar"], index=0)
-t = lambda key: get_translation(key, lang)
+t = translator(lang)
 
 st.set_page_config(page_title=t("Monthly Expenses"), layout="wide", page_icon="📅")
 st.title("📅 " + t("Monthly Expenses"))
 
 # --- DATABASE CONNECTION ---
-DATABASE_URL = st.secrets["database"]["url"]
-engine = create_engine(DATABASE_URL)
+engine = get_engine()
 
 # --- SELECT YEAR & MONTH ---
 today = datetime.today()
@@ -35,20 +35,19 @@ end_date = datetime(year, month_num, last_day)
 
 # --- FETCH DATA FROM DATABASE ---
 query = """
-    SELECT date, SUM(purchase_price * quantity) AS total
-    FROM purchases
+    SELECT date, purchase_total AS total
+    FROM daily_purchases
     WHERE date BETWEEN :start AND :end
-    GROUP BY date
     ORDER BY date ASC
 """
-with engine.connect() as conn:
-    result = conn.execute(text(query), {"start": start_date, "end": end_date}).fetchall()
+df = read_sql(engine, query, {"start": start_date, "end": end_date}, tables=("purchases",))
 
-if not result:
+if df.empty:
     st.info(t("No data for this month."))
 else:
     # --- CONVERT TO DATAFRAME ---
-    df = pd.DataFrame(result, columns=["Date", "Total"])
+    df.columns = ["Date", "Total"]
+    df["Total"] = df["Total"].astype(float)
     df["Date"] = pd.to_datetime(df["Date"])
 
     # Ensure all days are present in DataFrame
@@ -1,47 +1,43 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
-from datetime import datetime
-from lang_utils import get_translation
+from lang_utils import translator
+from db_utils import get_engine
+from cache_utils import read_sql
+from snapshot_utils import read_table
 
 # --- LANGUE ---
 lang = st.sidebar.selectbox("🌍 Langue / اللغة", ["fr", "ar"], index=0)
-t = lambda key: get_translation(key, lang)
+t = translator(lang)
 
 st.title(t("Dépenses mensuelles"))
 
-# --- Connexion à la base de données ---
-conn = sqlite3.connect("supermarket.db")
-cursor = conn.cursor()
+# --- Connexion à la base de données (base SQLite locale, comme avant) ---
+engine = get_engine("sqlite:///supermarket.db")
 
-# --- Charger les données ---
-df = pd.read_sql_query("SELECT * FROM purchases", conn)
+# --- Mois disponibles (agrégats journaliers, sans lire les achats) ---
+jours = read_sql(engine, "SELECT date FROM daily_purchases", tables=("purchases",))
 
-if df.empty:
+if jours.empty:
     st.info(t("aucune_donnee"))
 else:
-    # Vérifier colonnes
-    # st.write(df.columns.tolist())  # Debug si besoin
+    # Sélection du mois
+    mois_disponibles = sorted(pd.to_datetime(jours["date"]).dt.to_period("M").astype(str).unique(), reverse=True)
+    mois_selectionne = st.selectbox(t("choisir_mois"), mois_disponibles)
 
-    # Convertir la colonne date
-    df["date"] = pd.to_datetime(df["date"])
-    df["month"] = df["date"].dt.to_period("M")
+    # Seul le mois choisi est chargé : archive Parquet s'il est clos, base sinon
+    debut = pd.Period(mois_selectionne, "M").start_time.date()
+    fin = pd.Period(mois_selectionne, "M").end_time.date()
+    df_mois = read_table(engine, "purchases", debut, fin)
 
     # Ajouter colonne total achat (pas price mais purchase_price)
-    if "purchase_price" in df.columns:
-        df["total"] = df["quantity"] * df["purchase_price"]
-    elif "price" in df.columns:  # fallback si ancienne base
-        df["total"] = df["quantity"] * df["price"]
+    if "purchase_price" in df_mois.columns:
+        df_mois["total"] = df_mois["quantity"] * df_mois["purchase_price"]
+    elif "price" in df_mois.columns:  # fallback si ancienne base
+        df_mois["total"] = df_mois["quantity"] * df_mois["price"]
     else:
         st.error("⚠ Impossible de calculer les dépenses : colonne prix introuvable.")
         st.stop()
 
-    # Sélection du mois
-    mois_disponibles = sorted(df["month"].unique().astype(str), reverse=True)
-    mois_selectionne = st.selectbox(t("choisir_mois"), mois_disponibles)
-
-    df_mois = df[df["month"] == mois_selectionne]
-
     if df_mois.empty:
         st.info(t("aucune_donnee_mois"))
     else:
@@ -63,5 +59,3 @@ else:
         st.subheader(t("depense_par_fournisseur"))
         depense_par_fournisseur = df_mois.groupby("supplier")["total"].sum().sort_values(ascending=False)
         st.bar_chart(depense_par_fournisseur)
-
-conn.close()
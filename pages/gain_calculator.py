@@ -1,43 +1,24 @@
 import streamlit as st
-import pandas as pd
-from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
 from datetime import datetime
-from io import BytesIO
+from db_utils import get_engine, check_connection
+from cache_utils import read_sql
+from export_utils import download_export
 
 st.set_page_config(page_title="📈 Calculateur de Gain", layout="wide")
 
 # --- Connect to mkdb PostgreSQL ---
 try:
-    DATABASE_URL = st.secrets["database"]["url"]
-    engine = create_engine(DATABASE_URL)
-
-    with engine.connect() as conn:
-        db_version = conn.execute(text("SELECT version()")).fetchone()
-    st.success(f"✅ Connected to: {db_version[0]}")
+    engine = get_engine()
+    db_version = check_connection(engine)
+    st.success(f"✅ Connected to: {db_version}")
 except SQLAlchemyError as e:
     st.error(f"❌ Database connection failed: {e}")
     st.stop()
 
-# --- Initialize table if not exists ---
-with engine.begin() as conn:
-    conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS purchases (
-            id SERIAL PRIMARY KEY,
-            product TEXT,
-            category TEXT,
-            subcategory TEXT,
-            supplier TEXT,
-            quantity INTEGER,
-            purchase_price NUMERIC,
-            sale_price NUMERIC,
-            date DATE
-        )
-    """))
-
 st.title("📊 Calculateur de Gain sur les Ventes")
 
-# --- Read data ---
+# --- Read data (selected day only) ---
 query = """
 SELECT 
     id, 
@@ -51,32 +32,34 @@ SELECT
     date,
     (sale_price - purchase_price) * quantity AS gain
 FROM purchases
-WHERE purchase_price IS NOT NULL AND sale_price IS NOT NULL
-ORDER BY date DESC
+WHERE purchase_price IS NOT NULL AND sale_price IS NOT NULL AND date = :date
 """
 
-with engine.connect() as conn:
-    df = pd.read_sql(query, conn)
+# Dates and totals come from the daily rollup (rollup_utils)
+dates = read_sql(
+    engine, "SELECT date FROM daily_purchases WHERE priced_lines > 0 ORDER BY date DESC", tables=("purchases",)
+)["date"].tolist()
 
-if df.empty:
+if not dates:
     st.warning("Aucune donnée disponible pour le calcul de gain.")
     st.stop()
 
-# --- Filter by date ---
-df["date"] = pd.to_datetime(df["date"]).dt.date
-dates = sorted(df["date"].unique(), reverse=True)
+# --- Select date ---
 selected_date = st.selectbox("📅 Sélectionner une date", dates)
 
-filtered_df = df[df["date"] == selected_date]
+filtered_df = read_sql(engine, query, {"date": selected_date}, tables=("purchases",))
+day_totals = read_sql(engine, """
+    SELECT priced_purchase_total, priced_sale_total FROM daily_purchases WHERE date = :date
+""", {"date": selected_date}, tables=("purchases",)).iloc[0]
 
 # --- Display table ---
 st.subheader(f"🛒 Détail des Achats/Ventes pour le {selected_date}")
 st.dataframe(filtered_df)
 
 # --- Summary ---
-total_gain = filtered_df["gain"].sum()
-total_vente = (filtered_df["sale_price"] * filtered_df["quantity"]).sum()
-total_achat = (filtered_df["purchase_price"] * filtered_df["quantity"]).sum()
+total_achat = float(day_totals["priced_purchase_total"])
+total_vente = float(day_totals["priced_sale_total"])
+total_gain = total_vente - total_achat
 
 col1, col2, col3 = st.columns(3)
 col1.metric("🛒 Total Achat", f"{total_achat:.2f} TND")
@@ -88,16 +71,8 @@ st.subheader("📦 Gain par produit")
 gain_par_produit = filtered_df.groupby("product")["gain"].sum().sort_values(ascending=False)
 st.bar_chart(gain_par_produit)
 
-# --- Excel export ---
-def to_excel(dataframe):
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        dataframe.to_excel(writer, index=False)
-    return output.getvalue()
-
-st.download_button(
-    label="📥 Télécharger (Excel)",
-    data=to_excel(filtered_df),
-    file_name=f"gain_{selected_date}.xlsx",
-    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# --- Export ---
+download_export(
+    "📥 Télécharger", engine, query, {"date": selected_date}, file_stem=f"gain_{selected_date}",
+    key="gain_export", tables=("purchases",),
 )
@@ -0,0 +1,55 @@
+# import_purchases.py - Import en masse d'achats (CSV / XLSX)
+import streamlit as st
+import pandas as pd
+from sqlalchemy.exc import SQLAlchemyError
+from db_utils import get_engine
+from categories import CATEGORIES
+from import_utils import import_purchases, HEADER_ALIASES, MAX_REJECTS
+
+st.set_page_config(page_title="📥 Import des achats", layout="wide")
+st.title("📥 Import des achats")
+
+engine = get_engine()
+
+st.caption(
+    "Colonnes attendues : produit, quantité, date (obligatoires), catégorie, sous-catégorie, "
+    "fournisseur, prix d'achat, prix de vente. Séparateur ; ou , ; dates AAAA-MM-JJ ou JJ/MM/AAAA."
+)
+with st.expander("En-têtes reconnus"):
+    st.write({column: ", ".join(aliases) for column, aliases in HEADER_ALIASES.items()})
+
+uploaded = st.file_uploader("Fichier", type=["csv", "xlsx"])
+fallback = st.selectbox(
+    "Catégorie pour les lignes non reconnues",
+    ["❌ Rejeter la ligne"] + list(CATEGORIES.keys()),
+)
+dry_run = st.checkbox("Vérifier seulement (aucune écriture)", value=True)
+
+if uploaded and st.button("🚀 Lancer l'import"):
+    try:
+        with st.spinner("Import en cours..."):
+            report = import_purchases(
+                engine, uploaded, uploaded.name,
+                fallback_category=None if fallback.startswith("❌") else fallback,
+                dry_run=dry_run,
+            )
+    except (ValueError, SQLAlchemyError) as e:
+        st.error(f"❌ Import annulé : {e}")
+        st.stop()
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Lignes lues", report["read"])
+    col2.metric("Valides" if dry_run else "Insérées", report["inserted"])
+    col3.metric("Rejetées", report["rejected"])
+    col4.metric("Lignes / s", f"{report['rows_per_second']:.0f}")
+
+    if dry_run:
+        st.info("Vérification terminée : décochez la case pour enregistrer les lignes valides.")
+    else:
+        st.success(f"✅ {report['inserted']} achat(s) importé(s) en {report['seconds']:.2f} s.")
+
+    if report["rejects"]:
+        st.subheader("Lignes rejetées")
+        if report["rejected"] > MAX_REJECTS:
+            st.caption(f"Seules les {MAX_REJECTS} premières sont affichées.")
+        st.dataframe(pd.DataFrame(report["rejects"], columns=["Ligne", "Motif"]), use_container_width=True)
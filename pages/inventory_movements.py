@@ -1,43 +1,29 @@
 import streamlit as st
-import pandas as pd
 from datetime import datetime
-from fpdf import FPDF
-from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
 import os, sys
 
 # --- Import traductions ---
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from lang_utils import get_translation
+from lang_utils import get_translation, translator
+from db_utils import get_engine
+from repository import get_repository
+from lot_utils import load_lots
+from stock_utils import current_stock, stock_at
+from export_utils import download_export, lazy_download
+from pdf_utils import report_from_sql
 
 # --- Connexion DB ---
 try:
-    DATABASE_URL = st.secrets["database"]["url"]
-    engine = create_engine(DATABASE_URL)
+    engine = get_engine()
+    repo = get_repository(engine)
 except SQLAlchemyError as e:
     st.error(f"❌ {get_translation('Erreur de connexion à la base', 'fr')}: {e}")
     st.stop()
 
-# --- Créer table si besoin ---
-def init_db():
-    with engine.begin() as conn:
-        conn.execute(text("""
-            CREATE TABLE IF NOT EXISTS inventory_movements (
-                id SERIAL PRIMARY KEY,
-                product TEXT,
-                depot TEXT,
-                movement_type TEXT,  -- 'entry' ou 'exit'
-                quantity INTEGER,
-                price NUMERIC,
-                date DATE
-            )
-        """))
-
-init_db()
-
 # --- Langue ---
 lang = st.sidebar.selectbox("🌍 Langue / اللغة", ["fr", "ar"], index=0)
-_ = lambda key: get_translation(key, lang)
+_ = translator(lang)
 
 st.set_page_config(page_title=_("Mouvements d'inventaire"), layout="wide")
 st.title(_("Mouvements d'inventaire"))
@@ -52,6 +38,7 @@ with st.form("movement_form", clear_on_submit=True):
     quantity = st.number_input(_("Quantité"), min_value=1, step=1)
     price = st.number_input(_("Prix unitaire (TND)"), min_value=0.01, format="%.2f")
     date = st.date_input(_("Date"), value=datetime.today())
+    expiry_date = st.date_input(_("Date de péremption (optionnel)"), value=None)
     submitted = st.form_submit_button(_("Ajouter"))
 
     if submitted:
@@ -59,19 +46,7 @@ with st.form("movement_form", clear_on_submit=True):
             st.error(_("Veuillez saisir un nom de produit."))
         else:
             try:
-                with engine.begin() as conn:
-                    conn.execute(text("""
-                        INSERT INTO inventory_movements 
-                        (product, depot, movement_type, quantity, price, date)
-                        VALUES (:product, :depot, :movement_type, :quantity, :price, :date)
-                    """), {
-                        "product": product.strip(),
-                        "depot": depot,
-                        "movement_type": movement_type_db,
-                        "quantity": quantity,
-                        "price": price,
-                        "date": date
-                    })
+                repo.add_movement(product, depot, movement_type_db, quantity, price, date, expiry_date)
                 st.success(_("Mouvement ajouté avec succès."))
             except SQLAlchemyError as e:
                 st.error(f"{_('Erreur base de données')}: {str(e)}")
@@ -79,57 +54,46 @@ with st.form("movement_form", clear_on_submit=True):
 # --- Affichage historique ---
 st.header(_("Historique des mouvements"))
 
+# Une ligne par (dépôt, produit) : suffit pour savoir s'il y a des mouvements
 try:
-    with engine.connect() as conn:
-        df = pd.read_sql("SELECT * FROM inventory_movements ORDER BY date DESC", conn)
+    levels = current_stock(engine)
 except SQLAlchemyError as e:
     st.error(f"{_('Erreur lors de la récupération des données')}: {e}")
     st.stop()
 
-if df.empty:
+if levels.empty:
     st.info(_("Aucun mouvement enregistré."))
 else:
-    df["date"] = pd.to_datetime(df["date"])
-
-    # --- Séparer entrées et sorties ---
-    entries = df[df["movement_type"] == "entry"].copy()
-    exits = df[df["movement_type"] == "exit"].copy()
-
-    # Renommer pour fusion
-    entries = entries.rename(columns={
-        "quantity": "quantity_entry",
-        "date": "date_entry"
-    })
-    exits = exits.rename(columns={
-        "quantity": "quantity_exit",
-        "date": "date_exit"
-    })
-
-    # Fusion pour calcul durée
-    merged = pd.merge(
-        entries, exits,
-        on=["product", "depot"],
-        suffixes=("_entry", "_exit"),
-        how="outer"
+    # --- Lots : chaque sortie consomme les entrées du même produit/dépôt (lot_utils) ---
+    method = st.radio(
+        _("Méthode d'affectation"), ["fifo", "fefo"], horizontal=True,
+        format_func=lambda m: {"fifo": "FIFO", "fefo": "FEFO"}[m],
     )
-
-    merged["days_in_depot"] = (merged["date_exit"] - merged["date_entry"]).dt.days
-    merged.loc[merged["days_in_depot"] < 0, "days_in_depot"] = None
-
-    st.subheader(_("Détails des mouvements avec durée en dépôt"))
-    st.dataframe(merged[[
-        "product", "depot", "quantity_entry", "date_entry",
-        "quantity_exit", "date_exit", "days_in_depot"
+    try:
+        result = load_lots(engine, method)
+    except SQLAlchemyError as e:
+        st.error(f"{_('Erreur lors de la récupération des données')}: {e}")
+        st.stop()
+
+    st.subheader(_("Lots et durée en dépôt"))
+    st.dataframe(result["lots"][[
+        "product", "depot", "date", "expiry_date", "quantity", "consumed", "remaining",
+        "last_exit", "days_in_depot", "avg_days", "age_days"
     ]])
 
-    # --- Résumé stock par dépôt ---
-    st.subheader(_("Résumé du stock par dépôt"))
-    stock_entries = entries.groupby(["depot", "product"])["quantity_entry"].sum().reset_index()
-    stock_exits = exits.groupby(["depot", "product"])["quantity_exit"].sum().reset_index()
+    if not result["shortages"].empty:
+        st.warning(_("Sorties sans stock suffisant"))
+        st.dataframe(result["shortages"][["product", "depot", "date", "quantity"]])
 
-    stock = pd.merge(stock_entries, stock_exits, on=["depot", "product"], how="left")
-    stock["quantity_exit"] = stock["quantity_exit"].fillna(0)
-    stock["stock"] = stock["quantity_entry"] - stock["quantity_exit"]
+    # --- Résumé stock par dépôt (stock_levels, tenu à jour à chaque mouvement) ---
+    st.subheader(_("Résumé du stock par dépôt"))
+    stock_date = st.date_input(_("Stock au"), value=datetime.today())
+    if stock_date >= datetime.today().date():
+        stock = levels
+    else:
+        # Dernière fin de mois figée + mouvements depuis (stock_utils)
+        stock = stock_at(engine, stock_date)
+    stock = stock.rename(columns={"quantity": "stock"})
 
     st.dataframe(stock[["depot", "product", "stock"]])
 
@@ -138,44 +102,39 @@ else:
     for prod in stock["product"].unique():
         st.markdown(f"- [{prod}](#)")
 
-    # --- Export Excel ---
-    def to_excel(dataframe):
-        import io
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine="openpyxl") as writer:
-            dataframe.to_excel(writer, index=False)
-        return output.getvalue()
-
-    excel_data = to_excel(df)
-    st.download_button(
-        label=_("Télécharger l'historique Excel"),
-        data=excel_data,
-        file_name=f"inventory_movements_{datetime.now().strftime('%Y-%m-%d')}.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    # --- Export (lecture par paquets, voir export_utils) ---
+    download_export(
+        _("Télécharger l'historique"),
+        engine, "SELECT * FROM inventory_movements ORDER BY date DESC",
+        file_stem=f"inventory_movements_{datetime.now().strftime('%Y-%m-%d')}",
+        key="movements_export", tables=("inventory_movements",),
     )
 
-    # --- Export PDF ---
-    def to_pdf(dataframe):
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Arial", size=12)
-        pdf.cell(0, 10, _("Historique des mouvements"), ln=True, align="C")
-        pdf.ln(5)
-        for _, row in dataframe.iterrows():
-            line = (
-                f"{row['date'].strftime('%Y-%m-%d')} | "
-                f"{row['product']} | {row['depot']} | "
-                f"{row['movement_type']} | "
-                f"Qté: {row['quantity']} | "
-                f"Prix: {row['price']:.2f} TND"
-            )
-            pdf.cell(0, 8, line, ln=True)
-        return pdf.output(dest='S').encode('latin1')
-
-    pdf_data = to_pdf(df)
-    st.download_button(
-        label=_("Télécharger l'historique PDF"),
-        data=pdf_data,
-        file_name=f"inventory_movements_{datetime.now().strftime('%Y-%m-%d')}.pdf",
-        mime="application/pdf"
+    # --- Export PDF (tableau paginé, police Unicode : libellés arabes compris) ---
+    pdf_columns = [
+        ("date", _("Date"), 25, "date"),
+        ("product", _("Nom du produit"), 55, "text"),
+        ("depot", _("Dépôt"), 25, "text"),
+        ("movement_type", _("Type de mouvement"), 30, "text"),
+        ("quantity", _("Quantité"), 20, "int"),
+        ("price", _("Prix unitaire (TND)"), 35, "money"),
+    ]
+    pdf_query = """
+        SELECT date, product, depot,
+               CASE movement_type WHEN 'entry' THEN :entry ELSE :exit END AS movement_type,
+               quantity, price
+        FROM inventory_movements
+        ORDER BY date DESC
+    """
+
+    # Généré à la demande puis réutilisé tant que les mouvements ne changent pas
+    lazy_download(
+        _("Télécharger l'historique PDF"), engine, ("inventory_movements_pdf", lang), ("inventory_movements",),
+        lambda: report_from_sql(
+            engine, pdf_query, {"entry": _("Entrée"), "exit": _("Sortie")},
+            title=_("Historique des mouvements"), columns=pdf_columns,
+            labels={"subtotal": _("Sous-total page"), "total": _("Total"), "empty": _("Aucun mouvement enregistré.")},
+        ),
+        f"inventory_movements_{datetime.now().strftime('%Y-%m-%d')}.pdf", "application/pdf",
+        key="movements_pdf",
     )
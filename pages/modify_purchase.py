@@ -1,58 +1,56 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
+from db_utils import get_engine, check_connection
+from cache_utils import read_sql
+from repository import get_repository
 
 st.title("✏️ Modifier un achat")
 
-# --- Récupérer l'URL de la base de données depuis Streamlit secrets ---
-DATABASE_URL = st.secrets["database"]["url"]
-
-# --- Créer le moteur SQLAlchemy ---
-engine = create_engine(DATABASE_URL)
+# --- Moteur SQLAlchemy partagé (pool configuré dans st.secrets) ---
+engine = get_engine()
+repo = get_repository(engine)
 
 # --- Vérification connexion ---
 try:
-    with engine.connect() as conn:
-        db_version = conn.execute(text("SELECT version()")).fetchone()
-    st.success(f"✅ Connecté à la base: {db_version[0]}")
+    db_version = check_connection(engine)
+    st.success(f"✅ Connecté à la base: {db_version}")
 except SQLAlchemyError as e:
     st.error(f"❌ Erreur de connexion à la base: {e}")
     st.stop()
 
-# --- Charger les données ---
+# --- Sidebar filtres ---
+st.sidebar.header("🔎 Filtres")
+
 try:
-    with engine.connect() as conn:
-        df = pd.read_sql("SELECT * FROM purchases ORDER BY date DESC", conn)
+    # Liste des catégories lue dans la synthèse journalière (petite table)
+    known_categories = read_sql(
+        engine,
+        "SELECT DISTINCT category FROM daily_category_purchases WHERE category <> '' ORDER BY category",
+        tables=("purchases",)
+    )["category"].tolist()
 except Exception as e:
     st.error(f"Erreur lors du chargement des données: {e}")
     st.stop()
 
-# --- Sidebar filtres ---
-st.sidebar.header("🔎 Filtres")
-
 with st.sidebar:
     start_date = st.date_input("📅 Date de début", value=datetime.today().replace(day=1))
     end_date = st.date_input("📅 Date de fin", value=datetime.today())
-    categories = ["Tous"] + sorted(df["category"].dropna().unique().tolist()) if not df.empty else ["Tous"]
+    categories = ["Tous"] + known_categories
     category_filter = st.selectbox("📂 Catégorie", categories)
     search_term = st.text_input("🔍 Rechercher un produit")
 
-# --- Application des filtres ---
-filtered_df = df.copy()
-
-if category_filter != "Tous":
-    filtered_df = filtered_df[filtered_df["category"] == category_filter]
-
-filtered_df["date"] = pd.to_datetime(filtered_df["date"])
-filtered_df = filtered_df[
-    (filtered_df["date"] >= pd.to_datetime(start_date)) &
-    (filtered_df["date"] <= pd.to_datetime(end_date))
-]
-
-if search_term:
-    filtered_df = filtered_df[filtered_df["product"].str.contains(search_term, case=False, na=False)]
+# --- Charger les achats filtrés (filtres appliqués en SQL) ---
+try:
+    filtered_df = repo.purchases(
+        start_date, end_date,
+        category=None if category_filter == "Tous" else category_filter,
+        search=search_term, descending=True,
+    )
+except Exception as e:
+    st.error(f"Erreur lors du chargement des données: {e}")
+    st.stop()
 
 # --- Affichage du tableau ---
 st.subheader("🧾 Achats filtrés")
@@ -87,24 +85,19 @@ else:
         new_date = st.date_input("Date", value=pd.to_datetime(row["date"]))
 
         if st.button("💾 Enregistrer les modifications"):
+            changes = {
+                "product": new_product,
+                "category": new_category,
+                "subcategory": new_subcategory,
+                "supplier": new_supplier,
+                "quantity": new_quantity,
+                "purchase_price": new_purchase_price,
+                "sale_price": new_sale_price,
+                "date": new_date.strftime("%Y-%m-%d"),
+            }
             try:
-                with engine.begin() as conn:
-                    conn.execute(text("""
-                        UPDATE purchases SET
-                            product = :product, category = :category, subcategory = :subcategory, supplier = :supplier,
-                            quantity = :quantity, purchase_price = :purchase_price, sale_price = :sale_price, date = :date
-                        WHERE id = :id
-                    """), {
-                        "product": new_product,
-                        "category": new_category,
-                        "subcategory": new_subcategory,
-                        "supplier": new_supplier,
-                        "quantity": new_quantity,
-                        "purchase_price": new_purchase_price,
-                        "sale_price": new_sale_price,
-                        "date": new_date.strftime("%Y-%m-%d"),
-                        "id": selected_id
-                    })
+                # Synthèses journalières et index de recherche suivis dans la même transaction
+                repo.update_purchase(int(selected_id), **changes)
                 st.success("✅ Achat modifié avec succès.")
             except SQLAlchemyError as e:
                 st.error(f"Erreur lors de la mise à jour : {e}")
@@ -1,51 +1,35 @@
 # finance.py - Saisie Caisse, Crédit et Dépenses (PostgreSQL / mkdb)
 import streamlit as st
-import pandas as pd
-from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
 from datetime import datetime
-from io import BytesIO
+from db_utils import get_engine, check_connection, reset_connection_check
+from repository import get_repository
+from journal_utils import cash_writer, sync_caption, Journal, JournalFull
+from export_utils import download_export
 
 st.set_page_config(page_title="💰 Gestion Financière", layout="wide")
 
 # --- Connexion PostgreSQL ---
 try:
-    DATABASE_URL = st.secrets["database"]["url"]
-    engine = create_engine(DATABASE_URL)
-
-    with engine.connect() as conn:
-        db_version = conn.execute(text("SELECT version()")).fetchone()
-    st.success(f"✅ Connecté à : {db_version[0]}")
+    engine = get_engine()
+    repo = get_repository(engine)
+    # Base distante : saisies écrites dans le journal local puis synchronisées
+    writer = cash_writer(engine)
 except SQLAlchemyError as e:
     st.error(f"❌ Connexion base échouée : {e}")
     st.stop()
 
-# --- Création des tables si non existantes ---
-with engine.begin() as conn:
-    conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS caisse (
-            id SERIAL PRIMARY KEY,
-            montant NUMERIC,
-            date DATE,
-            periode TEXT
-        )
-    """))
-    conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS credits (
-            id SERIAL PRIMARY KEY,
-            montant NUMERIC,
-            date DATE,
-            note TEXT
-        )
-    """))
-    conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS expenses (
-            id SERIAL PRIMARY KEY,
-            montant NUMERIC,
-            date DATE,
-            type TEXT
-        )
-    """))
+# Une fois le journal lancé, la saisie continue même sans réseau
+online = True
+try:
+    db_version = check_connection(engine)
+    st.success(f"✅ Connecté à : {db_version}")
+except SQLAlchemyError as e:
+    if not isinstance(writer, Journal):
+        st.error(f"❌ Connexion base échouée : {e}")
+        st.stop()
+    online = False
+    st.warning("📴 Base distante injoignable : les saisies sont gardées sur ce poste et partiront au retour du réseau.")
 
 # --- Sélecteur de section ---
 section = st.radio("Choisir une opération :", ["💰 Caisse", "🏦 Crédit", "💸 Dépense"], horizontal=True)
@@ -61,16 +45,11 @@ if section == "💰 Caisse":
         periode = st.selectbox("Plage horaire", ["🕐 04–14", "🕑 14–17", "🌙 17–02"])
         submit_caisse = st.form_submit_button("Enregistrer")
         if submit_caisse:
-            with engine.begin() as conn:
-                conn.execute(text("""
-                    INSERT INTO caisse (montant, date, periode)
-                    VALUES (:montant, :date, :periode)
-                """), {
-                    "montant": montant,
-                    "date": date_val,
-                    "periode": periode
-                })
-            st.success(f"✅ {montant:.2f} TND ajouté à la caisse ({periode})")
+            try:
+                writer.add_cash(montant, date_val, periode)
+                st.success(f"✅ {montant:.2f} TND ajouté à la caisse ({periode})")
+            except JournalFull as e:
+                st.error(f"❌ {e}")
 
 # ==========================
 # 🏦 CRÉDIT
@@ -83,16 +62,11 @@ elif section == "🏦 Crédit":
         note = st.text_input("Note / Source du crédit")
         submit_credit = st.form_submit_button("Enregistrer")
         if submit_credit:
-            with engine.begin() as conn:
-                conn.execute(text("""
-                    INSERT INTO credits (montant, date, note)
-                    VALUES (:montant, :date, :note)
-                """), {
-                    "montant": montant,
-                    "date": date_val,
-                    "note": note
-                })
-            st.success(f"✅ Crédit de {montant:.2f} TND enregistré")
+            try:
+                writer.add_credit(montant, date_val, note)
+                st.success(f"✅ Crédit de {montant:.2f} TND enregistré")
+            except JournalFull as e:
+                st.error(f"❌ {e}")
 
 # ==========================
 # 💸 DÉPENSES
@@ -111,49 +85,47 @@ elif section == "💸 Dépense":
         ])
         submit_depense = st.form_submit_button("Enregistrer")
         if submit_depense:
-            with engine.begin() as conn:
-                conn.execute(text("""
-                    INSERT INTO expenses (montant, date, type)
-                    VALUES (:montant, :date, :type)
-                """), {
-                    "montant": montant,
-                    "date": date_val,
-                    "type": type_depense
-                })
-            st.success(f"✅ Dépense de {montant:.2f} TND enregistrée ({type_depense})")
+            try:
+                writer.add_expense(montant, date_val, type_depense)
+                st.success(f"✅ Dépense de {montant:.2f} TND enregistrée ({type_depense})")
+            except JournalFull as e:
+                st.error(f"❌ {e}")
 
 # ==========================
 # 📊 Historique & Export
 # ==========================
+sync_caption(writer)
+if not online:
+    st.stop()
+
 st.subheader("📜 Historique des Opérations")
 
 tables = {
-    "💰 Caisse": "caisse",
-    "🏦 Crédit": "credits",
-    "💸 Dépenses": "expenses"
+    "💰 Caisse": ("caisse", repo.cash),
+    "🏦 Crédit": ("credits", repo.credits),
+    "💸 Dépenses": ("expenses", repo.expenses)
 }
 
 selected_table = st.selectbox("Choisir la table à afficher", list(tables.keys()))
-table_name = tables[selected_table]
+table_name, load_history = tables[selected_table]
 
-with engine.connect() as conn:
-    df_hist = pd.read_sql(f"SELECT * FROM {table_name} ORDER BY date DESC", conn)
+try:
+    df_hist = load_history()
+except SQLAlchemyError:
+    # Lien coupé depuis le dernier test de connexion : nouveau test au prochain affichage
+    reset_connection_check(engine)
+    st.warning("📴 Base distante injoignable : les saisies sont gardées sur ce poste et partiront au retour du réseau.")
+    st.stop()
 
 if df_hist.empty:
     st.info("Aucune donnée enregistrée.")
 else:
     st.dataframe(df_hist)
 
-    # Export Excel
-    def to_excel(dataframe):
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            dataframe.to_excel(writer, index=False)
-        return output.getvalue()
-
-    st.download_button(
-        label="📥 Télécharger (Excel)",
-        data=to_excel(df_hist),
-        file_name=f"{table_name}_{datetime.now().strftime('%Y-%m-%d')}.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    # Export (lecture par paquets, voir export_utils)
+    download_export(
+        "📥 Télécharger",
+        engine, f"SELECT * FROM {table_name} ORDER BY date DESC",
+        file_stem=f"{table_name}_{datetime.now().strftime('%Y-%m-%d')}",
+        key=f"export_{table_name}", tables=(table_name,),
     )
@@ -1,69 +1,31 @@
 # gain.py - PostgreSQL / mkdb version avec calcul mensuel complet
 import streamlit as st
+import time
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
 from datetime import datetime
-from io import BytesIO
+from db_utils import get_engine, check_connection
+from cache_utils import read_sql
+from ledger_utils import monthly_ledger
+from valuation_utils import valuation_summary
+from export_utils import download_export
 
 # --- Config page ---
 st.set_page_config(page_title="📈 Calculateur de Gain", layout="wide")
 
 # --- Connexion PostgreSQL ---
 try:
-    DATABASE_URL = st.secrets["database"]["url"]
-    engine = create_engine(DATABASE_URL)
-
-    with engine.connect() as conn:
-        db_version = conn.execute(text("SELECT version()")).fetchone()
-    st.success(f"✅ Connecté à : {db_version[0]}")
+    engine = get_engine()
+    db_version = check_connection(engine)
+    st.success(f"✅ Connecté à : {db_version}")
 except SQLAlchemyError as e:
     st.error(f"❌ Connexion base échouée : {e}")
     st.stop()
 
-# --- Création des tables si elles n'existent pas ---
-with engine.begin() as conn:
-    conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS purchases (
-            id SERIAL PRIMARY KEY,
-            product TEXT,
-            category TEXT,
-            subcategory TEXT,
-            supplier TEXT,
-            quantity INTEGER,
-            purchase_price NUMERIC,
-            sale_price NUMERIC,
-            date DATE
-        )
-    """))
-    conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS caisse (
-            id SERIAL PRIMARY KEY,
-            montant NUMERIC,
-            date DATE,
-            periode TEXT
-        )
-    """))
-    conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS credits (
-            id SERIAL PRIMARY KEY,
-            montant NUMERIC,
-            date DATE,
-            note TEXT
-        )
-    """))
-    conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS expenses (
-            id SERIAL PRIMARY KEY,
-            montant NUMERIC,
-            date DATE,
-            type TEXT
-        )
-    """))
-
 st.title("📊 Calculateur de Gain sur les Ventes")
 
-# --- Lecture des données Achats/Ventes ---
+# --- Lecture des données Achats/Ventes (jour sélectionné uniquement) ---
 query = """
 SELECT 
     id, 
@@ -77,31 +39,33 @@ SELECT
     date,
     (sale_price - purchase_price) * quantity AS gain
 FROM purchases
-WHERE purchase_price IS NOT NULL AND sale_price IS NOT NULL
-ORDER BY date DESC
+WHERE purchase_price IS NOT NULL AND sale_price IS NOT NULL AND date = :date
 """
 
-with engine.connect() as conn:
-    df = pd.read_sql(query, conn)
+# Les dates et totaux viennent de la synthèse journalière (rollup_utils)
+dates = read_sql(
+    engine, "SELECT date FROM daily_purchases WHERE priced_lines > 0 ORDER BY date DESC", tables=("purchases",)
+)["date"].tolist()
 
-if df.empty:
+if not dates:
     st.warning("Aucune donnée disponible pour le calcul de gain.")
     st.stop()
 
-df["date"] = pd.to_datetime(df["date"]).dt.date
-dates = sorted(df["date"].unique(), reverse=True)
 selected_date = st.selectbox("📅 Sélectionner une date", dates)
 
-filtered_df = df[df["date"] == selected_date]
+filtered_df = read_sql(engine, query, {"date": selected_date}, tables=("purchases",))
+day_totals = read_sql(engine, """
+    SELECT priced_purchase_total, priced_sale_total FROM daily_purchases WHERE date = :date
+""", {"date": selected_date}, tables=("purchases",)).iloc[0]
 
 # --- Tableau détaillé ---
 st.subheader(f"🛒 Détail des Achats/Ventes pour le {selected_date}")
 st.dataframe(filtered_df)
 
 # --- Résumé du jour ---
-total_gain = filtered_df["gain"].sum()
-total_vente = (filtered_df["sale_price"] * filtered_df["quantity"]).sum()
-total_achat = (filtered_df["purchase_price"] * filtered_df["quantity"]).sum()
+total_achat = float(day_totals["priced_purchase_total"])
+total_vente = float(day_totals["priced_sale_total"])
+total_gain = total_vente - total_achat
 
 col1, col2, col3 = st.columns(3)
 col1.metric("🛒 Total Achat", f"{total_achat:.2f} TND")
@@ -113,18 +77,10 @@ st.subheader("📦 Gain par produit")
 gain_par_produit = filtered_df.groupby("product")["gain"].sum().sort_values(ascending=False)
 st.bar_chart(gain_par_produit)
 
-# --- Export Excel ---
-def to_excel(dataframe):
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        dataframe.to_excel(writer, index=False)
-    return output.getvalue()
-
-st.download_button(
-    label="📥 Télécharger (Excel)",
-    data=to_excel(filtered_df),
-    file_name=f"gain_{selected_date}.xlsx",
-    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# --- Export ---
+download_export(
+    "📥 Télécharger", engine, query, {"date": selected_date}, file_stem=f"gain_{selected_date}",
+    key="gain_export", tables=("purchases",),
 )
 
 # =========================
@@ -137,57 +93,29 @@ mode_vue = st.radio("Mode d'affichage :", ["📅 Jour", "🗓 Mois"], horizontal
 if mode_vue == "📅 Jour":
     st.write("📊 Analyse journalière déjà affichée ci-dessus.")
 else:
-    query_all = """
-    SELECT 
-        p.date,
-        (p.sale_price - p.purchase_price) * p.quantity AS gain_vente,
-        p.sale_price * p.quantity AS total_vente,
-        p.purchase_price * p.quantity AS total_achat,
-        COALESCE(ca.montant, 0) AS caisse,
-        COALESCE(cr.montant, 0) AS credit,
-        COALESCE(ch.montant, 0) AS depense
-    FROM purchases p
-    LEFT JOIN (
-        SELECT date, SUM(montant) AS montant FROM caisse GROUP BY date
-    ) ca ON ca.date = p.date
-    LEFT JOIN (
-        SELECT date, SUM(montant) AS montant FROM credits GROUP BY date
-    ) cr ON cr.date = p.date
-    LEFT JOIN (
-        SELECT date, SUM(montant) AS montant FROM expenses GROUP BY date
-    ) ch ON ch.date = p.date
-    """
-
+    # Compte de résultat mensuel (ledger_utils) : chaque source est agrégée par jour puis
+    # par mois séparément, lues en parallèle ; les mois sans activité restent à zéro
     try:
-        with engine.connect() as conn:
-            df_all = pd.read_sql(query_all, conn)
+        wall_start = time.perf_counter()
+        df_month, timings = monthly_ledger(engine)
+        wall = time.perf_counter() - wall_start
     except SQLAlchemyError as e:
         st.error(f"Erreur récupération données : {e}")
         st.stop()
 
-    if df_all.empty:
+    with st.expander("⏱️ Temps de chargement"):
+        st.dataframe(pd.DataFrame({
+            "requête": list(timings),
+            "durée (ms)": [round(t * 1000, 1) for t in timings.values()],
+        }), hide_index=True)
+        st.caption(f"Somme : {sum(timings.values()) * 1000:.1f} ms · attente réelle : {wall * 1000:.1f} ms")
+
+    if df_month.empty:
         st.warning("Aucune donnée disponible pour la vue mensuelle.")
     else:
-        df_all["date"] = pd.to_datetime(df_all["date"])
-        df_all["mois"] = df_all["date"].dt.to_period("M").astype(str)
-
-        df_month = df_all.groupby("mois").agg({
-            "gain_vente": "sum",
-            "total_vente": "sum",
-            "total_achat": "sum",
-            "caisse": "sum",
-            "credit": "sum",
-            "depense": "sum"
-        }).reset_index()
-
-        df_month["gain_brut"] = df_month["gain_vente"]
-        df_month["gain_net"] = (df_month["caisse"] + df_month["credit"]) - df_month["depense"]
-
-        df_month["evol_brut_%"] = df_month["gain_brut"].pct_change() * 100
-        df_month["evol_net_%"] = df_month["gain_net"].pct_change() * 100
-
-        df_month["evol_brut_%"] = df_month["evol_brut_%"].fillna(0).apply(lambda x: f"{x:+.1f}%")
-        df_month["evol_net_%"] = df_month["evol_net_%"].fillna(0).apply(lambda x: f"{x:+.1f}%")
+        # Un mois précédent à zéro (et le premier mois) n'a pas de variation en % : cellule vide
+        df_month["evol_brut_%"] = df_month["gain_brut"].pct_change().replace([np.inf, -np.inf], np.nan) * 100
+        df_month["evol_net_%"] = df_month["gain_net"].pct_change().replace([np.inf, -np.inf], np.nan) * 100
 
         st.subheader("📊 Résumé mensuel")
         st.dataframe(df_month.style.format({
@@ -197,8 +125,48 @@ else:
             "total_achat": "{:.2f} TND",
             "caisse": "{:.2f} TND",
             "credit": "{:.2f} TND",
-            "depense": "{:.2f} TND"
-        }))
+            "depense": "{:.2f} TND",
+            "evol_brut_%": "{:+.1f}%",
+            "evol_net_%": "{:+.1f}%",
+        }, na_rep=""))
 
         st.subheader("📈 Évolution mensuelle du gain net")
         st.line_chart(df_month.set_index("mois")[["gain_net", "gain_brut"]])
+
+# =========================
+# 📦 Valorisation du stock
+# =========================
+st.header("📦 Valorisation du stock")
+
+# Mois clos lus en base (valuation_utils.close_months), mois en cours rejoué à la volée
+col_method, col_by = st.columns(2)
+methode = col_method.radio("Méthode :", ["fifo", "wac"], horizontal=True,
+                           format_func=lambda m: {"fifo": "FIFO", "wac": "Coût moyen pondéré"}[m])
+axe = col_by.radio("Regrouper par :", ["depot", "category"], horizontal=True,
+                   format_func=lambda c: {"depot": "Dépôt", "category": "Catégorie"}[c])
+
+try:
+    df_val = valuation_summary(engine, methode, axe)
+except SQLAlchemyError as e:
+    st.error(f"Erreur récupération données : {e}")
+    st.stop()
+
+if df_val.empty:
+    st.info("Aucun mouvement d'inventaire à valoriser.")
+else:
+    df_val = df_val.rename(columns={
+        "month": "mois", "depot": "dépôt", "category": "catégorie",
+        "entries_value": "entrées", "cogs": "coût des sorties", "closing_value": "stock final",
+        "short_qty": "sorties sans stock",
+    })
+    groupe = {"depot": "dépôt", "category": "catégorie"}[axe]
+    st.dataframe(df_val[["mois", groupe, "entrées", "coût des sorties", "stock final", "sorties sans stock"]].style.format({
+        "entrées": "{:.2f} TND",
+        "coût des sorties": "{:.2f} TND",
+        "stock final": "{:.2f} TND",
+    }))
+
+    st.subheader("📈 Valeur du stock en fin de mois")
+    st.line_chart(df_val.pivot_table(index="mois", columns=groupe, values="stock final", aggfunc="sum"))
+    st.subheader("📉 Coût des sorties par mois")
+    st.bar_chart(df_val.pivot_table(index="mois", columns=groupe, values="coût des sorties", aggfunc="sum"))
@@ -1,48 +1,48 @@
 # pages/statistics.py
 import streamlit as st
-from sqlalchemy import create_engine, text
-import pandas as pd
 import matplotlib.pyplot as plt
 from datetime import date
-from lang_utils import get_translation
+from lang_utils import translator
+from db_utils import get_engine
+from repository import get_repository
+from cache_utils import read_sql
+from snapshot_utils import read_table
 
 # --- LANGUAGE ---
 lang = st.sidebar.selectbox("🌍 Langue / اللغة", ["fr", "ar"], index=0)
-t = lambda key: get_translation(key, lang)
+t = translator(lang)
 
 st.set_page_config(page_title=t("Purchases & Statistics"), layout="wide", page_icon="📊")
 st.title("📊 " + t("Purchases & Statistics"))
 
 # --- DATABASE CONNECTION ---
-DATABASE_URL = st.secrets["database"]["url"]
-engine = create_engine(DATABASE_URL)
+engine = get_engine()
 
 # --- LOAD PURCHASES ---
+PURCHASE_COLUMNS = ["id", "product", "category", "subcategory", "supplier",
+                    "quantity", "purchase_price", "sale_price", "date"]
+
 def load_purchases(start_date=None, end_date=None, search=None):
-    query = """
-        SELECT id, product, category, subcategory, supplier,
-               quantity, purchase_price, sale_price, date
-        FROM purchases
-        WHERE 1=1
-    """
-    params = {}
-    if start_date:
-        query += " AND date >= :start_date"
-        params["start_date"] = start_date
-    if end_date:
-        query += " AND date <= :end_date"
-        params["end_date"] = end_date
-    if search:
-        query += " AND LOWER(product) LIKE :search"
-        params["search"] = f"%{search.lower()}%"
+    if not search:
+        # Closed months come from the Parquet archives, the current month from the database
+        df = read_table(engine, "purchases", start_date, end_date, columns=PURCHASE_COLUMNS)
+        df["date"] = df["date"].dt.date
+        return df
 
-    query += " ORDER BY date ASC"
+    # Accent/case-insensitive substring match backed by the search index
+    return get_repository(engine).purchases(start_date, end_date, search=search)
 
-    with engine.connect() as conn:
-        result = conn.execute(text(query), params)
-        rows = result.fetchall()
-        cols = result.keys()
-        return pd.DataFrame(rows, columns=cols)
+# --- LOAD DAILY TOTALS (rollup, no raw rows) ---
+def load_daily_totals(start_date, end_date):
+    query = """
+        SELECT date, purchase_total AS total_purchase, sale_total AS total_sale
+        FROM daily_purchases
+        WHERE date >= :start_date AND date <= :end_date
+        ORDER BY date ASC
+    """
+    daily = read_sql(engine, query, {"start_date": start_date, "end_date": end_date}, tables=("purchases",))
+    daily[["total_purchase", "total_sale"]] = daily[["total_purchase", "total_sale"]].astype(float)
+    return daily
 
 # --- FILTERS ---
 col1, col2, col3 = st.columns([1, 1, 2])
@@ -62,8 +62,13 @@ else:
     # --- CALCULATE TOTALS ---
     df["total_purchase"] = df["purchase_price"] * df["quantity"]
     df["total_sale"] = df["sale_price"] * df["quantity"]
-    total_purchase_value = df["total_purchase"].sum()
-    total_sale_value = df["total_sale"].sum()
+    # Without a product search, totals come from the daily rollup
+    if search:
+        daily_totals = df.groupby("date")[["total_purchase", "total_sale"]].sum().reset_index()
+    else:
+        daily_totals = load_daily_totals(start_date, end_date)
+    total_purchase_value = daily_totals["total_purchase"].sum()
+    total_sale_value = daily_totals["total_sale"].sum()
     total_gain = total_sale_value - total_purchase_value
     margin_percent = (total_gain / total_purchase_value * 100) if total_purchase_value else 0
 
@@ -76,7 +81,6 @@ else:
     col4.metric(t("Margin %"), f"{margin_percent:.1f}%")
 
     # --- CHART: EVOLUTION OVER TIME ---
-    daily_totals = df.groupby("date")[["total_purchase", "total_sale"]].sum().reset_index()
     st.subheader(t("Evolution Over Time"))
     fig, ax = plt.subplots(figsize=(10, 5))
     ax.plot(daily_totals["date"], daily_totals["total_purchase"], label=t("Purchase Value"), marker="o")
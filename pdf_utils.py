@@ -0,0 +1,306 @@
+# pdf_utils.py
+# Rapports PDF tabulaires : colonnes formatées en bloc (pandas / numpy),
+# pagination avec en-tête, pied de page, sous-totaux par page et total final.
+# Police Unicode (DejaVu, livrée dans fonts/) pour le français et l'arabe ;
+# sans police trouvée, repli sur Helvetica (latin-1) et erreur explicite
+# dès qu'un libellé arabe doit être imprimé.
+# Le débit est celui de fpdf.cell() (≈ 50 000 lignes/s, comme l'ancienne
+# boucle) : le gain est la mise en page, pas la vitesse.
+# Usage : python pdf_utils.py [--rows 100000]   (mesure du débit)
+
+import os
+import re
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from fpdf import FPDF, set_global
+
+# Police : variable PDF_FONT, dossier fonts/ du projet, puis polices système
+FONT_PATHS = [
+    os.environ.get("PDF_FONT"),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts", "DejaVuSans.ttf"),
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/Library/Fonts/DejaVuSans.ttf",
+    "C:/Windows/Fonts/DejaVuSans.ttf",
+]
+FONT_SIZE = 8
+ROW_HEIGHT = 5
+MARGIN = 10
+CHAR_WIDTH = 0.5          # largeur moyenne d'un caractère, en fraction de la taille (mm)
+
+_ARABIC = re.compile("[\u0600-\u06FF]")
+# Après mise en forme : lettres arabes et leurs formes de présentation liées
+_ARABIC_GLYPHS = re.compile("[\u0600-\u06FF\uFB50-\uFDFF\uFE70-\uFEFC]")
+# Emojis et autres caractères hors BMP : absents de DejaVu et refusés par fpdf 1.7
+_OUTSIDE_BMP = re.compile("[\U00010000-\U0010FFFF]\\s*")
+
+# Mise en forme de l'arabe (lettres liées + ordre visuel) si les paquets sont installés
+try:
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+except ImportError:
+    arabic_reshaper = None
+
+
+class FontMissing(RuntimeError):
+    """Texte arabe à imprimer sans police Unicode (il deviendrait '?')."""
+
+
+def font_path():
+    """Premier fichier de police Unicode disponible, sinon None."""
+    for path in FONT_PATHS:
+        if path and os.path.exists(path):
+            return path
+    return None
+
+
+@lru_cache(maxsize=4096)
+def _shape_text(value):
+    return get_display(arabic_reshaper.reshape(value))
+
+
+def shape(value):
+    """Prépare un libellé pour l'affichage (arabe relié et remis dans l'ordre visuel)."""
+    value = _OUTSIDE_BMP.sub("", "" if value is None else str(value))
+    if arabic_reshaper and _ARABIC.search(value):
+        return _shape_text(value)
+    return value
+
+
+# --- Mise en forme vectorisée ---
+
+def format_columns(frame, columns):
+    """
+    Convertit `frame` en DataFrame de chaînes prêtes à imprimer.
+    `columns` : liste de (colonne, libellé, largeur mm, type) avec type
+    parmi "text", "money", "int", "date".
+    """
+    out = {}
+    for key, _label, width, kind in columns:
+        values = frame[key]
+        if kind == "money":
+            out[key] = np.char.mod("%.2f", pd.to_numeric(values, errors="coerce").fillna(0).to_numpy(float))
+        elif kind == "int":
+            out[key] = np.char.mod("%d", pd.to_numeric(values, errors="coerce").fillna(0).to_numpy("int64"))
+        elif kind == "date":
+            out[key] = pd.to_datetime(values, errors="coerce").dt.strftime("%Y-%m-%d").fillna("")
+        else:
+            max_chars = max(int(width / (FONT_SIZE * CHAR_WIDTH * 0.3528)), 3)
+            text = values.fillna("").astype(str).str.replace(_OUTSIDE_BMP, "", regex=True)
+            long = text.str.len() > max_chars
+            text = text.where(~long, text.str.slice(0, max_chars - 1) + "…")
+            arabic = text.str.contains(_ARABIC, regex=True)
+            if arabic_reshaper and arabic.any():
+                text = text.where(~arabic, text[arabic].map(shape))
+            out[key] = text
+    return pd.DataFrame({k: np.asarray(v) for k, v in out.items()}, index=frame.index)
+
+
+# --- Document ---
+
+class ReportPDF(FPDF):
+    """FPDF avec en-tête (titre, date) et pied de page (numéro de page) répétés."""
+
+    def __init__(self, title, orientation="P"):
+        super().__init__(orientation=orientation, unit="mm", format="A4")
+        self.report_title = title
+        self.generated = datetime.now().strftime("%Y-%m-%d %H:%M")
+        self.font_family_name = "Helvetica"
+        path = font_path()
+        if path:
+            # Métriques de la police mises en cache hors du dossier système
+            set_global("FPDF_CACHE_MODE", 2)
+            set_global("FPDF_CACHE_DIR", tempfile.gettempdir())
+            self.add_font("DejaVu", "", path, uni=True)
+            bold = path.replace("DejaVuSans.ttf", "DejaVuSans-Bold.ttf")
+            self.add_font("DejaVu", "B", bold if os.path.exists(bold) else path, uni=True)
+            self.font_family_name = "DejaVu"
+        self.unicode = path is not None
+        self.set_margins(MARGIN, MARGIN, MARGIN)
+        self.set_auto_page_break(False)
+        self.alias_nb_pages()
+
+    def _txt(self, value):
+        """Libellé prêt pour cell() (ne remplace pas FPDF.text(x, y, txt))."""
+        value = shape(value)
+        if self.unicode:
+            return value
+        if _ARABIC_GLYPHS.search(value):
+            raise FontMissing("Police DejaVuSans.ttf introuvable (fonts/ ou PDF_FONT) : l'arabe ne peut pas être imprimé")
+        # Autres caractères hors latin-1 (tirets, guillemets...) : '?'
+        return value.encode("latin-1", "replace").decode("latin-1")
+
+    def _putfonts(self):
+        # fpdf 1.7 ajoute chaque caractère imprimé à font["subset"] (liste avec
+        # doublons) puis y cherche chaque code : sans dédoublonnage, la sortie
+        # devient quadratique en nombre de lignes
+        for font in self.fonts.values():
+            if isinstance(font.get("subset"), list):
+                font["subset"] = sorted(set(font["subset"]))
+        super()._putfonts()
+
+    def header(self):
+        self.set_font(self.font_family_name, "B", 12)
+        self.cell(0, 8, self._txt(self.report_title), ln=0, align="L")
+        self.set_font(self.font_family_name, "", FONT_SIZE)
+        self.cell(0, 8, self.generated, ln=1, align="R")
+        self.ln(2)
+
+    def footer(self):
+        self.set_y(-MARGIN)
+        self.set_font(self.font_family_name, "", FONT_SIZE)
+        self.cell(0, 5, f"{self.page_no()} / {{nb}}", align="C")
+
+
+def _rows_per_page(pdf):
+    usable = pdf.h - 2 * MARGIN - 10 - 5     # en-tête de page, pied de page
+    return int(usable // ROW_HEIGHT) - 2      # ligne de titres + sous-total
+
+
+def _table_header(pdf, columns):
+    pdf.set_font(pdf.font_family_name, "B", FONT_SIZE)
+    pdf.set_fill_color(230, 230, 230)
+    for _key, label, width, kind in columns:
+        pdf.cell(width, ROW_HEIGHT + 1, pdf._txt(label), border=1, align="L" if kind == "text" else "C", fill=True)
+    pdf.ln()
+    pdf.set_font(pdf.font_family_name, "", FONT_SIZE)
+
+
+def _total_row(pdf, columns, label, totals):
+    pdf.set_font(pdf.font_family_name, "B", FONT_SIZE)
+    first = True
+    for key, _label, width, kind in columns:
+        if key in totals:
+            value = f"{totals[key]:.2f}" if kind == "money" else f"{int(totals[key])}"
+            pdf.cell(width, ROW_HEIGHT, value, border="T", align="R")
+        else:
+            pdf.cell(width, ROW_HEIGHT, pdf._txt(label) if first else "", border="T")
+        first = False
+    pdf.ln()
+    pdf.set_font(pdf.font_family_name, "", FONT_SIZE)
+
+
+def _write_page(pdf, rows, columns, totals, labels):
+    pdf.add_page()
+    _table_header(pdf, columns)
+    layout = [(width, "L" if kind in ("text", "date") else "R") for _k, _l, width, kind in columns]
+    cell, ln, convert = pdf.cell, pdf.ln, (None if pdf.unicode else pdf._txt)
+    for row in rows:
+        for (width, align), value in zip(layout, row):
+            cell(width, ROW_HEIGHT, convert(value) if convert else value, align=align)
+        ln(ROW_HEIGHT)
+    if totals:
+        _total_row(pdf, columns, labels["subtotal"], totals)
+
+
+def render_table(title, frames, columns, subtotal_columns=(), orientation="P", labels=None):
+    """
+    Produit un PDF (bytes) à partir d'un itérable de DataFrames (ex. paquets
+    lus en base) : chaque paquet est mis en forme en bloc puis découpé en
+    pages, sans charger toutes les lignes. `subtotal_columns` reçoivent un
+    sous-total par page et un total général.
+    """
+    labels = {"subtotal": "Sous-total page", "total": "Total", "empty": "Aucune donnée", **(labels or {})}
+    pdf = ReportPDF(title, orientation)
+    per_page = _rows_per_page(pdf)
+    keys = [key for key, _l, _w, _k in columns]
+    grand = dict.fromkeys(subtotal_columns, 0.0)
+    rows, amounts = [], {key: [] for key in subtotal_columns}
+
+    def flush(count):
+        totals = {key: float(sum(values[:count])) for key, values in amounts.items()}
+        _write_page(pdf, rows[:count], columns, totals, labels)
+        for key, value in totals.items():
+            grand[key] += value
+            del amounts[key][:count]
+        del rows[:count]
+
+    for frame in frames:
+        cells = format_columns(frame, columns)
+        rows.extend(zip(*(cells[key].tolist() for key in keys)))
+        for key in subtotal_columns:
+            amounts[key].extend(pd.to_numeric(frame[key], errors="coerce").fillna(0).tolist())
+        while len(rows) >= per_page:
+            flush(per_page)
+    if rows:
+        flush(len(rows))
+
+    if pdf.page_no() == 0:
+        pdf.add_page()
+        _table_header(pdf, columns)
+        pdf.cell(0, ROW_HEIGHT, pdf._txt(labels["empty"]), ln=1)
+    if grand:
+        if pdf.get_y() + ROW_HEIGHT > pdf.h - MARGIN - 5:
+            pdf.add_page()
+        pdf.ln(2)
+        _total_row(pdf, columns, labels["total"], grand)
+
+    with warnings.catch_warnings():
+        # fpdf 1.7 signale les formes arabiques (U+FExx) du cmap sans que le rendu en souffre
+        warnings.filterwarnings("ignore", message="cmap value too big/small")
+        data = pdf.output(dest="S")
+    return data.encode("latin-1") if isinstance(data, str) else bytes(data)
+
+
+def report_from_sql(engine, sql, params=None, title="", columns=(), subtotal_columns=(), **options):
+    """render_table() sur le résultat de `sql`, lu par paquets (voir export_utils)."""
+    from export_utils import iter_chunks
+
+    chunks = iter_chunks(engine, sql, params)
+    names = next(chunks)
+    return render_table(title, (pd.DataFrame(rows, columns=names) for rows in chunks),
+                        columns, subtotal_columns, **options)
+
+
+# --- Mesure ---
+
+def _legacy_pdf(frame):
+    # Ancienne boucle des pages : iterrows + encodage latin-1 + une cellule par ligne
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=12)
+    for _i, row in frame.iterrows():
+        line = f"{row['date']} | {row['periode']} | {float(row['montant']):.2f} TND"
+        line = line.encode("latin-1", "replace").decode("latin-1")
+        pdf.cell(200, 8, txt=line, ln=True)
+    return pdf.output(dest="S").encode("latin-1")
+
+
+def main(argv):
+    rows = 100_000
+    if "--rows" in argv:
+        rows = int(argv[argv.index("--rows") + 1])
+    rng = np.random.default_rng(7)
+    frame = pd.DataFrame({
+        "date": pd.Timestamp("2022-01-01") + pd.to_timedelta(rng.integers(0, 3 * 365, rows), unit="D"),
+        "periode": rng.choice(["🕐 04–14", "🕑 14–17", "🌙 17–02"], rows),
+        "note": rng.choice(["Recette", "دفعة نقدية", "Crédit réglé"], rows),
+        "montant": rng.uniform(50, 900, rows).round(2),
+    })
+    columns = [("date", "Date", 30, "date"), ("periode", "Plage horaire", 40, "text"),
+               ("note", "Note / ملاحظة", 70, "text"), ("montant", "Montant (TND)", 40, "money")]
+    chunks = (frame.iloc[i:i + 5000] for i in range(0, rows, 5000))
+
+    started = time.perf_counter()
+    data = render_table("Benchmark caisse", chunks, columns, ["montant"])
+    seconds = time.perf_counter() - started
+    print(f"✅ pdf_utils : {rows} lignes, {seconds:.2f} s ({rows / seconds:,.0f} lignes/s), "
+          f"{len(data) / 1e6:.1f} Mo, police {font_path() or 'Helvetica (latin-1)'}")
+
+    sample = frame
+    started = time.perf_counter()
+    _legacy_pdf(sample)
+    seconds = time.perf_counter() - started
+    print(f"ℹ️ ancienne boucle iterrows : {len(sample)} lignes, {seconds:.2f} s ({len(sample) / seconds:,.0f} lignes/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
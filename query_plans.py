@@ -0,0 +1,234 @@
+# query_plans.py
+# Vérifie par EXPLAIN que les requêtes des pages utilisent bien les index.
+# Usage : python query_plans.py [url] [--rows 200000]
+# Sans url, une base SQLite temporaire est remplie de données synthétiques.
+# Sur PostgreSQL, les données sont insérées dans une transaction annulée à la fin.
+
+import ast
+import glob
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+# Pages dont les requêtes écrites en clair sont contrôlées (lues dans le
+# source, sans exécuter la page) : chaînes SQL avec un WHERE paramétré
+PAGE_FILES = ("pages/*.py", "inev.py", "Dashboard_Résumé.py")
+
+# Valeurs des paramètres nommés des requêtes des pages
+SAMPLE_PARAMS = {
+    "date": "2024-03-15", "day": "2024-03-15",
+    "start": "2024-03-01", "end": "2024-03-31",
+    "start_date": "2024-03-01", "end_date": "2024-03-07",
+    "product": "Produit 42", "depot": "Dépôt 1", "category": "🥛 Produits Laitiers",
+}
+
+
+def page_literal_queries(root=None):
+    """[(page, requête, paramètres)] des requêtes paramétrées écrites en clair dans les pages."""
+    root = root or os.path.dirname(os.path.abspath(__file__))
+    queries = []
+    for pattern in PAGE_FILES:
+        for path in sorted(glob.glob(os.path.join(root, pattern))):
+            with open(path, encoding="utf-8") as f:
+                tree = ast.parse(f.read(), path)
+            for node in ast.walk(tree):
+                if not (isinstance(node, ast.Constant) and isinstance(node.value, str)):
+                    continue
+                sql = node.value
+                if re.search(r"\bSELECT\b", sql) and re.search(r"\bWHERE\b.*:\w+", sql, re.S):
+                    names = set(re.findall(r"(?<!:):(\w+)", sql))
+                    queries.append((os.path.relpath(path, root), sql, {n: SAMPLE_PARAMS[n] for n in names}))
+    return queries
+
+
+def module_queries(conn):
+    """
+    [(page, requête, paramètres[, table])] construites par les modules
+    qu'appellent les pages. Avec `table`, sa lecture doit en plus être une
+    plage d'index bornée des deux côtés (pas seulement "date <= ?").
+    """
+    from repository import get_repository
+    from stock_utils import stock_at_query
+    from weekly_utils import KEYS, comparison_params, comparison_sql
+
+    engine = conn.engine
+    repository = get_repository(engine)
+    end = date(2024, 3, 31)
+    queries = [
+        ("pages/ineev.py", comparison_sql(engine, ()), comparison_params(engine, end, 4)),
+        ("pages/ineev.py", comparison_sql(engine, KEYS), comparison_params(engine, end, 4)),
+        ("pages/modify_purchase.py", *repository.purchases_query(
+            conn, "2024-03-01", "2024-03-31", category="🥛 Produits Laitiers", descending=True)),
+        ("pages/modify_purchase.py", *repository.purchases_query(
+            conn, "2024-03-01", "2024-03-31", search="Produit 42", descending=True)),
+        ("pages/tils.py", *repository.purchases_query(conn, "2024-03-01", "2024-03-07", search="Produit 42")),
+        # Mouvements lus seulement depuis la dernière fin de mois : plage bornée des deux côtés
+        ("pages/inventory_movements.py", *stock_at_query("2024-03-15"), "inventory_movements"),
+    ]
+    return queries
+
+
+CATEGORIES = ["🥛 Produits Laitiers", "🍗 Volaille", "🥤 Liquides", "🧀 Fromage", "🥖 Daily", "📦 Divers"]
+PERIODES = ["🕐 04–14", "🕑 14–17", "🌙 17–02"]
+
+
+def seed_synthetic(conn, rows=200_000, days=3 * 365, seed=7):
+    """Remplit les tables avec des données synthétiques réparties sur `days` jours."""
+    rng = random.Random(seed)
+    start = date(2022, 1, 1)
+    day = lambda: (start + timedelta(days=rng.randrange(days))).isoformat()
+
+    purchases = [{
+        "product": f"Produit {rng.randrange(5000)}",
+        "category": rng.choice(CATEGORIES),
+        "subcategory": "",
+        "supplier": f"Fournisseur {rng.randrange(200)}",
+        "quantity": rng.randint(1, 20),
+        "purchase_price": round(rng.uniform(0.5, 50), 2),
+        "sale_price": round(rng.uniform(0.5, 60), 2),
+        "date": day(),
+    } for _ in range(rows)]
+    conn.execute(text("""
+        INSERT INTO purchases (product, category, subcategory, supplier, quantity, purchase_price, sale_price, date)
+        VALUES (:product, :category, :subcategory, :supplier, :quantity, :purchase_price, :sale_price, :date)
+    """), purchases)
+
+    cash_rows = max(rows // 20, 1)
+    conn.execute(text("INSERT INTO caisse (montant, date, periode) VALUES (:montant, :date, :periode)"), [
+        {"montant": round(rng.uniform(50, 900), 2), "date": day(), "periode": rng.choice(PERIODES)}
+        for _ in range(cash_rows)
+    ])
+    conn.execute(text("INSERT INTO credits (montant, date, note) VALUES (:montant, :date, '')"), [
+        {"montant": round(rng.uniform(10, 300), 2), "date": day()} for _ in range(cash_rows)
+    ])
+    conn.execute(text("INSERT INTO expenses (montant, date, type) VALUES (:montant, :date, 'Autre')"), [
+        {"montant": round(rng.uniform(10, 300), 2), "date": day()} for _ in range(cash_rows)
+    ])
+    conn.execute(text("""
+        INSERT INTO inventory_movements (product, depot, movement_type, quantity, price, date)
+        VALUES (:product, :depot, :movement_type, :quantity, :price, :date)
+    """), [{
+        "product": f"Produit {rng.randrange(5000)}",
+        "depot": rng.choice(["Dépôt 1", "Dépôt 2"]),
+        "movement_type": rng.choice(["entry", "exit"]),
+        "quantity": rng.randint(1, 50),
+        "price": round(rng.uniform(0.5, 50), 2),
+        "date": day(),
+    } for _ in range(rows // 4)])
+    conn.execute(text("ANALYZE"))
+
+
+def _sqlite_seq_scans(conn, sql, params):
+    plan = conn.execute(text("EXPLAIN QUERY PLAN " + sql), params).fetchall()
+    details = [row[-1] for row in plan]
+    # CTE et sous-requêtes (déjà filtrées) : leur parcours ne lit pas une table
+    derived = set(re.findall(r"(\w+)(?:\([^()]*\))?\s+AS\s*\(", sql)) | set(re.findall(r"\)\s*AS\s+(\w+)", sql))
+    derived |= {alias for name, alias in re.findall(r"(?:FROM|JOIN)\s+(\w+)\s+(?:AS\s+)?(\w+)", sql) if name in derived}
+    # "SCAN purchases" (ou son alias) sans "USING ... INDEX" = lecture complète de la table ;
+    # les tables FTS5 passent par leur propre index (VIRTUAL TABLE INDEX)
+    scans = [d for d in details
+             if re.match(r"SCAN \w+(?!.*USING (COVERING )?INDEX)(?!.*VIRTUAL TABLE INDEX)", d)
+             and d.split()[1] not in derived and d != "SCAN CONSTANT ROW"]
+    return scans, details
+
+
+def _postgres_seq_scans(conn, sql, params):
+    raw = conn.execute(text("EXPLAIN (FORMAT JSON) " + sql), params).scalar()
+    plan = raw if isinstance(raw, list) else json.loads(raw)
+    scans, details, stack = [], [], [plan[0]["Plan"]]
+    while stack:
+        node = stack.pop()
+        label = f"{node['Node Type']} {node.get('Relation Name', '')}".strip()
+        details.append(label)
+        if node["Node Type"] == "Seq Scan":
+            scans.append(label)
+        stack.extend(node.get("Plans", []))
+    return scans, details
+
+
+def _sqlite_unbounded(conn, sql, params, table):
+    details = [row[-1] for row in conn.execute(text("EXPLAIN QUERY PLAN " + sql), params).fetchall()]
+    names = {table} | set(re.findall(rf"\b{table}\s+(?:AS\s+)?(\w+)", sql))
+    reads = [d for d in details if re.match(r"(SEARCH|SCAN) (\w+)", d) and d.split()[1] in names]
+    return [f"plage ouverte : {d}" for d in reads if not re.search(r"\((\w+)>\? AND \1<\?\)", d)]
+
+
+def _postgres_unbounded(conn, sql, params, table):
+    raw = conn.execute(text("EXPLAIN (FORMAT JSON) " + sql), params).scalar()
+    plan = raw if isinstance(raw, list) else json.loads(raw)
+    unbounded, stack = [], [plan[0]["Plan"]]
+    while stack:
+        node = stack.pop()
+        if node.get("Relation Name") == table:
+            condition = node.get("Index Cond", "")
+            if ">" not in condition or "<" not in condition:
+                unbounded.append(f"plage ouverte : {node['Node Type']} {table} {condition}".rstrip())
+        stack.extend(node.get("Plans", []))
+    return unbounded
+
+
+def check_plans(conn):
+    """
+    Retourne [(page, requête, scans séquentiels, plan)] pour chaque requête
+    des pages (page_literal_queries et module_queries).
+    Une liste de scans vide signifie que la requête utilise un index (et
+    lit une plage bornée pour les requêtes qui le demandent).
+    """
+    explain = _sqlite_seq_scans if conn.dialect.name == "sqlite" else _postgres_seq_scans
+    unbounded = _sqlite_unbounded if conn.dialect.name == "sqlite" else _postgres_unbounded
+    results = []
+    for page, sql, params, *bounded in page_literal_queries() + module_queries(conn):
+        scans, details = explain(conn, sql, params)
+        for table in bounded:
+            scans += unbounded(conn, sql, params, table)
+        results.append((page, " ".join(sql.split()), scans, details))
+    return results
+
+
+def main(argv):
+    from db_utils import get_engine
+
+    rows = 200_000
+    if "--rows" in argv:
+        rows = int(argv[argv.index("--rows") + 1])
+        argv = argv[:argv.index("--rows")] + argv[argv.index("--rows") + 2:]
+
+    tmpdir = None
+    if argv:
+        url = argv[0]
+    else:
+        tmpdir = tempfile.mkdtemp()
+        url = f"sqlite:///{os.path.join(tmpdir, 'plans.db')}"
+
+    engine = get_engine(url)
+    with engine.connect() as conn:
+        trans = conn.begin()
+        print(f"⏳ Insertion de {rows} achats synthétiques...")
+        seed_synthetic(conn, rows)
+        results = check_plans(conn)
+        # Les données synthétiques ne sont jamais conservées
+        trans.rollback()
+    engine.dispose()
+
+    failures = 0
+    for page, sql, scans, details in results:
+        status = "❌ SCAN" if scans else "✅"
+        print(f"{status} {page}: {sql[:90]}")
+        print(f"     plan : {' | '.join(details)}")
+        failures += bool(scans)
+
+    if tmpdir:
+        os.remove(os.path.join(tmpdir, "plans.db"))
+        os.rmdir(tmpdir)
+    print(f"{failures} requête(s) sans index sur {len(results)}.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
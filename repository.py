@@ -0,0 +1,388 @@
+# repository.py
+# Couche d'accès aux données commune aux pages : une méthode par opération
+# (achats, caisse, crédits, dépenses, mouvements d'inventaire), au-dessus
+# d'un backend interchangeable :
+#  - SQLite     : base embarquée, une seule caisse, latence minimale
+#  - PostgreSQL : plusieurs caisses sur une base partagée
+# Chaque écriture met à jour synthèses journalières, stock, index de recherche
+# et versions de tables dans sa propre transaction.
+# Usage : python repository.py bench [url ...] [--rows 20000]
+# Sans url, le banc d'essai tourne sur une base SQLite temporaire.
+
+import sys
+import threading
+import time
+from datetime import date as date_type, datetime
+
+from sqlalchemy import text
+
+from cache_utils import bump_table_version, read_sql
+from db_utils import begin_write, get_engine, purchase_cost_sql
+from import_utils import insert_purchases
+from rollup_utils import cash_inserted, purchase_deleted, purchase_inserted, purchase_updated
+from search_utils import index_purchase, search_condition, unindex_purchase
+from stock_utils import movement_inserted
+from valuation_utils import movement_inserted as reopen_valuation
+
+PURCHASE_COLUMNS = ["product", "category", "subcategory", "supplier", "quantity", "purchase_price", "sale_price", "date"]
+MOVEMENT_TYPES = ("entry", "exit")
+
+_repositories = {}
+_lock = threading.Lock()
+
+
+# --- Backends ---
+
+class SQLiteBackend:
+    """SQLite embarqué : écritures sérialisées (begin_write), dates en texte ISO."""
+
+    dialect = "sqlite"
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def begin(self):
+        return begin_write(self.engine)
+
+    def connect(self):
+        return self.engine.connect()
+
+    def date(self, value):
+        if value is None:
+            return None
+        if isinstance(value, (date_type, datetime)):
+            return value.strftime("%Y-%m-%d")
+        return str(value)[:10]
+
+
+class PostgresBackend(SQLiteBackend):
+    """PostgreSQL partagé entre caisses : colonnes DATE natives."""
+
+    dialect = "postgresql"
+
+    def begin(self):
+        return self.engine.begin()
+
+    def date(self, value):
+        if value is None:
+            return None
+        if isinstance(value, datetime):
+            return value.date()
+        if isinstance(value, date_type):
+            return value
+        return date_type.fromisoformat(str(value)[:10])
+
+
+BACKENDS = {"sqlite": SQLiteBackend, "postgresql": PostgresBackend}
+
+
+def register_backend(dialect, backend_class):
+    """Ajoute (ou remplace) le backend utilisé pour un dialecte SQLAlchemy."""
+    BACKENDS[dialect] = backend_class
+
+
+# --- Dépôt ---
+
+class Repository:
+    """
+    Opérations métier sur une base. Les lectures renvoient des DataFrame
+    (via le cache de cache_utils), les écritures l'id créé ou None.
+    """
+
+    def __init__(self, engine, backend=None):
+        if backend is None:
+            if engine.dialect.name not in BACKENDS:
+                raise ValueError(f"Aucun backend pour {engine.dialect.name}")
+            backend = BACKENDS[engine.dialect.name](engine)
+        self.engine = engine
+        self.backend = backend
+
+    # --- Achats ---
+
+    def _purchase_row(self, values):
+        row = {column: values.get(column) for column in PURCHASE_COLUMNS}
+        for column in ("product", "category", "subcategory", "supplier"):
+            row[column] = (row[column] or "").strip()
+        row["date"] = self.backend.date(row["date"] or date_type.today())
+        return row
+
+    def add_purchase(self, product, quantity, purchase_price=None, sale_price=None, date=None,
+                     category="", subcategory="", supplier=""):
+        """Enregistre un achat et retourne son id."""
+        row = self._purchase_row(locals())
+        if not row["product"]:
+            raise ValueError("Nom du produit manquant")
+        with self.backend.begin() as conn:
+            purchase_id = conn.execute(text(f"""
+                INSERT INTO purchases ({", ".join(PURCHASE_COLUMNS)})
+                VALUES ({", ".join(":" + c for c in PURCHASE_COLUMNS)})
+                RETURNING id
+            """), row).scalar()
+            purchase_inserted(conn, row)
+            index_purchase(conn, purchase_id, row["product"])
+            bump_table_version(conn, "purchases")
+        return purchase_id
+
+    def add_purchases(self, rows):
+        """Enregistre une livraison (liste de dicts) en une transaction ; retourne le nombre de lignes."""
+        rows = [self._purchase_row(row) for row in rows]
+        if not rows:
+            return 0
+        with self.backend.begin() as conn:
+            insert_purchases(conn, rows)
+        return len(rows)
+
+    def update_purchase(self, purchase_id, **changes):
+        unknown = set(changes) - set(PURCHASE_COLUMNS)
+        if unknown:
+            raise ValueError(f"Colonnes inconnues : {', '.join(sorted(unknown))}")
+        if "date" in changes:
+            changes["date"] = self.backend.date(changes["date"])
+        with self.backend.begin() as conn:
+            # Synthèses mises à jour avant l'UPDATE (ancienne ligne retirée)
+            purchase_updated(conn, purchase_id, changes)
+            if "product" in changes:
+                index_purchase(conn, purchase_id, changes["product"])
+            conn.execute(text(f"""
+                UPDATE purchases SET {", ".join(f"{c} = :{c}" for c in changes)}
+                WHERE id = :id
+            """), {**changes, "id": purchase_id})
+            bump_table_version(conn, "purchases")
+
+    def delete_purchase(self, purchase_id):
+        with self.backend.begin() as conn:
+            purchase_deleted(conn, purchase_id)
+            unindex_purchase(conn, purchase_id)
+            conn.execute(text("DELETE FROM purchases WHERE id = :id"), {"id": purchase_id})
+            bump_table_version(conn, "purchases")
+
+    def _purchase_select(self, conn):
+        # Les bases SQLite historiques n'ont que `price` : exposé en purchase_price
+        return f"""
+            SELECT id, product, category, subcategory, supplier, quantity,
+                   {purchase_cost_sql(conn)} AS purchase_price, sale_price, date
+            FROM purchases
+        """
+
+    def purchase(self, purchase_id):
+        """Un achat (dict) ou None."""
+        with self.backend.connect() as conn:
+            row = conn.execute(
+                text(self._purchase_select(conn) + " WHERE id = :id"), {"id": purchase_id}
+            ).mappings().first()
+        return dict(row) if row else None
+
+    def purchases(self, start=None, end=None, category=None, search=None, descending=False, cursor=None, limit=None):
+        """
+        Achats entre start et end (inclus), triés par date puis id.
+        Avec limit : page par ordre décroissant, `cursor` = (date, id)
+        de la dernière ligne de la page précédente.
+        """
+        with self.backend.connect() as conn:
+            query, params = self.purchases_query(conn, start, end, category, search, descending, cursor, limit)
+        return read_sql(self.engine, query, params, tables=("purchases",))
+
+    def purchases_query(self, conn, start=None, end=None, category=None, search=None,
+                        descending=False, cursor=None, limit=None):
+        """(requête, paramètres) de purchases() ; aussi contrôlée par query_plans."""
+        params = {}
+        query = self._purchase_select(conn) + " WHERE 1=1"
+        if start:
+            query += " AND date >= :start"
+            params["start"] = self.backend.date(start)
+        if end:
+            query += " AND date <= :end"
+            params["end"] = self.backend.date(end)
+        if category:
+            query += " AND category = :category"
+            params["category"] = category
+        if search:
+            condition, search_params = search_condition(conn, search)
+            query += f" AND {condition}"
+            params.update(search_params)
+        if cursor:
+            query += " AND (date < :last_date OR (date = :last_date AND id < :last_id))"
+            params["last_date"], params["last_id"] = self.backend.date(cursor[0]), cursor[1]
+        query += " ORDER BY date DESC, id DESC" if descending or limit else " ORDER BY date, id"
+        if limit:
+            query += " LIMIT :limit"
+            params["limit"] = limit
+        return query, params
+
+    # --- Caisse, crédits, dépenses ---
+
+    def _add_cash_row(self, table, montant, date, extra):
+        values = {"montant": float(montant), "date": self.backend.date(date), **extra}
+        with self.backend.begin() as conn:
+            row_id = conn.execute(text(f"""
+                INSERT INTO {table} ({", ".join(values)})
+                VALUES ({", ".join(":" + c for c in values)})
+                RETURNING id
+            """), values).scalar()
+            cash_inserted(conn, table, values["montant"], values["date"])
+            bump_table_version(conn, table)
+        return row_id
+
+    def add_cash(self, montant, date, periode):
+        return self._add_cash_row("caisse", montant, date, {"periode": periode})
+
+    def add_credit(self, montant, date, note=""):
+        return self._add_cash_row("credits", montant, date, {"note": note})
+
+    def add_expense(self, montant, date, type):
+        return self._add_cash_row("expenses", montant, date, {"type": type})
+
+    def _dated_rows(self, table, start, end, descending=True):
+        query = f"SELECT * FROM {table} WHERE 1=1"
+        params = {}
+        if start:
+            query += " AND date >= :start"
+            params["start"] = self.backend.date(start)
+        if end:
+            query += " AND date <= :end"
+            params["end"] = self.backend.date(end)
+        query += f" ORDER BY date {'DESC' if descending else 'ASC'}, id {'DESC' if descending else 'ASC'}"
+        return read_sql(self.engine, query, params, tables=(table,))
+
+    def cash(self, start=None, end=None):
+        """Entrées de caisse, les plus récentes d'abord."""
+        return self._dated_rows("caisse", start, end)
+
+    def credits(self, start=None, end=None):
+        return self._dated_rows("credits", start, end)
+
+    def expenses(self, start=None, end=None):
+        return self._dated_rows("expenses", start, end)
+
+    # --- Mouvements d'inventaire ---
+
+    def add_movement(self, product, depot, movement_type, quantity, price, date, expiry_date=None):
+        if movement_type not in MOVEMENT_TYPES:
+            raise ValueError(f"Type de mouvement inconnu : {movement_type}")
+        if not product or not product.strip():
+            raise ValueError("Nom du produit manquant")
+        values = {
+            "product": product.strip(),
+            "depot": depot,
+            "movement_type": movement_type,
+            "quantity": int(quantity),
+            "price": float(price),
+            "date": self.backend.date(date),
+            # Seules les entrées ont une péremption (affectation FEFO, voir lot_utils)
+            "expiry_date": self.backend.date(expiry_date) if movement_type == "entry" else None,
+        }
+        with self.backend.begin() as conn:
+            row_id = conn.execute(text(f"""
+                INSERT INTO inventory_movements ({", ".join(values)})
+                VALUES ({", ".join(":" + c for c in values)})
+                RETURNING id
+            """), values).scalar()
+            movement_inserted(conn, values)
+            reopen_valuation(conn, values)
+            bump_table_version(conn, "inventory_movements")
+        return row_id
+
+    def movements(self, start=None, end=None):
+        """Mouvements d'inventaire, les plus récents d'abord."""
+        return self._dated_rows("inventory_movements", start, end)
+
+
+def get_repository(engine=None):
+    """Dépôt partagé par le processus pour `engine` (par défaut get_engine())."""
+    engine = engine or get_engine()
+    repository = _repositories.get(engine.url)
+    if repository is None:
+        with _lock:
+            repository = _repositories.setdefault(engine.url, Repository(engine))
+    return repository
+
+
+# --- Banc d'essai ---
+
+def _percentile(values, ratio):
+    values = sorted(values)
+    return values[min(int(len(values) * ratio), len(values) - 1)] if values else 0.0
+
+
+def bench(url, rows=20_000, writes=500):
+    """Mêmes opérations sur chaque backend ; retourne {mesure: valeur}."""
+    from cache_utils import clear_cache
+    from query_plans import seed_synthetic
+
+    engine = get_engine(url)
+    repository = get_repository(engine)
+    with repository.backend.begin() as conn:
+        seed_synthetic(conn, rows)
+    results = {"backend": repository.backend.dialect}
+
+    # Saisie à la caisse : une transaction par entrée
+    latencies = []
+    for i in range(writes):
+        start = time.perf_counter()
+        repository.add_cash(10 + i % 7, date_type(2026, 1, 1 + i % 28), "🕐 04–14")
+        latencies.append(time.perf_counter() - start)
+    results["add_cash p50 (ms)"] = _percentile(latencies, 0.5) * 1000
+    results["add_cash p99 (ms)"] = _percentile(latencies, 0.99) * 1000
+
+    # Livraison de 100 lignes
+    delivery = [
+        {"product": f"Produit {i}", "quantity": 1 + i % 5, "purchase_price": 1.5, "sale_price": 2.0,
+         "date": date_type(2026, 1, 15), "category": "🌾 Farine"}
+        for i in range(100)
+    ]
+    start = time.perf_counter()
+    repository.add_purchases(delivery)
+    results["add_purchases 100 lignes (ms)"] = (time.perf_counter() - start) * 1000
+
+    # Lectures sans cache : un mois, une recherche, une page d'historique
+    for label, call in (
+        ("purchases un mois (ms)", lambda: repository.purchases(date_type(2026, 1, 1), date_type(2026, 1, 31))),
+        ("purchases recherche (ms)", lambda: repository.purchases(search="farine")),
+        ("purchases page de 25 (ms)", lambda: repository.purchases(limit=25)),
+        ("cash un mois (ms)", lambda: repository.cash(date_type(2026, 1, 1), date_type(2026, 1, 31))),
+    ):
+        clear_cache()
+        start = time.perf_counter()
+        call()
+        results[label] = (time.perf_counter() - start) * 1000
+    return results
+
+
+def main(argv):
+    import os
+    import tempfile
+
+    argv = list(argv)
+    rows = 20_000
+    if "--rows" in argv:
+        i = argv.index("--rows")
+        rows = int(argv[i + 1])
+        del argv[i:i + 2]
+    if argv[:1] != ["bench"]:
+        print("Usage : python repository.py bench [url ...] [--rows 20000]")
+        return 2
+
+    tmpdir = None
+    urls = argv[1:]
+    if not urls:
+        tmpdir = tempfile.mkdtemp()
+        urls = [f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"]
+    try:
+        reports = [bench(url, rows) for url in urls]
+    finally:
+        if tmpdir:
+            from db_utils import dispose_engines
+            dispose_engines()
+            for name in os.listdir(tmpdir):
+                os.remove(os.path.join(tmpdir, name))
+            os.rmdir(tmpdir)
+
+    print(f"{'':32}" + "".join(f"{r['backend']:>14}" for r in reports))
+    for label in reports[0]:
+        if label != "backend":
+            print(f"{label:32}" + "".join(f"{r[label]:>14.2f}" for r in reports))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
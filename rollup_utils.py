@@ -0,0 +1,292 @@
+# rollup_utils.py
+# Tables de synthèse journalières tenues à jour à chaque écriture.
+# Usage : python rollup_utils.py [url] rebuild|verify
+
+import sys
+
+from sqlalchemy import text
+
+from cache_utils import bump_month_versions
+from db_utils import purchase_cost_sql
+
+# Mesures des achats : toutes les lignes, puis seulement celles qui ont
+# un prix d'achat ET un prix de vente (base du calcul de gain).
+PURCHASE_MEASURES = [
+    "lines", "quantity", "purchase_total", "sale_total",
+    "priced_lines", "priced_purchase_total", "priced_sale_total",
+]
+CASH_TABLES = {"caisse": "caisse", "credits": "credits", "expenses": "expenses"}
+
+# Écart toléré par verify() sur les montants (arrondis flottants)
+TOLERANCE = 0.005
+
+
+def create_tables(conn):
+    """Crée daily_purchases, daily_category_purchases, daily_supplier_purchases et daily_cash."""
+    money = "REAL" if conn.dialect.name == "sqlite" else "NUMERIC"
+    day = "TEXT" if conn.dialect.name == "sqlite" else "DATE"
+    measures = """
+            lines INTEGER NOT NULL DEFAULT 0,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            purchase_total {money} NOT NULL DEFAULT 0,
+            sale_total {money} NOT NULL DEFAULT 0,
+            priced_lines INTEGER NOT NULL DEFAULT 0,
+            priced_purchase_total {money} NOT NULL DEFAULT 0,
+            priced_sale_total {money} NOT NULL DEFAULT 0""".format(money=money)
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS daily_purchases (
+            date {day} PRIMARY KEY,{measures}
+        )
+    """))
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS daily_category_purchases (
+            date {day} NOT NULL,
+            category TEXT NOT NULL,{measures},
+            PRIMARY KEY (date, category)
+        )
+    """))
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS daily_supplier_purchases (
+            date {day} NOT NULL,
+            supplier TEXT NOT NULL,{measures},
+            PRIMARY KEY (date, supplier)
+        )
+    """))
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS daily_cash (
+            date {day} PRIMARY KEY,
+            caisse {money} NOT NULL DEFAULT 0,
+            credits {money} NOT NULL DEFAULT 0,
+            expenses {money} NOT NULL DEFAULT 0
+        )
+    """))
+
+
+def _day(value):
+    # date, datetime ou texte 'YYYY-MM-DD...' -> 'YYYY-MM-DD'
+    return str(value)[:10] if value is not None else None
+
+
+def _num(value):
+    return float(value) if value is not None else None
+
+
+# --- Mise à jour incrémentale ---
+
+def _purchase_delta(row, sign):
+    quantity = row.get("quantity") or 0
+    cost = _num(row.get("purchase_price"))
+    if cost is None:
+        cost = _num(row.get("price"))
+    sale = _num(row.get("sale_price"))
+    priced = cost is not None and sale is not None
+    return {
+        "lines": sign,
+        "quantity": sign * quantity,
+        "purchase_total": sign * quantity * cost if cost is not None else 0.0,
+        "sale_total": sign * quantity * sale if sale is not None else 0.0,
+        "priced_lines": sign if priced else 0,
+        "priced_purchase_total": sign * quantity * cost if priced else 0.0,
+        "priced_sale_total": sign * quantity * sale if priced else 0.0,
+    }
+
+
+def _upsert(conn, table, keys, values):
+    params = {**keys, **values}
+    columns = list(keys) + list(values)
+    updates = ", ".join(f"{c} = {table}.{c} + excluded.{c}" for c in values)
+    conn.execute(text(f"""
+        INSERT INTO {table} ({", ".join(columns)})
+        VALUES ({", ".join(":" + c for c in columns)})
+        ON CONFLICT ({", ".join(keys)}) DO UPDATE SET {updates}
+    """), params)
+
+
+def _apply_purchase(conn, row, sign):
+    day = _day(row.get("date"))
+    if day is None:
+        return
+    delta = _purchase_delta(row, sign)
+    category = row.get("category") or ""
+    supplier = row.get("supplier") or ""
+    _upsert(conn, "daily_purchases", {"date": day}, delta)
+    _upsert(conn, "daily_category_purchases", {"date": day, "category": category}, delta)
+    _upsert(conn, "daily_supplier_purchases", {"date": day, "supplier": supplier}, delta)
+    # Mois archivé touché (ancienne ou nouvelle ligne) : revérifié par snapshot_utils
+    bump_month_versions(conn, "purchases", [day])
+    if sign < 0:
+        # Les jours vidés par une suppression ne gardent pas de ligne à zéro
+        conn.execute(text("DELETE FROM daily_purchases WHERE date = :date AND lines <= 0"), {"date": day})
+        conn.execute(text(
+            "DELETE FROM daily_category_purchases WHERE date = :date AND category = :category AND lines <= 0"
+        ), {"date": day, "category": category})
+        conn.execute(text(
+            "DELETE FROM daily_supplier_purchases WHERE date = :date AND supplier = :supplier AND lines <= 0"
+        ), {"date": day, "supplier": supplier})
+
+
+def _fetch_purchase(conn, purchase_id):
+    row = conn.execute(text("SELECT * FROM purchases WHERE id = :id"), {"id": purchase_id}).mappings().first()
+    return dict(row) if row else None
+
+
+def purchase_inserted(conn, row):
+    """À appeler dans la transaction qui insère l'achat `row` (dict de colonnes)."""
+    _apply_purchase(conn, row, 1)
+
+
+def purchases_inserted(conn, rows):
+    """
+    Version groupée de purchase_inserted pour les imports en masse :
+    les deltas sont cumulés en mémoire puis appliqués une fois par jour/catégorie.
+    """
+    by_day, by_category, by_supplier = {}, {}, {}
+    for row in rows:
+        day = _day(row.get("date"))
+        if day is None:
+            continue
+        delta = _purchase_delta(row, 1)
+        keys = ((by_day, day), (by_category, (day, row.get("category") or "")),
+                (by_supplier, (day, row.get("supplier") or "")))
+        for totals, key in keys:
+            current = totals.setdefault(key, dict.fromkeys(PURCHASE_MEASURES, 0))
+            for measure, value in delta.items():
+                current[measure] += value
+    for day, delta in by_day.items():
+        _upsert(conn, "daily_purchases", {"date": day}, delta)
+    for (day, category), delta in by_category.items():
+        _upsert(conn, "daily_category_purchases", {"date": day, "category": category}, delta)
+    for (day, supplier), delta in by_supplier.items():
+        _upsert(conn, "daily_supplier_purchases", {"date": day, "supplier": supplier}, delta)
+    bump_month_versions(conn, "purchases", by_day)
+
+
+def purchase_deleted(conn, purchase_id):
+    """À appeler dans la transaction de suppression, AVANT le DELETE."""
+    old = _fetch_purchase(conn, purchase_id)
+    if old:
+        _apply_purchase(conn, old, -1)
+
+
+def purchase_updated(conn, purchase_id, new_row):
+    """À appeler dans la transaction de modification, AVANT l'UPDATE."""
+    old = _fetch_purchase(conn, purchase_id)
+    if old:
+        _apply_purchase(conn, old, -1)
+    _apply_purchase(conn, {**(old or {}), **new_row}, 1)
+
+
+def cash_inserted(conn, table, montant, date):
+    """À appeler dans la transaction qui insère dans caisse, credits ou expenses."""
+    column = CASH_TABLES[table]
+    if date is None:
+        return
+    _upsert(conn, "daily_cash", {"date": _day(date)}, {column: float(montant or 0)})
+    bump_month_versions(conn, table, [_day(date)])
+
+
+# --- Reconstruction / vérification ---
+
+def _purchase_select(conn, keys, group_by):
+    cost = purchase_cost_sql(conn)
+    priced = f"{cost} IS NOT NULL AND sale_price IS NOT NULL"
+    return f"""
+        SELECT {keys},
+               COUNT(*) AS lines,
+               COALESCE(SUM(quantity), 0) AS quantity,
+               COALESCE(SUM(quantity * {cost}), 0) AS purchase_total,
+               COALESCE(SUM(quantity * sale_price), 0) AS sale_total,
+               COALESCE(SUM(CASE WHEN {priced} THEN 1 ELSE 0 END), 0) AS priced_lines,
+               COALESCE(SUM(CASE WHEN {priced} THEN quantity * {cost} END), 0) AS priced_purchase_total,
+               COALESCE(SUM(CASE WHEN {priced} THEN quantity * sale_price END), 0) AS priced_sale_total
+        FROM purchases
+        WHERE date IS NOT NULL
+        GROUP BY {group_by}
+    """
+
+
+CASH_SELECT = """
+    SELECT date, SUM(caisse) AS caisse, SUM(credits) AS credits, SUM(expenses) AS expenses
+    FROM (
+        SELECT date, montant AS caisse, 0 AS credits, 0 AS expenses FROM caisse
+        UNION ALL SELECT date, 0, montant, 0 FROM credits
+        UNION ALL SELECT date, 0, 0, montant FROM expenses
+    ) AS flows
+    WHERE date IS NOT NULL
+    GROUP BY date
+"""
+
+
+def _sources(conn):
+    return {
+        "daily_purchases": (["date"], _purchase_select(conn, "date", "date")),
+        "daily_category_purchases": (["date", "category"], _purchase_select(
+            conn, "date, COALESCE(category, '') AS category", "date, COALESCE(category, '')"
+        )),
+        "daily_supplier_purchases": (["date", "supplier"], _purchase_select(
+            conn, "date, COALESCE(supplier, '') AS supplier", "date, COALESCE(supplier, '')"
+        )),
+        "daily_cash": (["date"], CASH_SELECT),
+    }
+
+
+def rebuild(conn):
+    """Recalcule entièrement les tables de synthèse à partir des tables brutes."""
+    measures = {
+        "daily_purchases": ["date"] + PURCHASE_MEASURES,
+        "daily_category_purchases": ["date", "category"] + PURCHASE_MEASURES,
+        "daily_supplier_purchases": ["date", "supplier"] + PURCHASE_MEASURES,
+        "daily_cash": ["date", "caisse", "credits", "expenses"],
+    }
+    for table, (_, select) in _sources(conn).items():
+        conn.execute(text(f"DELETE FROM {table}"))
+        conn.execute(text(f"INSERT INTO {table} ({', '.join(measures[table])}) {select}"))
+
+
+def verify(conn):
+    """
+    Compare les tables de synthèse avec un recalcul complet.
+    Retourne la liste des écarts [(table, clé, colonne, attendu, trouvé)].
+    """
+    mismatches = []
+    for table, (keys, select) in _sources(conn).items():
+        expected = {
+            tuple(_day(r[k]) if k == "date" else r[k] for k in keys): r
+            for r in conn.execute(text(select)).mappings()
+        }
+        actual = {
+            tuple(_day(r[k]) if k == "date" else r[k] for k in keys): r
+            for r in conn.execute(text(f"SELECT * FROM {table}")).mappings()
+        }
+        for key in expected.keys() | actual.keys():
+            exp, act = expected.get(key), actual.get(key)
+            columns = [c for c in (exp or act).keys() if c not in keys]
+            for column in columns:
+                e = float(exp[column]) if exp else 0.0
+                a = float(act[column]) if act else 0.0
+                if abs(e - a) > TOLERANCE:
+                    mismatches.append((table, key, column, e, a))
+    return mismatches
+
+
+def main(argv):
+    from db_utils import get_engine
+
+    args = [a for a in argv if a not in ("rebuild", "verify")]
+    url = args[0] if args else "sqlite:///supermarket.db"
+    engine = get_engine(url)
+
+    with engine.begin() as conn:
+        if "rebuild" in argv:
+            rebuild(conn)
+            print("✅ Tables de synthèse reconstruites.")
+        mismatches = verify(conn)
+
+    for table, key, column, expected, found in mismatches[:50]:
+        print(f"❌ {table} {key} {column} : attendu {expected:.2f}, trouvé {found:.2f}")
+    print(f"{len(mismatches)} écart(s).")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
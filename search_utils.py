@@ -0,0 +1,160 @@
+# search_utils.py
+# Recherche de produits par sous-chaîne, insensible à la casse et aux accents.
+#  - PostgreSQL : index trigramme (pg_trgm) sur unaccent(lower(product))
+#  - SQLite     : table FTS5 `purchases_search` (tokenizer trigram) sur le nom normalisé
+# Usage : python search_utils.py [url] rebuild
+
+import sys
+import unicodedata
+
+from sqlalchemy import text
+
+_available = {}
+
+
+def normalize(value):
+    """'Moulin d’Or ' -> "moulin d'or", 'Majesté' -> 'majeste'."""
+    if value is None:
+        return ""
+    value = unicodedata.normalize("NFKD", str(value))
+    value = "".join(c for c in value if not unicodedata.combining(c))
+    value = value.replace("’", "'").replace("`", "'")
+    return " ".join(value.lower().split())
+
+
+# --- Création de l'index ---
+
+def create_index(conn):
+    """Crée l'index de recherche adapté au moteur (appelé par les migrations)."""
+    if conn.dialect.name == "sqlite":
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS purchases_search USING fts5(product_norm, tokenize='trigram')"
+        ))
+        rebuild_index(conn)
+        return
+
+    # Les extensions demandent des droits : en cas d'échec on garde le LIKE simple
+    try:
+        with conn.begin_nested():
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS unaccent"))
+            # unaccent() n'est pas IMMUTABLE : il faut l'envelopper pour l'indexer
+            conn.execute(text("""
+                CREATE OR REPLACE FUNCTION immutable_unaccent(text) RETURNS text AS
+                $$ SELECT public.unaccent('public.unaccent', $1) $$
+                LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_purchases_product_trgm
+                ON purchases USING gin (immutable_unaccent(lower(product)) gin_trgm_ops)
+            """))
+    except Exception as e:
+        print(f"⚠️ Index trigramme indisponible, recherche par LIKE simple : {e}")
+
+
+def rebuild_index(conn, batch_size=5000):
+    """Recharge entièrement la table FTS5 (SQLite uniquement)."""
+    if conn.dialect.name != "sqlite":
+        return
+    conn.execute(text("DELETE FROM purchases_search"))
+    rows = conn.execute(text("SELECT id, product FROM purchases")).fetchall()
+    for start in range(0, len(rows), batch_size):
+        conn.execute(text("INSERT INTO purchases_search (rowid, product_norm) VALUES (:id, :norm)"), [
+            {"id": purchase_id, "norm": normalize(product)}
+            for purchase_id, product in rows[start:start + batch_size]
+        ])
+
+
+# --- Maintenance à chaque écriture (SQLite ; rien à faire sous PostgreSQL) ---
+
+def index_purchase(conn, purchase_id, product):
+    """À appeler dans la transaction qui insère ou modifie l'achat."""
+    if conn.dialect.name == "sqlite":
+        conn.execute(text("DELETE FROM purchases_search WHERE rowid = :id"), {"id": purchase_id})
+        conn.execute(
+            text("INSERT INTO purchases_search (rowid, product_norm) VALUES (:id, :norm)"),
+            {"id": purchase_id, "norm": normalize(product)},
+        )
+
+
+def index_purchases_after(conn, last_id, batch_size=5000):
+    """Indexe en une fois les achats d'id > last_id (imports en masse)."""
+    if conn.dialect.name != "sqlite":
+        return
+    # Une insertion concurrente a pu déjà indexer certains de ces ids
+    conn.execute(text("DELETE FROM purchases_search WHERE rowid > :id"), {"id": last_id})
+    rows = conn.execute(text("SELECT id, product FROM purchases WHERE id > :id"), {"id": last_id}).fetchall()
+    for start in range(0, len(rows), batch_size):
+        conn.execute(text("INSERT INTO purchases_search (rowid, product_norm) VALUES (:id, :norm)"), [
+            {"id": purchase_id, "norm": normalize(product)}
+            for purchase_id, product in rows[start:start + batch_size]
+        ])
+
+
+def unindex_purchase(conn, purchase_id):
+    """À appeler dans la transaction qui supprime l'achat."""
+    if conn.dialect.name == "sqlite":
+        conn.execute(text("DELETE FROM purchases_search WHERE rowid = :id"), {"id": purchase_id})
+
+
+# --- Recherche ---
+
+def _has_trigram_index(conn):
+    key = conn.engine.url
+    if key not in _available:
+        _available[key] = conn.execute(text(
+            "SELECT 1 FROM pg_indexes WHERE indexname = 'idx_purchases_product_trgm'"
+        )).first() is not None
+    return _available[key]
+
+
+def _like_pattern(needle):
+    """Motif '%needle%' avec % et _ de la saisie échappés (ESCAPE '\\')."""
+    escaped = needle.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%", escaped != needle
+
+
+def search_condition(conn, term, alias=""):
+    """
+    Retourne (fragment SQL, paramètres) à ajouter au WHERE d'une requête
+    sur `purchases` pour ne garder que les produits contenant `term`.
+    """
+    prefix = f"{alias}." if alias else ""
+    if conn.dialect.name == "sqlite":
+        # Le tokenizer trigram accélère LIKE '%...%' dès 3 caractères, mais
+        # pas avec ESCAPE : la clause n'est ajoutée que si la saisie en a besoin
+        pattern, escaped = _like_pattern(normalize(term))
+        escape = " ESCAPE '\\'" if escaped else ""
+        return (
+            f"{prefix}id IN (SELECT rowid FROM purchases_search WHERE product_norm LIKE :search_pattern{escape})",
+            {"search_pattern": pattern},
+        )
+
+    if _has_trigram_index(conn):
+        pattern, _ = _like_pattern(normalize(term))
+        return (
+            f"immutable_unaccent(lower({prefix}product)) LIKE :search_pattern ESCAPE '\\'",
+            {"search_pattern": pattern},
+        )
+    # Sans unaccent, les deux côtés gardent leurs accents : seule la casse est ignorée
+    pattern, _ = _like_pattern(" ".join(str(term).lower().split()))
+    return f"LOWER({prefix}product) LIKE :search_pattern ESCAPE '\\'", {"search_pattern": pattern}
+
+
+def main(argv):
+    from db_utils import get_engine
+
+    args = [a for a in argv if a != "rebuild"]
+    engine = get_engine(args[0] if args else "sqlite:///supermarket.db")
+    with engine.begin() as conn:
+        if conn.dialect.name == "sqlite":
+            rebuild_index(conn)
+            count = conn.execute(text("SELECT COUNT(*) FROM purchases_search")).scalar()
+            print(f"✅ Index de recherche reconstruit ({count} produits).")
+        else:
+            conn.execute(text("REINDEX INDEX idx_purchases_product_trgm"))
+            print("✅ Index trigramme reconstruit.")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
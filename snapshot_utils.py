@@ -0,0 +1,434 @@
+# snapshot_utils.py
+# Archives Parquet des mois clos : un fichier par table et par mois
+# (snapshots/<table>/month=AAAA-MM/data.parquet), relu en colonnes,
+# avec projection en mémoire (mmap) et filtre sur la date.
+# read_table() fusionne ces archives avec les lignes vivantes du mois en cours.
+# Usage : python snapshot_utils.py [url] [--dir snapshots] [status|bench]
+#         python snapshot_utils.py check
+# pyarrow est optionnel : sans lui, read_table() lit tout en SQL.
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pandas as pd
+from sqlalchemy import text
+
+from cache_utils import month_versions, read_sql
+
+SNAPSHOT_DIR = os.environ.get(
+    "SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshots")
+)
+ROW_GROUP_SIZE = 50_000
+
+# Tables archivées. L'empreinte d'un mois couvre toutes les colonnes de
+# chaque ligne : si elle change (ligne modifiée après clôture), le mois est réécrit.
+SNAPSHOT_TABLES = ("purchases", "caisse", "credits", "expenses", "inventory_movements")
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    from pyarrow import fs
+except ImportError:
+    pa = None
+
+
+# --- Mois ---
+
+def _as_date(value):
+    return pd.Timestamp(value).date() if value is not None else None
+
+
+def _month(day):
+    return f"{day.year:04d}-{day.month:02d}"
+
+
+def _next_month(month):
+    year, number = map(int, month.split("-"))
+    return f"{year + number // 12:04d}-{number % 12 + 1:02d}"
+
+
+def _month_start(month):
+    return date.fromisoformat(f"{month}-01")
+
+
+# --- Manifeste ---
+
+def _manifest_path(root):
+    return os.path.join(root, "manifest.json")
+
+
+def load_manifest(root=SNAPSHOT_DIR):
+    """{"url", "tables": {table: {"through": mois, "months": {mois: {...}}, "versions": {mois: version}}}}"""
+    try:
+        with open(_manifest_path(root), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"url": None, "tables": {}}
+
+
+def _save_manifest(manifest, root):
+    tmp = _manifest_path(root) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, _manifest_path(root))
+
+
+def _url(engine):
+    return engine.url.render_as_string(hide_password=True)
+
+
+def _table_info(engine, table, root):
+    manifest = load_manifest(root)
+    # Des archives d'une autre base ne sont jamais mélangées aux lignes vivantes
+    if manifest["url"] != _url(engine):
+        return None
+    return manifest["tables"].get(table)
+
+
+# --- Écriture ---
+
+def _month_sql(conn):
+    return "substr(date, 1, 7)" if conn.dialect.name == "sqlite" else "to_char(date, 'YYYY-MM')"
+
+
+def _row_hash(*values):
+    # 32 bits : la somme d'un mois tient dans un entier SQLite (64 bits)
+    return int.from_bytes(hashlib.blake2b(repr(values).encode(), digest_size=4).digest(), "big")
+
+
+def _hash_sql(conn, table):
+    """Expression SQL : hachage 32 bits de toutes les colonnes d'une ligne."""
+    columns = ", ".join(f'"{c}"' for c in conn.execute(text(f"SELECT * FROM {table} LIMIT 0")).keys())
+    if conn.dialect.name == "sqlite":
+        conn.connection.driver_connection.create_function("row_hash", -1, _row_hash, deterministic=True)
+        return f"row_hash({columns})"
+    return f"('x' || substr(md5(CAST(ROW({columns}) AS TEXT)), 1, 8))::bit(32)::bigint"
+
+
+def _fingerprints(conn, table, before, after=None):
+    # Somme des hachages de lignes : toute modification d'une colonne, y
+    # compris la date dans le mois, change l'empreinte
+    rows = conn.execute(text(f"""
+        SELECT {_month_sql(conn)} AS month, COUNT(*), COALESCE(SUM(id), 0), COALESCE(SUM({_hash_sql(conn, table)}), 0)
+        FROM {table}
+        WHERE date < :before {"AND date >= :after" if after else ""}
+        GROUP BY {_month_sql(conn)}
+    """), {"before": before, "after": after}).fetchall()
+    return {month: [count, int(ids), int(total)] for month, count, ids, total in rows if month}
+
+
+def _month_versions(conn, table):
+    # Lues en base (pas en cache) avant les empreintes : une écriture
+    # concurrente laisse son mois à revérifier par les lecteurs
+    rows = conn.execute(text("SELECT table_name, version FROM table_versions WHERE table_name LIKE :prefix"),
+                        {"prefix": f"{table}@%"})
+    return {name.split("@", 1)[1]: version for name, version in rows if name.startswith(f"{table}@")}
+
+
+def _partition_dir(root, table, month):
+    return os.path.join(root, table, f"month={month}")
+
+
+def _to_arrow(frame):
+    frame["date"] = pd.to_datetime(frame["date"]).dt.date
+    for column in frame.columns:
+        # NUMERIC (PostgreSQL) -> float64, comme les REAL de SQLite
+        if frame[column].dtype == object and frame[column].map(lambda v: isinstance(v, Decimal)).any():
+            frame[column] = pd.to_numeric(frame[column])
+    return pa.Table.from_pandas(frame, preserve_index=False)
+
+
+def _write_month(conn, table, month, root):
+    frame = pd.read_sql(text(f"""
+        SELECT * FROM {table} WHERE date >= :start AND date < :end ORDER BY date, id
+    """), conn, params={"start": _month_start(month), "end": _month_start(_next_month(month))})
+    directory = _partition_dir(root, table, month)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "data.parquet")
+    # Écriture dans un fichier temporaire puis renommage : un lecteur ne voit jamais un fichier partiel
+    pq.write_table(_to_arrow(frame), path + ".tmp", compression="zstd", row_group_size=ROW_GROUP_SIZE)
+    os.replace(path + ".tmp", path)
+    return len(frame)
+
+
+def snapshot(engine, tables=None, root=SNAPSHOT_DIR, today=None):
+    """
+    Archive tous les mois clos (antérieurs au mois de `today`) des tables
+    demandées. Seuls les mois nouveaux ou modifiés depuis la dernière
+    archive sont réécrits. Retourne [(table, mois, lignes)] écrits.
+    """
+    if pa is None:
+        raise RuntimeError("pyarrow n'est pas installé : pip install pyarrow")
+    current = _month(today or date.today())
+    manifest = load_manifest(root)
+    if manifest["url"] != _url(engine):
+        manifest = {"url": _url(engine), "tables": {}}
+        for table in SNAPSHOT_TABLES:
+            shutil.rmtree(os.path.join(root, table), ignore_errors=True)
+    os.makedirs(root, exist_ok=True)
+
+    written = []
+    with engine.connect() as conn:
+        for table in tables or SNAPSHOT_TABLES:
+            info = manifest["tables"].setdefault(table, {"through": None, "months": {}})
+            versions = _month_versions(conn, table)
+            fingerprints = _fingerprints(conn, table, _month_start(current))
+            for month, fingerprint in sorted(fingerprints.items()):
+                if info["months"].get(month, {}).get("fingerprint") != fingerprint:
+                    rows = _write_month(conn, table, month, root)
+                    info["months"][month] = {"fingerprint": fingerprint, "rows": rows}
+                    written.append((table, month, rows))
+            # Mois entièrement vidés depuis la dernière archive
+            for month in set(info["months"]) - set(fingerprints):
+                shutil.rmtree(_partition_dir(root, table, month), ignore_errors=True)
+                del info["months"][month]
+                written.append((table, month, 0))
+            # Tous les mois jusqu'à `through` sont couverts par les archives
+            year, number = map(int, current.split("-"))
+            info["through"] = f"{year - (number == 1):04d}-{(number - 2) % 12 + 1:02d}"
+            info["versions"] = {m: v for m, v in versions.items() if m <= info["through"]}
+            _save_manifest(manifest, root)
+    return written
+
+
+def stale_months(engine, table, root=SNAPSHOT_DIR):
+    """Mois archivés dont les lignes ont changé en base depuis l'archive."""
+    info = _table_info(engine, table, root)
+    if not info or not info["through"]:
+        return []
+    with engine.connect() as conn:
+        fingerprints = _fingerprints(conn, table, _month_start(_next_month(info["through"])))
+    months = set(fingerprints) | set(info["months"])
+    return sorted(m for m in months if info["months"].get(m, {}).get("fingerprint") != fingerprints.get(m))
+
+
+# --- Lecture ---
+
+_verified = {}
+
+
+def _dirty_months(engine, table, info, first_month):
+    """Mois archivés (>= first_month) écrits depuis l'archive, d'après leur version (cache_utils)."""
+    archived = info.get("versions", {})
+    return {
+        month: version for month, version in month_versions(engine, table).items()
+        if month <= info["through"] and (first_month is None or month >= first_month)
+        and version != archived.get(month, 0)
+    }
+
+
+def _stale_since(engine, table, info, first_month):
+    """
+    Mois archivés (>= first_month) modifiés en base depuis l'archive. Seuls
+    les mois écrits depuis (_dirty_months) sont revérifiés par empreinte,
+    une fois par version du mois : une écriture ne fait relire que son mois.
+    """
+    stale = set()
+    for month, version in _dirty_months(engine, table, info, first_month).items():
+        archived = info["months"].get(month, {}).get("fingerprint")
+        key = (_url(engine), table, month, version, json.dumps(archived))
+        if key not in _verified:
+            with engine.connect() as conn:
+                fingerprint = _fingerprints(
+                    conn, table, _month_start(_next_month(month)), _month_start(month)
+                ).get(month)
+            if len(_verified) > 4096:
+                _verified.clear()
+            _verified[key] = fingerprint != archived
+        if _verified[key]:
+            stale.add(month)
+    return stale
+
+
+def _read_archive(table, start, end, columns, root, skip=()):
+    if not os.path.isdir(os.path.join(root, table)):
+        return None
+    paths = [
+        os.path.join(root, table, name, "data.parquet")
+        for name in sorted(os.listdir(os.path.join(root, table)))
+        if name.startswith("month=") and name[6:] not in skip
+        and (start is None or name[6:] >= _month(start))
+        and (end is None or name[6:] <= _month(end))
+    ]
+    if not paths:
+        return None
+    # Les mois peuvent différer (colonne vide -> type null) : schéma unifié
+    schema = pa.unify_schemas([pq.read_schema(p) for p in paths], promote_options="permissive")
+    dataset = ds.dataset(paths, schema=schema, format="parquet", filesystem=fs.LocalFileSystem(use_mmap=True))
+    # Filtre poussé jusqu'aux statistiques min/max des groupes de lignes
+    condition = None
+    if start is not None:
+        condition = ds.field("date") >= pa.scalar(start, pa.date32())
+    if end is not None:
+        upper = ds.field("date") <= pa.scalar(end, pa.date32())
+        condition = upper if condition is None else condition & upper
+    return dataset.to_table(columns=columns, filter=condition).to_pandas(date_as_object=False)
+
+
+def _read_live(engine, table, start, end, columns):
+    query = f"SELECT {', '.join(columns) if columns else '*'} FROM {table} WHERE 1=1"
+    params = {}
+    if start is not None:
+        query += " AND date >= :start"
+        params["start"] = start.isoformat()
+    if end is not None:
+        query += " AND date <= :end"
+        params["end"] = end.isoformat()
+    return read_sql(engine, query + " ORDER BY date", params, tables=(table,))
+
+
+def read_table(engine, table, start=None, end=None, columns=None, root=SNAPSHOT_DIR):
+    """
+    Lignes de `table` dont la date est comprise entre start et end (inclus) :
+    mois archivés lus en Parquet, mois ouverts (ou modifiés depuis leur
+    archive) lus en base. La colonne date est renvoyée en datetime64.
+    """
+    start, end = _as_date(start), _as_date(end)
+    info = _table_info(engine, table, root) if pa is not None else None
+    live_from = _month_start(_next_month(info["through"])) if info and info["through"] else None
+
+    frames = []
+    if live_from and (start is None or start < live_from):
+        archive_end = live_from - timedelta(days=1) if end is None or end >= live_from else end
+        stale = _stale_since(engine, table, info, _month(start) if start else None)
+        archived = _read_archive(table, start, archive_end, columns, root, skip=stale)
+        if archived is not None:
+            frames.append(archived)
+        for month in sorted(m for m in stale if m <= _month(archive_end)):
+            month_end = _month_start(_next_month(month)) - timedelta(days=1)
+            frames.append(_read_live(
+                engine, table, max(start, _month_start(month)) if start else _month_start(month),
+                min(archive_end, month_end), columns,
+            ))
+    if live_from is None or end is None or end >= live_from:
+        live_start = max(start, live_from) if start and live_from else (start or live_from)
+        frames.append(_read_live(engine, table, live_start, end, columns))
+
+    # Plage entièrement archivée mais sans aucun mois en archive : lecture SQL (vide, avec les colonnes)
+    frames = [f for f in frames if not f.empty] or frames[-1:] or [_read_live(engine, table, start, end, columns)]
+    frame = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    if "date" in frame.columns:
+        frame["date"] = pd.to_datetime(frame["date"]).astype("datetime64[ns]")
+        frame = frame.sort_values("date", kind="stable", ignore_index=True)
+    return frame
+
+
+# --- Contrôle ---
+
+def check():
+    """
+    Sur une base SQLite temporaire dont seul 2025-03 est archivé : compare
+    read_table à une lecture SQL sur des plages archivées (vides ou non),
+    à cheval sur le mois ouvert et ouvertes.
+    """
+    import tempfile
+
+    from db_utils import dispose_engines, get_engine
+    from repository import get_repository
+
+    if pa is None:
+        print("❌ pyarrow n'est pas installé : pip install pyarrow")
+        return 1
+    tmpdir = tempfile.mkdtemp()
+    root = os.path.join(tmpdir, "snapshots")
+    failures = 0
+    try:
+        engine = get_engine(f"sqlite:///{os.path.join(tmpdir, 'snapshot.db')}")
+        get_repository(engine).add_purchases([{
+            "product": f"Produit {i}", "quantity": 1 + i % 5, "purchase_price": 2.0, "sale_price": 3.0,
+            "date": date(2025, 3, 1) + timedelta(days=i % 45),
+        } for i in range(500)])
+        snapshot(engine, ("purchases",), root, today=date(2025, 4, 15))
+
+        # Écritures après l'archive : seul le mois clos touché est revérifié
+        repository = get_repository(engine)
+        repository.add_purchase("Produit avril", 1, 2.0, 3.0, date(2025, 4, 20))
+        info = _table_info(engine, "purchases", root)
+        dirty = set(_dirty_months(engine, "purchases", info, None))
+        failures += bool(dirty)
+        print(f"{'✅' if not dirty else '❌'} achat du mois ouvert : mois archivés à revérifier {sorted(dirty)}")
+        march = repository.purchases("2025-03-05", "2025-03-05")["id"].iloc[0]
+        repository.update_purchase(int(march), product="Produit mars")
+        dirty = set(_dirty_months(engine, "purchases", info, None))
+        failures += dirty != {"2025-03"}
+        print(f"{'✅' if dirty == {'2025-03'} else '❌'} achat de mars modifié : mois archivés à revérifier {sorted(dirty)}")
+        merged = read_table(engine, "purchases", "2025-03-01", "2025-03-31", root=root)
+        product = merged.loc[merged["id"] == march, "product"].iloc[0]
+        failures += product != "Produit mars"
+        print(f"{'✅' if product == 'Produit mars' else '❌'} mars relu en base : {product!r}")
+
+        ranges = [
+            ("2025-01-01", "2025-01-31"), ("2025-01-01", "2025-03-31"), ("2025-03-10", "2025-04-10"),
+            ("2025-04-01", "2025-04-30"), ("2025-05-01", "2025-05-31"), (None, None),
+        ]
+        for start, end in ranges:
+            for columns in (None, ["id", "date", "quantity"]):
+                merged = read_table(engine, "purchases", start, end, columns, root)
+                with engine.connect() as conn:
+                    reference = pd.read_sql(text(f"""
+                        SELECT {", ".join(columns) if columns else "*"} FROM purchases
+                        WHERE date >= :start AND date <= :end ORDER BY date, id
+                    """), conn, params={"start": start or "0001-01-01", "end": end or "9999-12-31"})
+                ok = list(merged.columns) == list(reference.columns) and sorted(merged["id"]) == sorted(reference["id"])
+                failures += not ok
+                print(f"{'✅' if ok else '❌'} {start} → {end} {columns or '*'} : "
+                      f"{len(merged)} lignes (attendu {len(reference)})")
+        print(f"{failures} écart(s).")
+        return 1 if failures else 0
+    finally:
+        dispose_engines()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def main(argv):
+    from db_utils import get_engine
+
+    argv = list(argv)
+    if argv[:1] == ["check"]:
+        return check()
+    root = SNAPSHOT_DIR
+    if "--dir" in argv:
+        i = argv.index("--dir")
+        root = argv[i + 1]
+        del argv[i:i + 2]
+    verbs = [a for a in argv if a in ("status", "bench")]
+    args = [a for a in argv if a not in verbs]
+    engine = get_engine(args[0] if args else "sqlite:///supermarket.db")
+
+    if "status" in verbs:
+        manifest = load_manifest(root)
+        for table, info in manifest["tables"].items():
+            rows = sum(m["rows"] for m in info["months"].values())
+            stale = stale_months(engine, table, root)
+            print(f"{table}: {len(info['months'])} mois archivés jusqu'à {info['through']}, {rows} lignes"
+                  + (f", à rafraîchir : {', '.join(stale)}" if stale else ""))
+        return 0
+
+    started = time.perf_counter()
+    written = snapshot(engine, root=root)
+    for table, month, rows in written:
+        print(f"✅ {table} {month} : {rows} lignes")
+    print(f"{len(written)} mois (ré)écrits en {time.perf_counter() - started:.2f} s.")
+
+    if "bench" in verbs:
+        with engine.connect() as conn:
+            started = time.perf_counter()
+            reference = pd.read_sql(text("SELECT * FROM purchases"), conn)
+            sql_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        merged = read_table(engine, "purchases", root=root)
+        snap_seconds = time.perf_counter() - started
+        print(f"ℹ️ purchases : pd.read_sql {len(reference)} lignes en {sql_seconds:.2f} s, "
+              f"read_table {len(merged)} lignes en {snap_seconds:.2f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,355 @@
+# stock_utils.py
+# Stock par (dépôt, produit) tenu à jour à chaque mouvement d'inventaire :
+#  - stock_levels      : stock courant, mis à jour dans la transaction du mouvement
+#  - stock_checkpoints : stock en fin de mois, pour le stock à une date donnée
+#    (dernier point de contrôle + mouvements depuis, sur l'index des dates)
+# La réconciliation (à planifier, par exemple chaque nuit) compare les deux
+# tables au journal des mouvements, corrige les écarts et ajoute les fins de
+# mois manquantes.
+# Usage : python stock_utils.py [url] reconcile|verify|at AAAA-MM-JJ
+#         python stock_utils.py bench [--rows 200000]
+
+import sys
+import time
+from datetime import date as date_type, timedelta
+
+from sqlalchemy import text
+
+from cache_utils import bump_month_versions, bump_table_version, read_sql
+
+SIGNED_QUANTITY = (
+    "CASE movement_type WHEN 'entry' THEN COALESCE(quantity, 0) "
+    "WHEN 'exit' THEN -COALESCE(quantity, 0) ELSE 0 END"
+)
+LEVELS_SELECT = f"""
+    SELECT COALESCE(depot, '') AS depot, COALESCE(product, '') AS product, SUM({SIGNED_QUANTITY}) AS quantity
+    FROM inventory_movements
+    GROUP BY COALESCE(depot, ''), COALESCE(product, '')
+"""
+DAILY_DELTAS = f"""
+    SELECT date, COALESCE(depot, '') AS depot, COALESCE(product, '') AS product, SUM({SIGNED_QUANTITY}) AS quantity
+    FROM inventory_movements
+    WHERE date IS NOT NULL
+    GROUP BY date, COALESCE(depot, ''), COALESCE(product, '')
+    ORDER BY date
+"""
+
+
+def create_tables(conn):
+    """Crée stock_levels et stock_checkpoints."""
+    day = "TEXT" if conn.dialect.name == "sqlite" else "DATE"
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS stock_levels (
+            depot TEXT NOT NULL,
+            product TEXT NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (depot, product)
+        )
+    """))
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS stock_checkpoints (
+            checkpoint_date {day} NOT NULL,
+            depot TEXT NOT NULL,
+            product TEXT NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (checkpoint_date, depot, product)
+        )
+    """))
+
+
+def _day(value):
+    # date, datetime ou texte 'YYYY-MM-DD...' -> 'YYYY-MM-DD'
+    return str(value)[:10] if value is not None else None
+
+
+# --- Mise à jour incrémentale ---
+
+def movement_inserted(conn, row):
+    """À appeler dans la transaction qui insère le mouvement `row` (dict de colonnes)."""
+    quantity = row.get("quantity") or 0
+    delta = {"entry": quantity, "exit": -quantity}.get(row.get("movement_type"), 0)
+    params = {"depot": row.get("depot") or "", "product": row.get("product") or "", "delta": delta}
+    conn.execute(text("""
+        INSERT INTO stock_levels (depot, product, quantity) VALUES (:depot, :product, :delta)
+        ON CONFLICT (depot, product) DO UPDATE SET quantity = stock_levels.quantity + excluded.quantity
+    """), params)
+    day = _day(row.get("date"))
+    if day is None:
+        return
+    bump_month_versions(conn, "inventory_movements", [day])
+    # Mouvement antidaté : les fins de mois déjà figées après lui sont corrigées
+    conn.execute(text("""
+        INSERT INTO stock_checkpoints (checkpoint_date, depot, product, quantity)
+        SELECT c.checkpoint_date, :depot, :product, :delta
+        FROM (SELECT DISTINCT checkpoint_date FROM stock_checkpoints WHERE checkpoint_date >= :date) AS c
+        WHERE 1 = 1
+        ON CONFLICT (checkpoint_date, depot, product)
+        DO UPDATE SET quantity = stock_checkpoints.quantity + excluded.quantity
+    """), {**params, "date": day})
+
+
+# --- Recalcul et réconciliation ---
+
+def _month_ends(first, today):
+    """Derniers jours des mois de `first` jusqu'au mois précédant `today`."""
+    ends = []
+    month = date_type.fromisoformat(first[:7] + "-01")
+    while True:
+        following = (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+        end = following - timedelta(days=1)
+        if end >= today.replace(day=1):
+            return ends
+        ends.append(end.isoformat())
+        month = following
+
+
+def _expected(conn, today):
+    """
+    Stock recalculé depuis le journal : (stock courant, {fin de mois: stock}).
+    Un seul passage sur les mouvements agrégés par jour.
+    """
+    levels = {
+        (r.depot, r.product): int(r.quantity or 0)
+        for r in conn.execute(text(LEVELS_SELECT))
+    }
+    first = conn.execute(text("SELECT MIN(date) FROM inventory_movements")).scalar()
+    dates = _month_ends(_day(first), today) if first is not None else []
+
+    snapshots, running, i = {}, {}, 0
+    for day, depot, product, quantity in conn.execute(text(DAILY_DELTAS)):
+        day = _day(day)
+        while i < len(dates) and dates[i] < day:
+            snapshots[dates[i]] = dict(running)
+            i += 1
+        running[(depot, product)] = running.get((depot, product), 0) + int(quantity or 0)
+    for checkpoint in dates[i:]:
+        snapshots[checkpoint] = dict(running)
+    return levels, snapshots
+
+
+def _found(conn):
+    levels = {(r.depot, r.product): r.quantity for r in conn.execute(text("SELECT * FROM stock_levels"))}
+    snapshots = {}
+    for r in conn.execute(text("SELECT * FROM stock_checkpoints")):
+        snapshots.setdefault(_day(r.checkpoint_date), {})[(r.depot, r.product)] = r.quantity
+    return levels, snapshots
+
+
+def _differences(conn, today):
+    """Écarts [(table, date ou None, dépôt, produit, attendu, trouvé)] ; None = ligne absente."""
+    expected_levels, expected_snapshots = _expected(conn, today)
+    found_levels, found_snapshots = _found(conn)
+    differences = []
+    for key in expected_levels.keys() | found_levels.keys():
+        expected, found = expected_levels.get(key), found_levels.get(key)
+        if expected != found:
+            differences.append(("stock_levels", None, *key, expected, found))
+    for checkpoint in expected_snapshots.keys() | found_snapshots.keys():
+        expected_rows = expected_snapshots.get(checkpoint, {})
+        found_rows = found_snapshots.get(checkpoint, {})
+        for key in expected_rows.keys() | found_rows.keys():
+            expected, found = expected_rows.get(key), found_rows.get(key)
+            if expected != found:
+                differences.append(("stock_checkpoints", checkpoint, *key, expected, found))
+    return differences
+
+
+def _fix(conn, differences):
+    for table in ("stock_levels", "stock_checkpoints"):
+        rows = [d for d in differences if d[0] == table]
+        where = "depot = :depot AND product = :product"
+        columns = ["depot", "product", "quantity"]
+        if table == "stock_checkpoints":
+            where += " AND checkpoint_date = :checkpoint_date"
+            columns.insert(0, "checkpoint_date")
+        stale = [
+            {"checkpoint_date": checkpoint, "depot": depot, "product": product}
+            for _, checkpoint, depot, product, _, found in rows if found is not None
+        ]
+        missing = [
+            {"checkpoint_date": checkpoint, "depot": depot, "product": product, "quantity": expected}
+            for _, checkpoint, depot, product, expected, _ in rows if expected is not None
+        ]
+        if stale:
+            conn.execute(text(f"DELETE FROM {table} WHERE {where}"), stale)
+        if missing:
+            conn.execute(text(f"""
+                INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join(":" + c for c in columns)})
+            """), missing)
+
+
+def rebuild(conn, today=None):
+    """Recalcule entièrement stock_levels et les fins de mois depuis inventory_movements."""
+    conn.execute(text("DELETE FROM stock_levels"))
+    conn.execute(text("DELETE FROM stock_checkpoints"))
+    _fix(conn, _differences(conn, today or date_type.today()))
+
+
+def verify(conn, today=None):
+    """Écarts entre les tables de stock et le journal des mouvements (voir _differences)."""
+    return _differences(conn, today or date_type.today())
+
+
+def reconcile(engine, today=None):
+    """
+    Tâche périodique : corrige les écarts et crée les fins de mois manquantes
+    dans une transaction d'écriture. Retourne la liste des écarts corrigés.
+    """
+    from db_utils import begin_write
+
+    with begin_write(engine) as conn:
+        differences = _differences(conn, today or date_type.today())
+        if differences:
+            _fix(conn, differences)
+            bump_table_version(conn, "inventory_movements")
+    return differences
+
+
+# --- Lectures ---
+
+def current_stock(engine, depot=None, product=None):
+    """Stock courant par (dépôt, produit), lu dans stock_levels (une ligne par clé)."""
+    query = "SELECT depot, product, quantity FROM stock_levels WHERE 1=1"
+    params = {}
+    if depot is not None:
+        query += " AND depot = :depot"
+        params["depot"] = depot
+    if product is not None:
+        query += " AND product = :product"
+        params["product"] = product
+    return read_sql(engine, query + " ORDER BY depot, product", params, tables=("inventory_movements",))
+
+
+def stock_at(engine, day, depot=None, product=None):
+    """
+    Stock en fin de journée `day` : dernière fin de mois figée avant `day`
+    plus les mouvements depuis (moins d'un mois à relire).
+    """
+    query, params = stock_at_query(day, depot, product)
+    return read_sql(engine, query, params, tables=("inventory_movements",))
+
+
+def stock_at_query(day, depot=None, product=None):
+    """(requête, paramètres) de stock_at ; aussi contrôlée par query_plans."""
+    filters, params = "", {"day": _day(day)}
+    if depot is not None:
+        filters += " AND COALESCE(depot, '') = :depot"
+        params["depot"] = depot
+    if product is not None:
+        filters += " AND COALESCE(product, '') = :product"
+        params["product"] = product
+    # Fin de mois liée par une CTE d'une ligne : les mouvements sont lus sur
+    # une plage bornée des deux côtés de l'index (checkpoint_date, day]
+    query = f"""
+        WITH c AS (
+            SELECT COALESCE(MAX(checkpoint_date), '0001-01-01') AS checkpoint_date
+            FROM stock_checkpoints WHERE checkpoint_date <= :day
+        )
+        SELECT depot, product, SUM(quantity) AS quantity FROM (
+            SELECT s.depot, s.product, s.quantity
+            FROM stock_checkpoints s JOIN c ON s.checkpoint_date = c.checkpoint_date
+            WHERE 1 = 1{filters}
+            UNION ALL
+            SELECT COALESCE(depot, '') AS depot, COALESCE(product, '') AS product, {SIGNED_QUANTITY} AS quantity
+            FROM inventory_movements m JOIN c ON m.date > c.checkpoint_date
+            WHERE m.date <= :day{filters}
+        ) AS stock
+        GROUP BY depot, product
+        ORDER BY depot, product
+    """
+    return query, params
+
+
+# --- Banc d'essai ---
+
+def bench(rows=200_000):
+    """Compare lectures par table de stock et recalcul complet sur une base SQLite temporaire."""
+    import os
+    import tempfile
+
+    from cache_utils import clear_cache
+    from db_utils import begin_write, dispose_engines, get_engine
+    from query_plans import seed_synthetic
+    from repository import get_repository
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        engine = get_engine(f"sqlite:///{os.path.join(tmpdir, 'stock.db')}")
+        with begin_write(engine) as conn:
+            seed_synthetic(conn, rows)
+            rebuild(conn)
+        repository = get_repository(engine)
+        for i in range(200):
+            # Mouvements saisis par la page, dont certains antidatés
+            repository.add_movement(f"Produit {i % 50}", "Dépôt 1", ("entry", "exit")[i % 2], 1 + i % 9, 2.0,
+                                    date_type(2023, 1 + i % 12, 1 + i % 28))
+        with engine.connect() as conn:
+            movements = conn.execute(text("SELECT COUNT(*) FROM inventory_movements")).scalar()
+            failures = len(verify(conn))
+        print(f"{movements} mouvements, {failures} écart(s) après saisies incrémentales")
+
+        def timed(label, call):
+            clear_cache()
+            start = time.perf_counter()
+            result = call()
+            print(f"{label:42} {(time.perf_counter() - start) * 1000:8.1f} ms")
+            return result
+
+        timed("stock courant, recalcul complet", lambda: read_sql(engine, LEVELS_SELECT))
+        timed("stock courant, stock_levels", lambda: current_stock(engine))
+        timed("stock d'un produit, stock_levels", lambda: current_stock(engine, "Dépôt 1", "Produit 42"))
+        for day in ("2022-06-15", "2023-11-30", "2024-12-20"):
+            full = timed(f"stock au {day}, recalcul complet", lambda: read_sql(engine, f"""
+                SELECT COALESCE(depot, '') AS depot, COALESCE(product, '') AS product,
+                       SUM({SIGNED_QUANTITY}) AS quantity
+                FROM inventory_movements WHERE date <= :day
+                GROUP BY COALESCE(depot, ''), COALESCE(product, '') ORDER BY depot, product
+            """, {"day": day}))
+            fast = timed(f"stock au {day}, point de contrôle", lambda: stock_at(engine, day))
+            if full.values.tolist() != fast.values.tolist():
+                print(f"❌ stock au {day} différent du recalcul complet")
+                failures += 1
+        return 1 if failures else 0
+    finally:
+        dispose_engines()
+        for name in os.listdir(tmpdir):
+            os.remove(os.path.join(tmpdir, name))
+        os.rmdir(tmpdir)
+
+
+def main(argv):
+    argv = list(argv)
+    rows = 200_000
+    if "--rows" in argv:
+        i = argv.index("--rows")
+        rows = int(argv[i + 1])
+        del argv[i:i + 2]
+    if argv[:1] == ["bench"]:
+        return bench(rows)
+
+    from db_utils import get_engine
+
+    commands = ("reconcile", "verify", "at")
+    args = [a for a in argv if a not in commands]
+    url = args[0] if args and "://" in args[0] else "sqlite:///supermarket.db"
+    engine = get_engine(url)
+
+    if "at" in argv:
+        day = argv[argv.index("at") + 1]
+        print(stock_at(engine, day).to_string(index=False))
+        return 0
+    if "reconcile" in argv:
+        differences = reconcile(engine)
+        label = "corrigé(s)"
+    else:
+        with engine.connect() as conn:
+            differences = verify(conn)
+        label = ""
+    for table, checkpoint, depot, product, expected, found in differences[:50]:
+        print(f"❌ {table} {checkpoint or ''} {depot} / {product} : attendu {expected}, trouvé {found}")
+    print(f"{len(differences)} écart(s) {label}".rstrip() + ".")
+    return 1 if differences and "reconcile" not in argv else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,25 +1,9 @@
-import sqlite3
+import sys
 
-# Connexion à la base
-conn = sqlite3.connect("supermarket.db")
-cursor = conn.cursor()
+from db_migrations import DEFAULT_URL, main
 
-# Colonnes à vérifier
-required_columns = {
-    "purchase_price": "REAL",
-    "sale_price": "REAL"
-}
-
-# Récupérer les colonnes existantes
-cursor.execute("PRAGMA table_info(purchases)")
-existing_columns = [col[1] for col in cursor.fetchall()]
-
-# Ajouter les colonnes manquantes
-for col, col_type in required_columns.items():
-    if col not in existing_columns:
-        cursor.execute(f"ALTER TABLE purchases ADD COLUMN {col} {col_type}")
-        print(f"✅ Colonne '{col}' ajoutée.")
-
-conn.commit()
-conn.close()
-print("✅ Mise à jour terminée.")
+# Mise à jour du schéma de la base SQLite (ou de l'url passée en argument).
+# Les colonnes manquantes sont désormais gérées par les migrations numérotées
+# de db_migrations.py, suivies dans la table schema_version.
+if __name__ == "__main__":
+    main(sys.argv[1:] or [DEFAULT_URL])
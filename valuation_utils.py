@@ -0,0 +1,405 @@
+# valuation_utils.py
+# Valorisation du stock et coût des sorties (COGS) à partir de
+# inventory_movements, par (dépôt, produit), en FIFO ou au coût moyen
+# pondéré (« wac »). Les mouvements sont rejoués par ordre de date ; l'état
+# de chaque mois clos (couches de coût restantes) est gardé en base, donc
+# clore un nouveau mois ne relit que les mouvements de ce mois. Un mouvement
+# saisi dans un mois déjà clos rouvre ce mois et les suivants.
+# Usage : python valuation_utils.py [url] close|rebuild [--method fifo|wac]
+#         python valuation_utils.py check [--rows 200000]
+
+import sys
+import threading
+import time
+from collections import deque
+from datetime import date as date_type
+
+import pandas as pd
+from sqlalchemy import text
+
+from cache_utils import bump_table_version, clear_cache, read_sql, table_versions
+
+METHODS = ("fifo", "wac")
+
+# Par mois et (dépôt, produit) : entrées, sorties valorisées, sorties sans
+# stock (non valorisées) et stock de clôture
+MONTH_COLUMNS = [
+    "entries_qty", "entries_value", "exits_qty", "cogs", "short_qty", "closing_qty", "closing_value",
+]
+
+MONTH_MOVEMENTS = """
+    SELECT COALESCE(depot, '') AS depot, COALESCE(product, '') AS product, movement_type,
+           COALESCE(quantity, 0) AS quantity, COALESCE(price, 0) AS price
+    FROM inventory_movements
+    WHERE date >= :start AND date < :end
+    ORDER BY date, CASE movement_type WHEN 'entry' THEN 0 ELSE 1 END, id
+"""
+
+_live = {}
+_lock = threading.Lock()
+
+
+def create_tables(conn):
+    """Crée valuation_closes, valuation_months et valuation_layers."""
+    money = "REAL" if conn.dialect.name == "sqlite" else "NUMERIC"
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS valuation_closes (
+            method TEXT NOT NULL,
+            month TEXT NOT NULL,
+            closed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (method, month)
+        )
+    """))
+    columns = ",\n            ".join(
+        f"{c} {'INTEGER' if c.endswith('_qty') else money} NOT NULL DEFAULT 0" for c in MONTH_COLUMNS
+    )
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS valuation_months (
+            method TEXT NOT NULL,
+            month TEXT NOT NULL,
+            depot TEXT NOT NULL,
+            product TEXT NOT NULL,
+            {columns},
+            PRIMARY KEY (method, month, depot, product)
+        )
+    """))
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS valuation_layers (
+            method TEXT NOT NULL,
+            month TEXT NOT NULL,
+            depot TEXT NOT NULL,
+            product TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            unit_cost {money} NOT NULL,
+            PRIMARY KEY (method, month, depot, product, seq)
+        )
+    """))
+
+
+def movement_inserted(conn, row):
+    """À appeler dans la transaction qui insère le mouvement : rouvre son mois s'il était clos."""
+    if row.get("date") is None:
+        return
+    month = str(row["date"])[:7]
+    reopened = conn.execute(
+        text("DELETE FROM valuation_closes WHERE month >= :month"), {"month": month}
+    ).rowcount
+    if reopened:
+        conn.execute(text("DELETE FROM valuation_months WHERE month >= :month"), {"month": month})
+        conn.execute(text("DELETE FROM valuation_layers WHERE month >= :month"), {"month": month})
+        bump_table_version(conn, "valuation")
+
+
+# --- Moteur ---
+
+def _next_month(month):
+    year, number = int(month[:4]), int(month[5:7])
+    return f"{year + number // 12}-{number % 12 + 1:02d}"
+
+
+def _months(first, last):
+    months = []
+    while first <= last:
+        months.append(first)
+        first = _next_month(first)
+    return months
+
+
+def _apply(state, method, movements):
+    """
+    Rejoue les mouvements d'un mois sur `state` ({(dépôt, produit): couches
+    [quantité, coût unitaire]}, une seule couche en coût moyen).
+    Retourne {(dépôt, produit): [entries_qty, entries_value, exits_qty, cogs, short_qty]}.
+    """
+    stats = {}
+    for depot, product, movement_type, quantity, price in movements:
+        key = (depot, product)
+        layers = state.get(key)
+        if layers is None:
+            layers = state[key] = deque()
+        row = stats.get(key)
+        if row is None:
+            row = stats[key] = [0, 0.0, 0, 0.0, 0]
+        quantity, price = int(quantity), float(price)
+
+        if movement_type == "entry":
+            row[0] += quantity
+            row[1] += quantity * price
+            if method == "fifo" or not layers:
+                layers.append([quantity, price])
+            else:
+                held, cost = layers[0]
+                total = held + quantity
+                layers[0] = [total, (held * cost + quantity * price) / total if total else price]
+        elif movement_type == "exit":
+            while quantity > 0 and layers:
+                layer = layers[0]
+                taken = min(layer[0], quantity)
+                layer[0] -= taken
+                quantity -= taken
+                row[2] += taken
+                row[3] += taken * layer[1]
+                if layer[0] <= 0:
+                    layers.popleft()
+            row[4] += quantity
+    return stats
+
+
+def _month_rows(state, stats):
+    """Lignes du mois : clés actives ce mois-ci ou avec du stock restant."""
+    rows = {}
+    for key in stats.keys() | {k for k, layers in state.items() if layers}:
+        layers = state.get(key) or ()
+        activity = stats.get(key, [0, 0.0, 0, 0.0, 0])
+        rows[key] = activity + [sum(q for q, _ in layers), sum(q * c for q, c in layers)]
+    return rows
+
+
+def _last_close(conn, method):
+    return conn.execute(
+        text("SELECT MAX(month) FROM valuation_closes WHERE method = :method"), {"method": method}
+    ).scalar()
+
+
+def _load_state(conn, method, month):
+    state = {}
+    if month is None:
+        return state
+    for depot, product, quantity, unit_cost in conn.execute(text("""
+        SELECT depot, product, quantity, unit_cost FROM valuation_layers
+        WHERE method = :method AND month = :month ORDER BY depot, product, seq
+    """), {"method": method, "month": month}):
+        state.setdefault((depot, product), deque()).append([int(quantity), float(unit_cost)])
+    return state
+
+
+def _roll(conn, method, last_closed, through):
+    """
+    Rejoue les mois après `last_closed` jusqu'à `through` inclus à partir de
+    l'état figé ; génère (mois, lignes, état) mois par mois.
+    """
+    state = _load_state(conn, method, last_closed)
+    if last_closed is None:
+        first = conn.execute(text("SELECT MIN(date) FROM inventory_movements")).scalar()
+        if first is None:
+            return
+        start = str(first)[:7]
+    else:
+        start = _next_month(last_closed)
+    for month in _months(start, through):
+        movements = conn.execute(
+            text(MONTH_MOVEMENTS), {"start": f"{month}-01", "end": f"{_next_month(month)}-01"}
+        )
+        stats = _apply(state, method, movements)
+        yield month, _month_rows(state, stats), state
+
+
+def close_months(engine, methods=METHODS, today=None):
+    """
+    Tâche de fin de mois : clôt les mois complets pas encore clos (jusqu'au
+    mois précédant `today`) pour chaque méthode. Retourne {méthode: [mois clos]}.
+    """
+    from db_utils import begin_write
+
+    through = _previous_month(today)
+    closed = {}
+    with begin_write(engine) as conn:
+        for method in methods:
+            closed[method] = []
+            for month, rows, state in _roll(conn, method, _last_close(conn, method), through):
+                _save_month(conn, method, month, rows, state)
+                closed[method].append(month)
+        if any(closed.values()):
+            bump_table_version(conn, "valuation")
+    return closed
+
+
+def _previous_month(today=None):
+    today = today or date_type.today()
+    return f"{today.year - 1}-12" if today.month == 1 else f"{today.year}-{today.month - 1:02d}"
+
+
+def _save_month(conn, method, month, rows, state):
+    if rows:
+        conn.execute(text(f"""
+            INSERT INTO valuation_months (method, month, depot, product, {", ".join(MONTH_COLUMNS)})
+            VALUES (:method, :month, :depot, :product, {", ".join(":" + c for c in MONTH_COLUMNS)})
+        """), [
+            {"method": method, "month": month, "depot": depot, "product": product, **dict(zip(MONTH_COLUMNS, values))}
+            for (depot, product), values in rows.items()
+        ])
+    layers = [
+        {"method": method, "month": month, "depot": depot, "product": product,
+         "seq": seq, "quantity": quantity, "unit_cost": unit_cost}
+        for (depot, product), key_layers in state.items()
+        for seq, (quantity, unit_cost) in enumerate(key_layers)
+    ]
+    if layers:
+        conn.execute(text("""
+            INSERT INTO valuation_layers (method, month, depot, product, seq, quantity, unit_cost)
+            VALUES (:method, :month, :depot, :product, :seq, :quantity, :unit_cost)
+        """), layers)
+    conn.execute(text("INSERT INTO valuation_closes (method, month) VALUES (:method, :month)"),
+                 {"method": method, "month": month})
+
+
+def rebuild(engine, methods=METHODS, today=None):
+    """Efface toutes les clôtures puis reclôt les mois complets."""
+    from db_utils import begin_write
+
+    with begin_write(engine) as conn:
+        for method in methods:
+            for table in ("valuation_closes", "valuation_months", "valuation_layers"):
+                conn.execute(text(f"DELETE FROM {table} WHERE method = :method"), {"method": method})
+        bump_table_version(conn, "valuation")
+    return close_months(engine, methods, today)
+
+
+# --- Lectures ---
+
+def _frame(rows_by_month):
+    records = [
+        (month, depot, product, *values)
+        for month, rows in rows_by_month
+        for (depot, product), values in rows.items()
+    ]
+    return pd.DataFrame(records, columns=["month", "depot", "product", *MONTH_COLUMNS])
+
+
+def _open_months(engine, method, today):
+    # Mois non clos (dont le mois en cours) rejoués depuis le dernier état figé
+    today = today or date_type.today()
+    key = (engine.url, method, today)
+    versions = table_versions(engine, ("inventory_movements", "valuation"))
+    with _lock:
+        cached = _live.get(key)
+        if cached and cached[0] == versions:
+            return cached[1]
+    with engine.connect() as conn:
+        last_movement = conn.execute(text("SELECT MAX(date) FROM inventory_movements")).scalar()
+        through = max(today.strftime("%Y-%m"), str(last_movement)[:7] if last_movement else "")
+        frame = _frame(
+            (month, rows) for month, rows, _ in _roll(conn, method, _last_close(conn, method), through)
+        )
+    with _lock:
+        _live[key] = (versions, frame)
+    return frame
+
+
+def valuation(engine, method="fifo", today=None):
+    """
+    Une ligne par mois et (dépôt, produit), avec la catégorie du dernier
+    achat du produit : entrées, COGS, sorties sans stock, stock de clôture.
+    Mois clos lus en base, mois suivants rejoués à la volée.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Méthode inconnue : {method} (attendu : {', '.join(METHODS)})")
+    closed = read_sql(engine, f"""
+        SELECT month, depot, product, {", ".join(MONTH_COLUMNS)}
+        FROM valuation_months WHERE method = :method
+    """, {"method": method}, tables=("valuation",))
+    frames = [f for f in (closed, _open_months(engine, method, today)) if not f.empty]
+    if not frames:
+        return pd.DataFrame(columns=["month", "depot", "product", "category", *MONTH_COLUMNS])
+    df = pd.concat(frames, ignore_index=True)
+    categories = read_sql(engine, """
+        SELECT p.product, COALESCE(p.category, '') AS category FROM purchases p
+        JOIN (SELECT product, MAX(id) AS id FROM purchases GROUP BY product) AS last ON last.id = p.id
+    """, tables=("purchases",))
+    df = df.merge(categories, on="product", how="left")
+    df["category"] = df["category"].fillna("")
+    return df.sort_values(["month", "depot", "product"]).reset_index(drop=True)
+
+
+def valuation_summary(engine, method="fifo", by="depot", today=None):
+    """Valorisation et COGS par mois et `by` ("depot" ou "category")."""
+    df = valuation(engine, method, today)
+    return df.groupby(["month", by], as_index=False)[MONTH_COLUMNS].sum()
+
+
+# --- Contrôle ---
+
+def check(rows=200_000):
+    """
+    Sur une base SQLite temporaire : clôtures successives, mouvement antidaté,
+    puis comparaison avec un rejeu complet sans point de contrôle.
+    """
+    import os
+    import tempfile
+
+    from db_utils import begin_write, dispose_engines, get_engine
+    from query_plans import seed_synthetic
+    from repository import get_repository
+
+    tmpdir = tempfile.mkdtemp()
+    failures = 0
+    try:
+        engine = get_engine(f"sqlite:///{os.path.join(tmpdir, 'valuation.db')}")
+        with begin_write(engine) as conn:
+            seed_synthetic(conn, rows)
+        repository = get_repository(engine)
+
+        close_months(engine, today=date_type(2024, 6, 15))
+        repository.add_movement("Produit 7", "Dépôt 1", "entry", 40, 3.5, date_type(2023, 2, 10))
+        start = time.perf_counter()
+        reclosed = close_months(engine, today=date_type(2024, 12, 15))
+        print(f"mouvement antidaté 2023-02 : {len(reclosed['fifo'])} mois reclos en {time.perf_counter() - start:.2f} s")
+
+        start = time.perf_counter()
+        close_months(engine, today=date_type(2025, 1, 15))
+        print(f"clôture d'un nouveau mois (2024-12) : {(time.perf_counter() - start) * 1000:.0f} ms (2 méthodes)")
+
+        for method in METHODS:
+            clear_cache()
+            incremental = valuation(engine, method, date_type(2025, 1, 15))
+            with engine.connect() as conn:
+                start = time.perf_counter()
+                full = _frame((m, r) for m, r, _ in _roll(conn, method, None, "2025-01"))
+                seconds = time.perf_counter() - start
+            merged = incremental.merge(full, on=["month", "depot", "product"], how="outer",
+                                       suffixes=("", "_full"), indicator=True)
+            gaps = (merged["_merge"] != "both").sum()
+            for column in MONTH_COLUMNS:
+                gaps += ((merged[column] - merged[f"{column}_full"]).abs() > 0.005).sum()
+            failures += int(gaps)
+            totals = incremental.groupby("month")[["cogs", "closing_value"]].sum()
+            print(f"{method} : rejeu complet {seconds:.2f} s · {len(incremental)} lignes · {gaps} écart(s) · "
+                  f"COGS total {totals['cogs'].sum():.2f} · stock fin 2024-12 {totals.loc['2024-12', 'closing_value']:.2f}")
+        return 1 if failures else 0
+    finally:
+        dispose_engines()
+        for name in os.listdir(tmpdir):
+            os.remove(os.path.join(tmpdir, name))
+        os.rmdir(tmpdir)
+
+
+def main(argv):
+    argv = list(argv)
+    options = {}
+    for flag in ("--method", "--rows"):
+        if flag in argv:
+            i = argv.index(flag)
+            options[flag] = argv[i + 1]
+            del argv[i:i + 2]
+    if argv[:1] == ["check"]:
+        return check(int(options.get("--rows", 200_000)))
+
+    from db_utils import get_engine
+
+    commands = ("close", "rebuild")
+    args = [a for a in argv if a not in commands]
+    url = args[0] if args else "sqlite:///supermarket.db"
+    engine = get_engine(url)
+    methods = (options["--method"],) if "--method" in options else METHODS
+    if "rebuild" in argv:
+        closed = rebuild(engine, methods)
+    else:
+        closed = close_months(engine, methods)
+    for method, months in closed.items():
+        print(f"{method} : {len(months)} mois clos" + (f" ({months[0]} → {months[-1]})" if months else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
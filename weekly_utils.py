@@ -0,0 +1,180 @@
+# weekly_utils.py
+# Comparaison hebdomadaire des achats (pages/ineev.py) calculée par la base :
+# un calendrier des jours comparés (N semaines, un ou plusieurs jours de la
+# semaine) lu sur l'index purchases(date), agrégé par clés (produit,
+# catégorie, fournisseur), puis LAG/LEAD par jour de semaine pour l'écart
+# avec la semaine précédente. Une seule requête, quel que soit N.
+# Usage : python weekly_utils.py [url] [--weeks 52] [--end 2025-07-31]
+
+import sys
+import time
+from datetime import date as date_type, timedelta
+
+import pandas as pd
+
+from cache_utils import read_sql
+from db_utils import purchase_cost_sql
+
+KEYS = ("product", "category", "supplier")
+WEEKDAYS = tuple(range(7))        # 0 = lundi, comme datetime.weekday()
+
+
+def comparison_dates(end, weeks=4, weekdays=WEEKDAYS):
+    """Jours comparés, du plus récent au plus ancien : `weeks` semaines finissant à `end`."""
+    weekdays = set(weekdays)
+    days = (end - timedelta(days=i) for i in range(7 * weeks))
+    return [day for day in days if day.weekday() in weekdays]
+
+
+def _dialect_sql(engine):
+    # Dates TEXT 'YYYY-MM-DD' sous SQLite, DATE sous PostgreSQL
+    if engine.dialect.name == "sqlite":
+        return {
+            "first": "date(:start)",
+            "next": "date(day, '+1 day')",
+            "weekday": "(CAST(strftime('%w', day) AS INTEGER) + 6) % 7",
+            "week_before": "date(day, '-7 day')",
+            "week_after": "date(day, '+7 day')",
+        }
+    return {
+        "first": "CAST(:start AS DATE)",
+        "next": "CAST(day + 1 AS DATE)",
+        "weekday": "(CAST(EXTRACT(DOW FROM day) AS INTEGER) + 6) % 7",
+        "week_before": "CAST(day - 7 AS DATE)",
+        "week_after": "CAST(day + 7 AS DATE)",
+    }
+
+
+def comparison_sql(engine, by=KEYS, weekdays=WEEKDAYS):
+    """Requête de weekly_comparison (paramètres :start, :first, :end)."""
+    unknown = set(by) - set(KEYS)
+    if unknown:
+        raise ValueError(f"Clés de regroupement inconnues : {sorted(unknown)}")
+    weekdays = sorted({int(w) for w in weekdays})
+    if not weekdays or weekdays[0] < 0 or weekdays[-1] > 6:
+        raise ValueError("Jours de la semaine attendus entre 0 (lundi) et 6 (dimanche)")
+    with engine.connect() as conn:
+        cost = purchase_cost_sql(conn)
+    sql = _dialect_sql(engine)
+
+    # Clés vides -> '' pour que les partitions regroupent bien les lignes
+    key_totals = "".join(f", COALESCE(p.{k}, '') AS {k}" for k in by)
+    key_group = "".join(f", COALESCE(p.{k}, '')" for k in by)
+    keys = "".join(f", {k}" for k in by)
+    partition = ", ".join([*by, "weekday"])
+
+    # Seuls les jours non nuls sont agrégés : LAG donne la semaine précédente
+    # quand elle existe, LEAD repère les semaines suivantes retombées à zéro
+    # (ajoutées par le second SELECT avec total = 0).
+    return f"""
+        WITH RECURSIVE spine(day) AS (
+            SELECT {sql['first']}
+            UNION ALL
+            SELECT {sql['next']} FROM spine WHERE day < :end
+        ),
+        days AS (
+            SELECT day, {sql['weekday']} AS weekday FROM spine
+            WHERE {sql['weekday']} IN ({", ".join(map(str, weekdays))})
+        ),
+        totals AS (
+            SELECT d.day, d.weekday{key_totals}, SUM(p.quantity * {cost}) AS total
+            FROM days d
+            JOIN purchases p ON p.date = d.day
+            GROUP BY d.day, d.weekday{key_group}
+        ),
+        compared AS (
+            SELECT totals.*,
+                   {sql['week_before']} AS week_before,
+                   {sql['week_after']} AS week_after,
+                   LAG(day) OVER w AS previous_day,
+                   LAG(total) OVER w AS previous_total,
+                   LEAD(day) OVER w AS next_day
+            FROM totals
+            WINDOW w AS (PARTITION BY {partition} ORDER BY day)
+        ),
+        weekly AS (
+            SELECT day, weekday{keys}, total,
+                   CASE WHEN previous_day = week_before THEN previous_total ELSE 0 END AS previous
+            FROM compared
+            WHERE day >= :first
+            UNION ALL
+            SELECT week_after, weekday{keys}, 0, total
+            FROM compared
+            WHERE (next_day IS NULL OR next_day <> week_after)
+              AND week_after >= :first AND week_after <= :end
+        )
+        SELECT day AS date, weekday{keys}, total, previous,
+               total - previous AS delta,
+               CASE WHEN previous <> 0 THEN (total - previous) * 100.0 / previous END AS variation
+        FROM weekly
+        WHERE total <> 0 OR previous <> 0
+        ORDER BY {", ".join([*by, "day DESC"])}
+    """
+
+
+def comparison_params(engine, end, weeks=4):
+    """Paramètres :start, :first, :end de comparison_sql pour `weeks` semaines finissant à `end`."""
+    first = end - timedelta(days=7 * weeks - 1)
+    start = first - timedelta(days=7)     # semaine de plus pour le LAG de la plus ancienne
+    bind = (lambda d: d.isoformat()) if engine.dialect.name == "sqlite" else (lambda d: d)
+    return {"start": bind(start), "first": bind(first), "end": bind(end)}
+
+
+def weekly_comparison(engine, end, weeks=4, weekdays=WEEKDAYS, by=KEYS):
+    """
+    Total des achats par jour comparé au même jour de la semaine précédente.
+    Une ligne par (clés `by`, date) non nulle sur les `weeks` semaines
+    finissant à `end` : total, previous, delta, variation (%, vide si la
+    semaine précédente est à zéro). Avec by=() : un total par jour.
+    """
+    df = read_sql(
+        engine, comparison_sql(engine, by, weekdays), comparison_params(engine, end, weeks),
+        tables=("purchases",),
+    )
+    df["date"] = pd.to_datetime(df["date"]).dt.date
+    for column in ("total", "previous", "delta", "variation"):
+        df[column] = pd.to_numeric(df[column])
+    return df
+
+
+def comparison_matrix(df, dates, by=KEYS, column="total"):
+    """Matrice compacte : une ligne par clé (ou une seule sans clés), une colonne par date de `dates`."""
+    if by:
+        matrix = df.pivot_table(index=list(by), columns="date", values=column, aggfunc="sum", fill_value=0)
+    else:
+        matrix = df.set_index("date")[[column]].T
+    return matrix.reindex(columns=dates, fill_value=0)
+
+
+def weekday_matrix(df, column="total"):
+    """Totaux par jour (weekly_comparison avec by=()) en matrice jour de la semaine x semaine (lundi)."""
+    weeks = df["date"].map(lambda d: d - timedelta(days=d.weekday()))
+    matrix = df.assign(week=weeks).pivot_table(index="weekday", columns="week", values=column, aggfunc="sum")
+    return matrix.reindex(index=list(WEEKDAYS)).sort_index(axis=1, ascending=False)
+
+
+def main(argv):
+    from db_utils import get_engine
+
+    argv = list(argv)
+    options = {}
+    for flag in ("--weeks", "--end"):
+        if flag in argv:
+            i = argv.index(flag)
+            options[flag] = argv[i + 1]
+            del argv[i:i + 2]
+    url = argv[0] if argv else "sqlite:///supermarket.db"
+    weeks = int(options.get("--weeks", 52))
+    end = date_type.fromisoformat(options["--end"]) if "--end" in options else date_type.today()
+    engine = get_engine(url)
+
+    for label, by in (("totaux 7 jours", ()), ("détail produit/catégorie/fournisseur", KEYS)):
+        start = time.perf_counter()
+        df = weekly_comparison(engine, end, weeks, WEEKDAYS, by)
+        print(f"{weeks} semaines x 7 jours, {label} : {len(df)} lignes en {(time.perf_counter() - start) * 1000:.1f} ms")
+    print(weekday_matrix(weekly_comparison(engine, end, weeks, WEEKDAYS, ())).fillna(0).round(2).to_string())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))